@@ -1,8 +1,16 @@
 import argparse
+import concurrent.futures
+import os
+import sys
+from typing import List
+import bundle
 import display
+import exporter
+import headless
 import logs
 import m3u8
 import monitoring
+import streams
 
 class EnableBooleanAction(argparse.Action):
     def __init__(self, option_strings, dest, nargs=None, **kwargs):
@@ -13,7 +21,45 @@ class EnableBooleanAction(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
         setattr(namespace, self.dest, True)
 
-def main(url: str, limit: int, speed_limit: int, save_files: str):
+def load_master(url: str) -> m3u8.M3U8:
+    # master playlist, a media playlist is wrapped into a master with 1 stream; None if it cannot be loaded (see logs)
+    master_playlist = m3u8.load_and_parse_master(url)
+
+    # Check if it is indeed a master playlist
+    if master_playlist is None:
+        #raise ValueError('The provided m3u8 file is not a master playlist or cannot be downloaded (see logs).')
+        logs.write_error(f"Master manifest ({url}) is not an URL or cannot be loaded.")
+        logs.print_error(f'The provided m3u8 file ({url}) is not a master playlist or cannot be downloaded (see logs).')
+        return None
+    elif master_playlist.Type == m3u8.TypeM3U8.MASTER:
+        pass
+    elif master_playlist.Type == m3u8.TypeM3U8.VIDEO:
+        #create a fake master playlist
+        master_playlist.Type = m3u8.TypeM3U8.MASTER
+        master_playlist.Media_Streams.append(m3u8.MediaStream(master_playlist.URI, 0, "Undefined", "Undefined"))
+        logs.write_warning(f"Provided manifest ({url}) is a media manifest instead of master. So will be used as master with 1 stream inside.")
+    else:
+        # if status != 200 or type is other that manifest
+        msg = f"Master manifest ({url}) is not an URL of manifest or cannot be loaded. Status = {master_playlist.FileDownloaded.HTTP_code}, {master_playlist.FileDownloaded.Status}"
+        logs.write_error(msg)
+        logs.print_error(msg)
+        return None
+    return master_playlist
+
+def load_streams(config: streams.MonitoringConfig, config_path: str) -> tuple[m3u8.M3U8, List[streams.MonitoredRendition]]:
+    # master playlists of all streams are loaded in parallel, streams which cannot be loaded are skipped (see logs);
+    # the returned playlist lists selected renditions of all streams in order of media indexes
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(config.Streams), config.Workers), thread_name_prefix="Master") as executor:
+        master_playlists = list(executor.map(load_master, [stream.URL for stream in config.Streams]))
+    renditions = streams.select_renditions([(stream, master_playlist) for stream, master_playlist in zip(config.Streams, master_playlists) if master_playlist is not None])
+
+    all_streams = m3u8.M3U8(m3u8.TypeM3U8.MASTER)
+    all_streams.URI = config_path
+    all_streams.Name = os.path.basename(config_path)
+    all_streams.Media_Streams = [r.Media for r in renditions]
+    return all_streams, renditions
+
+def main(url: str, limit: int, speed_limit: int, save_files: str, engine: monitoring.MonitoringEngine = monitoring.MonitoringEngine.THREAD, protocol: m3u8.HttpProtocol = m3u8.HttpProtocol.H1, delta: bool = False, events_ram_mb: int = 64, events_dir: str = None, headless_mode: bool = False, summary_interval: float = 60.0, log_format: logs.LogFormat = logs.LogFormat.CSV, config_path: str = None, processes: int = 1, bundle_path: str = None, probe: str = None, metrics_port: int = 0, prefetch: bool = False, rendition_reports: bool = False):
 
 #    print(f"Found: {master_playlist.Type}, {master_playlist.Name}, {master_playlist.URI}")
 #
@@ -24,44 +70,64 @@ def main(url: str, limit: int, speed_limit: int, save_files: str):
 #        print(f'Audio {i + 1}: ' +  str(stream))
     
     
-    logs.init_logs()
+    logs.init_logs(log_format)
+    m3u8.set_protocol(protocol)
+    monitoring.set_delta_playlists(delta)
+    monitoring.set_prefetch(prefetch)
+    monitoring.set_rendition_reports(rendition_reports)
+    monitoring.set_event_store(events_ram_mb, events_dir)
+    reporter = headless.HeadlessReporter(summary_interval=summary_interval) if headless_mode else None
+    monitoring.set_headless(reporter)
+    registry = None
+    if metrics_port:
+        # Prometheus/OpenMetrics endpoint, see exporter.py
+        registry = exporter.MetricsRegistry(monitoring.rendition_labels)
+        registry.serve(metrics_port)
+        monitoring.set_metrics(registry)
+    started = bundle.now_text()
     
     try:
-        master_playlist = m3u8.load_and_parse_master(url)
-
-        # Check if it is indeed a master playlist
-        if master_playlist is None:
-            #raise ValueError('The provided m3u8 file is not a master playlist or cannot be downloaded (see logs).')
-            logs.write_error(f"Master manifest ({url}) is not an URL or cannot be loaded.")
-            print(f'The provided m3u8 file ({url}) is not a master playlist or cannot be downloaded (see logs).')
-            return
-        elif master_playlist.Type == m3u8.TypeM3U8.MASTER:
-            pass
-        elif master_playlist.Type == m3u8.TypeM3U8.VIDEO:
-            #create a fake master playlist
-            master_playlist.Type = m3u8.TypeM3U8.MASTER
-            master_playlist.Media_Streams.append(m3u8.MediaStream(master_playlist.URI, 0, "Undefined", "Undefined"))
-            logs.write_warning(f"Provided manifest ({url}) is a media manifest instead of master. So will be used as master with 1 stream inside.")
+        if config_path:
+            # many streams of the config file, renditions of all of them are monitored at once
+            config = streams.load_config(config_path)
+            master_playlist, renditions = load_streams(config, config_path)
+            limit = config.Limit
+            stream_names = [r.Stream.Name for r in renditions]
+            run = lambda: monitoring.coordinator_renditions(renditions, engine, config.Workers, processes)
         else:
-            # if status != 200 or type is other that manifest
-            msg = f"Master manifest ({url}) is not an URL of manifest or cannot be loaded. Status = {master_playlist.FileDownloaded.HTTP_code}, {master_playlist.FileDownloaded.Status}"
-            logs.write_error(msg)
-            print(msg)
-            return
-
-        if master_playlist.Type == m3u8.TypeM3U8.MASTER and len(master_playlist.Media_Streams)>0:
-            display.init_display(master_playlist, limit)
-            monitoring.coordinator(master_playlist, limit)
+            master_playlist = load_master(url)
+            if master_playlist is None:
+                return
+            stream_names = None
+            run = lambda: monitoring.coordinator(master_playlist, limit, engine, processes)
+
+        if reporter is not None and len(master_playlist.Media_Streams)>0:
+            # no terminal: NDJSON requests and periodic summaries to stdout
+            reporter.start(monitoring.headless_summary)
+            run()
+            reporter.stop()
+        elif master_playlist.Type == m3u8.TypeM3U8.MASTER and len(master_playlist.Media_Streams)>0:
+            display.init_display(master_playlist, limit, stream_names)
+            run()
             display.display_getch(True)
             display.display_finish()
             monitoring.display_summary(master_playlist)
+
+        if bundle_path:
+            # summary of this probe to be merged with other probes, see bundle.py
+            bundle.write_bundle(bundle_path, bundle.new_bundle(probe, started, {
+                "url": url, "config": config_path, "engine": str(engine), "protocol": str(protocol), "delta": delta, "prefetch": prefetch, "rendition_reports": rendition_reports, "processes": processes,
+            }, monitoring.bundle_renditions()))
         pass
     except Exception as e:
         # Handle exceptions and print the error message
-        print(f"An error occurred: {e}")
+        logs.print_error(f"An error occurred: {e}")
         logs.write_exception(e)
     finally:
         display.display_finish()
+        monitoring.close_event_store()
+        if registry is not None:
+            registry.stop()
 
     
 
@@ -69,11 +135,20 @@ def main(url: str, limit: int, speed_limit: int, save_files: str):
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "merge":
+        # python app.py merge a.json.gz b.json.gz ... = comparative report of result bundles of many probes
+        merge_parser = argparse.ArgumentParser(prog="app.py merge", description="Merge result bundles (--bundle) of many probes into one comparative report")
+        merge_parser.add_argument('bundles', type=str, nargs='+', help='result bundles (.json.gz)')
+        merge_parser.add_argument('--output', type=str, default=None, help='save the merged bundle, it can be merged again (default is only the report)')
+        merge_args = merge_parser.parse_args(sys.argv[2:])
+        bundle.merge_command(merge_args.bundles, merge_args.output)
+        sys.exit(0)
+
     # Create the parser
     parser = argparse.ArgumentParser(description="Script to handle URL, speed-limit, and save-files parameters")
 
     # Add the URL parameter (required, without modifiers)
-    parser.add_argument('URL', type=str, help='Manifest URL .m3u8 (required)')
+    parser.add_argument('URL', type=str, nargs='?', default=None, help='Manifest URL .m3u8 (required without --config)')
 
     # Add the speed-limit parameter (optional, with default value of 0)
     parser.add_argument('--limit', type=int, default=100, help='limit on the number of download repetitions (integer, default is 100)')
@@ -84,14 +159,70 @@ if __name__ == "__main__":
     # Add the save-files parameter (optional boolean, default value is True)
     parser.add_argument('--save-files', action=EnableBooleanAction, default=False, help='Flag to save files (default is False) – not implemented')
 
+    # Add the engine parameter (optional, thread pools by default)
+    parser.add_argument('--engine', type=str, choices=[e.value for e in monitoring.MonitoringEngine], default=monitoring.MonitoringEngine.THREAD.value, help='Monitoring engine: thread = thread pool per rendition, async = one asyncio event loop for all renditions (default is thread)')
+
+    # Add the protocol parameter (optional, HTTP1 by default)
+    parser.add_argument('--protocol', type=str, choices=[p.value for p in m3u8.HttpProtocol], default=m3u8.HttpProtocol.H1.value, help='HTTP protocol for manifests, parts and init files: h1 or h2 (default is h1)')
+
+    # Add the delta parameter (optional boolean, full playlists by default)
+    parser.add_argument('--delta', action=EnableBooleanAction, default=False, help='Request delta playlists (_HLS_skip=YES|v2) if the server advertises CAN-SKIP-UNTIL (default is False)')
+
+    # Add the prefetch parameter (optional boolean, parts are requested after the playlist by default)
+    parser.add_argument('--prefetch', action=EnableBooleanAction, default=False, help='Request the part of EXT-X-PRELOAD-HINT together with the blocking playlist request for it, as LL-HLS players do, and report which one was available first (default is False)')
+
+    # Add the rendition reports parameter (optional boolean, a non-blocking first request of every rendition by default)
+    parser.add_argument('--rendition-reports', action=EnableBooleanAction, default=False, help='Start every rendition with a blocking request at the live edge from EXT-X-RENDITION-REPORT of one playlist of the stream, and report how far renditions lag behind the leader (default is False)')
+
+    # Add the event store parameters (optional, 64 MB of RAM and a temporary spill directory by default)
+    parser.add_argument('--events-ram-mb', type=int, default=64, help='RAM budget (MB) of the per-request event store, older events are spilled to memory-mapped files; 0 = no store, summary from quantile sketches (default is 64)')
+    parser.add_argument('--events-dir', type=str, default=None, help='directory to keep events as .npy columns for post-run analysis, see events.load_event_store() (default is a temporary directory removed on exit)')
+
+    # Add the headless parameters (optional, curses display by default)
+    parser.add_argument('--headless', action=EnableBooleanAction, default=False, help='No display and no curses: every request and periodic summaries are written to stdout as NDJSON (default is False)')
+    parser.add_argument('--summary-interval', type=float, default=60.0, help='Seconds between summaries in headless mode, 0 = only the final summary (default is 60)')
+
+    # Add the config parameter (optional, one URL by default)
+    parser.add_argument('--config', type=str, default=None, help='JSON file with many streams to monitor in one process, with rendition filters, limits and thresholds per stream (format is described at the top of streams.py); URL and --limit are not used')
+
+    # Add the processes parameter (optional, one process by default)
+    parser.add_argument('--processes', type=int, default=1, help='Worker processes to shard streams across CPU cores, this process draws the display and merges the summary; renditions of a stream stay in one worker (they share its publish clock), so there are at most as many workers as streams; 1 = all renditions in this process (default is 1)')
+
+    # Add the result bundle parameters (optional, no bundle by default)
+    parser.add_argument('--bundle', type=str, default=None, help='save a result bundle (.json.gz) with counts and histograms of every rendition, see "app.py merge" (default is no bundle)')
+    parser.add_argument('--probe', type=str, default=None, help='name of the probe location in the result bundle (default is the host name)')
+
+    # Add the metrics parameter (optional, no endpoint by default)
+    parser.add_argument('--metrics-port', type=int, default=0, help='serve Prometheus/OpenMetrics histograms and counters of requests at http://<host>:<port>/metrics while monitoring (see exporter.py); 0 = no endpoint (default is 0)')
+
+    # Add the log format parameter (optional, csv by default)
+    parser.add_argument('--log-format', type=str, choices=[f.value for f in logs.LogFormat], default=logs.LogFormat.CSV.value, help='Format of records in logs/: csv or ndjson, written by a background thread (default is csv)')
+
     # Parse the arguments
     args = parser.parse_args()
+    if args.URL is None and args.config is None:
+        parser.error("URL or --config is required")
 
     # Access the arguments
     url = args.URL
     limit = args.limit
     speed_limit = args.speed_limit
     save_files = args.save_files
+    engine = monitoring.MonitoringEngine(args.engine)
+    protocol = m3u8.HttpProtocol(args.protocol)
+    delta = args.delta
+    prefetch = args.prefetch
+    rendition_reports = args.rendition_reports
+    events_ram_mb = args.events_ram_mb
+    events_dir = args.events_dir
+    headless_mode = args.headless
+    summary_interval = args.summary_interval
+    log_format = logs.LogFormat(args.log_format)
+    config_path = args.config
+    processes = args.processes
+    bundle_path = args.bundle
+    probe = args.probe
+    metrics_port = args.metrics_port
 
     #url = "https://demo.gvideo.io/cmaf/2675_19146/master.m3u8"
     #url = "https://demo.gvideo.io/cmaf/2675_19146/media_0.m3u8"
@@ -99,11 +230,21 @@ if __name__ == "__main__":
     #speed_limit = 0
     #save_files = False
 
-    # Print the values
-    print(f'URL: {url}')
-    print(f'Limit: {limit}')
-    print(f'Speed limit: {speed_limit} Kbps – not implemented')
-    print(f'Save files: {save_files} – not implemented')
+    # Print the values (stdout is NDJSON in headless mode)
+    if not headless_mode:
+        print(f'URL: {url}' if config_path is None else f'Config: {config_path}')
+        print(f'Limit: {limit}' if config_path is None else 'Limit: see config')
+        print(f'Speed limit: {speed_limit} Kbps – not implemented')
+        print(f'Save files: {save_files} – not implemented')
+        print(f'Engine: {engine}')
+        print(f'Protocol: {protocol}')
+        print(f'Delta playlists: {delta}')
+        print(f'Preload hint prefetch: {prefetch}')
+        print(f'Rendition reports: {rendition_reports}')
+        print(f'Event store: {events_ram_mb} MB RAM, {events_dir if events_dir else "temporary spill directory"}')
+        print(f'Log format: {log_format}')
+        print(f'Processes: {processes}')
+        print(f'Metrics: http://localhost:{metrics_port}/metrics' if metrics_port else 'Metrics: no endpoint')
 
     #Start
-    main(url, limit, speed_limit, save_files)
\ No newline at end of file
+    main(url, limit, speed_limit, save_files, engine, protocol, delta, events_ram_mb, events_dir, headless_mode, summary_interval, log_format, config_path, processes, bundle_path, probe, metrics_port, prefetch, rendition_reports)
\ No newline at end of file
@@ -0,0 +1,192 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+
+import m3u8
+
+# Micro-benchmark suite of the playlist parser (m3u8.parse_m3u8, URL resolving and the M3U8 model).
+# Synthetic master and media playlists of growing size are generated in memory, no network is used.
+# For every case it reports parses per second, memory blocks kept by the parsed result (not all blocks allocated
+# during the parse, temporary ones are freed) and peak memory of one parse. Results are compared with the baseline file, a regression makes exit code 1.
+#
+# python benchmark.py --save          measure and save the baseline (per machine)
+# python benchmark.py                 measure and compare with the baseline
+# python benchmark.py --cases media_  only cases which names contain the text
+
+BASELINE_FILE = "benchmark_baseline.json"
+
+PLAYLIST_URL = "https://cdn.example.com/live/stream_1/media_0.m3u8?_HLS_msn=1000&_HLS_part=3"
+MASTER_URL = "https://cdn.example.com/live/stream_1/master.m3u8"
+
+
+def _padded_uri(uri: str, url_length: int) -> str:
+    # CDN tokens make URIs long, the query is padded to the requested length
+    padding = url_length - len(uri) - len("?token=")
+    return f"{uri}?token={'a' * padding}" if padding > 0 else uri
+
+def generate_media_playlist(segments: int, parts_per_segment: int, renditions: int = 4, media_sequence: int = 1000, part_duration: float = 0.5, url_length: int = 0) -> bytes:
+    # parts are listed for every segment, renditions - 1 rendition reports
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:9",
+        f"#EXT-X-TARGETDURATION:{int(part_duration * parts_per_segment + 0.999)}",
+        f"#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={part_duration * 3:.3f}",
+        f"#EXT-X-PART-INF:PART-TARGET={part_duration:.5f}",
+        f"#EXT-X-MEDIA-SEQUENCE:{media_sequence}",
+        "#EXT-X-INDEPENDENT-SEGMENTS",
+        '#EXT-X-MAP:URI="init_0.mp4"',
+    ]
+    url_length = url_length or len("media_0_1000_0.m4s?token=abcdef0123456789")
+    for s in range(media_sequence, media_sequence + segments):
+        for p in range(parts_per_segment):
+            independent = ",INDEPENDENT=YES" if p % 2 == 0 else ""
+            lines.append(f'#EXT-X-PART:DURATION={part_duration:.5f},URI="{_padded_uri(f"media_0_{s}_{p}.m4s", url_length)}"{independent}')
+        lines.append(f"#EXTINF:{part_duration * parts_per_segment:.5f},")
+        lines.append(_padded_uri(f"media_0_{s}.m4s", url_length))
+    last = media_sequence + segments
+    lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="{_padded_uri(f"media_0_{last}_0.m4s", url_length)}"')
+    for r in range(1, renditions):
+        lines.append(f'#EXT-X-RENDITION-REPORT:URI="media_{r}.m3u8",LAST-MSN={last},LAST-PART={parts_per_segment - 1}')
+    return ("\n".join(lines) + "\n").encode()
+
+def generate_master_playlist(renditions: int = 4) -> bytes:
+    lines = ["#EXTM3U", "#EXT-X-INDEPENDENT-SEGMENTS",
+             '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="audio",NAME="main",DEFAULT=YES,URI="audio.m3u8"']
+    for r in range(renditions):
+        lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={(r + 1) * 1000000},RESOLUTION={(r + 1) * 320}x{(r + 1) * 180},CODECS="avc1.64001f,mp4a.40.2",AUDIO="audio"')
+        lines.append(f"media_{r}.m3u8")
+    return ("\n".join(lines) + "\n").encode()
+
+def benchmark_cases() -> List[tuple[str, bytes, str]]:
+    # (name, playlist, url)
+    cases = []
+    for renditions in [4, 12]:
+        cases.append((f"master_r{renditions}", generate_master_playlist(renditions), MASTER_URL))
+    # window size
+    for segments in [10, 100, 1000, 10000]:
+        cases.append((f"media_s{segments}_p6_r4_u64", generate_media_playlist(segments, 6, 4, url_length=64), PLAYLIST_URL))
+    # parts per segment
+    for parts in [4, 8, 12]:
+        cases.append((f"media_s1000_p{parts}_r4_u64", generate_media_playlist(1000, parts, 4, url_length=64), PLAYLIST_URL))
+    # rendition reports
+    for renditions in [1, 16, 64]:
+        cases.append((f"media_s100_p6_r{renditions}_u64", generate_media_playlist(100, 6, renditions, url_length=64), PLAYLIST_URL))
+    # URL length
+    for url_length in [32, 256]:
+        cases.append((f"media_s1000_p6_r4_u{url_length}", generate_media_playlist(1000, 6, 4, url_length=url_length), PLAYLIST_URL))
+    return cases
+
+
+def measure_parses_per_second(data: bytes, url: str, seconds: float, rounds: int = 5, min_parses: int = 3) -> float:
+    # best of several rounds of CPU time of the process, so noise of other processes does not look like a regression
+    best = 0.0
+    for _ in range(rounds):
+        count = 0
+        timer_start = time.process_time()
+        timer_end = timer_start + seconds / rounds
+        while True:
+            m3u8.parse_m3u8(bytearray(data), url)
+            count += 1
+            now = time.process_time()
+            if now >= timer_end and count >= min_parses:
+                break
+        best = max(best, count / (now - timer_start))
+    return best
+
+def measure_memory(data: bytes, url: str) -> tuple[int, float]:
+    # memory blocks kept by the parsed manifest (retained after the parse) and peak KB of one parse
+    buffer = bytearray(data)
+    tracemalloc.start()
+    try:
+        blocks_before = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+        tracemalloc.reset_peak()
+        current_before = tracemalloc.get_traced_memory()[0]
+        manifest = m3u8.parse_m3u8(buffer, url)
+        peak = tracemalloc.get_traced_memory()[1]
+        blocks_after = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+        del manifest
+    finally:
+        tracemalloc.stop()
+    return blocks_after - blocks_before, (peak - current_before) / 1024
+
+def run_benchmark(case_filter: str, seconds: float) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+    for name, data, url in benchmark_cases():
+        if case_filter and case_filter not in name:
+            continue
+        # garbage of the previous case must not be collected during this one
+        gc.collect()
+        kept_blocks, peak_kb = measure_memory(data, url)
+        results[name] = {
+            "size": len(data),
+            "parses_per_sec": measure_parses_per_second(data, url, seconds),
+            "kept_blocks": kept_blocks,
+            "peak_kb": peak_kb,
+        }
+    return results
+
+def compare_with_baseline(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float) -> List[str]:
+    # returns regressions, speed must not fall and memory must not grow by more than the tolerance
+    regressions = []
+    for name, r in results.items():
+        b = baseline.get(name)
+        if b is None:
+            continue
+        if r["parses_per_sec"] < b["parses_per_sec"] * (1 - tolerance):
+            regressions.append(f"{name}: parses/s {r['parses_per_sec']:.1f} < {b['parses_per_sec']:.1f}")
+        if "kept_blocks" in b and r["kept_blocks"] > b["kept_blocks"] * (1 + tolerance):
+            regressions.append(f"{name}: kept blocks {r['kept_blocks']} > {b['kept_blocks']}")
+        if r["peak_kb"] > b["peak_kb"] * (1 + tolerance):
+            regressions.append(f"{name}: peak {r['peak_kb']:.1f} KB > {b['peak_kb']:.1f} KB")
+    return regressions
+
+def print_results(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]]):
+    def change(name: str, key: str) -> str:
+        b = baseline.get(name) if baseline else None
+        if not b or not b.get(key):
+            return ""
+        return f"{(results[name][key] / b[key] - 1) * 100:+.0f}%"
+
+    print(f"{'case':<28} {'size':>9} {'parses/s':>10} {'':>5} {'kept blocks':>11} {'':>5} {'peak KB':>9} {'':>5}")
+    for name, r in results.items():
+        print(f"{name:<28} {r['size']:>9} {r['parses_per_sec']:>10.1f} {change(name, 'parses_per_sec'):>5} "
+              f"{r['kept_blocks']:>11} {change(name, 'kept_blocks'):>5} {r['peak_kb']:>9.1f} {change(name, 'peak_kb'):>5}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark suite of the M3U8 parser")
+    parser.add_argument('--baseline', type=str, default=BASELINE_FILE, help=f'baseline file (default is {BASELINE_FILE})')
+    parser.add_argument('--save', action="store_true", default=False, help='save results as the new baseline instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed regression against the baseline, 0.15 = 15%% (default is 0.15)')
+    parser.add_argument('--seconds', type=float, default=1.0, help='time to measure parses per second of each case (default is 1.0)')
+    parser.add_argument('--cases', type=str, default="", help='run only cases which names contain the text')
+    args = parser.parse_args()
+
+    baseline = None
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)["results"]
+
+    results = run_benchmark(args.cases, args.seconds)
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump({"python": sys.version, "platform": platform.platform(), "results": results}, f, indent=2)
+        print(f"\nBaseline saved: {args.baseline}")
+    elif baseline is None:
+        print(f"\nNo baseline ({args.baseline}), run with --save to create it")
+    else:
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nREGRESSION (tolerance {args.tolerance * 100:.0f}%):")
+            for r in regressions:
+                print(f"  {r}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline} (tolerance {args.tolerance * 100:.0f}%)")
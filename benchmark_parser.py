@@ -0,0 +1,270 @@
+import argparse
+from enum import Enum
+import re
+import time
+from typing import List
+from urllib.parse import urlparse
+
+import m3u8
+from benchmark import generate_master_playlist, generate_media_playlist
+from m3u8 import M3U8, MediaAudio, MediaPart, MediaSegment, MediaStream, RenditionReport, TypeM3U8, ensure_absolute_url
+
+# Benchmark of m3u8.parse_m3u8() against the previous regex based parser kept here as the reference.
+# Both parsers must build the same M3U8 object for every generated playlist.
+#
+# python benchmark_parser.py --segments 100 --parts 6 --seconds 2
+
+
+def manifest_to_compare(manifest: M3U8):
+    # plain structure of the object, to compare results of both parsers
+    def plain(value):
+        if isinstance(value, list):
+            return [plain(v) for v in value]
+        if hasattr(value, "__dict__") and not isinstance(value, Enum):
+            return {k: plain(v) for k, v in vars(value).items()}
+        return value
+    return plain(manifest)
+
+def measure(parse, data: bytes, url: str, seconds: float) -> float:
+    # returns parses per second
+    count = 0
+    timer_start = time.perf_counter()
+    timer_end = timer_start + seconds
+    while True:
+        parse(bytearray(data), url)
+        count += 1
+        now = time.perf_counter()
+        if now >= timer_end:
+            return count / (now - timer_start)
+
+
+def parse_m3u8_legacy(data: bytearray, master_url: str) -> M3U8:
+    if data is None or len(data) == 0:
+        return None
+
+    # Convert bytearray to a string
+    text_data = data.decode('utf-8')
+    lines = text_data.splitlines()
+
+    if len(lines) == 0:
+        return None
+    
+    # Check the first line
+    if lines[0].strip() != "#EXTM3U":
+        #display.display_error(f"Invalid M3U8 file. First line: {lines[0]}")
+        print(f"Invalid M3U8 file. First line: {lines[0]}")
+        return None
+    
+    #print(f"Valid M3U8 file. First line: {lines[0]}")
+
+    # Initialize variables
+    params_independent_segments = False
+    params_target_duration = 0
+    params_part_target = 0.0
+    params_media_sequence = 1
+    params_map_uri = ""
+    params_server_control_can_block_reload = False
+    params_server_control_part_hold_back = 0.0
+    media_parts_preload_hint_uri = ""
+    media_rendition_reports : List[RenditionReport] = []
+    media_audios: List[MediaAudio] = []
+    media_streams : List[MediaStream] = []
+    media_parts : List[MediaPart] = []
+    media_segments : List[MediaSegment] = []
+
+    previous_extinf : float = 0.0
+    segment_num : int = params_media_sequence
+    part_num : int = 0
+
+    attr_pattern = r"=('([^']*)'|\"([^\"]*)\"|[^,\s]+)(?=,|$)"
+
+    i = 1
+    while i < len(lines):
+        line = lines[i].strip()
+
+        if line.startswith("#EXT-X-MEDIA:"):
+            result_type = re.search(r'TYPE'+attr_pattern, line, re.IGNORECASE)
+            if result_type is not None and result_type.group(1).upper() == "AUDIO":
+                result_group_id = re.search(r'GROUP-ID'+attr_pattern, line, re.IGNORECASE)
+                result_uri = re.search(r'URI'+attr_pattern, line, re.IGNORECASE)
+                
+                groupid = result_group_id.group(1).strip('\'"') if result_group_id else None
+                url = result_uri.group(1).strip('\'"') if result_uri else None
+                url = ensure_absolute_url(master_url, url)
+                
+                media_audios.append(MediaAudio(groupid, url))
+
+        elif line.startswith("#EXT-X-STREAM-INF:"):
+            if i + 1 < len(lines):
+                parsed_filename = urlparse(lines[i + 1].strip())
+                if bool(parsed_filename.path): 
+                    result_bandwidth = re.search(r'BANDWIDTH=(\d+)', line, re.IGNORECASE)
+                    result_resolution = re.search(r'RESOLUTION=([0-9x]+)', line, re.IGNORECASE)
+                    result_audio = re.search(r'AUDIO'+attr_pattern, line, re.IGNORECASE)
+
+                    bandwidth = int(result_bandwidth.group(1).strip('\'"')) if result_bandwidth else 0
+                    resolution = result_resolution.group(1).strip('\'"') if result_resolution else None
+                    audio = result_audio.group(1).strip('\'"') if result_audio else None
+
+                    url = ensure_absolute_url(master_url, parsed_filename.geturl())
+
+                    media_streams.append(MediaStream(url, bandwidth, resolution, audio))
+                    i += 1
+
+        elif line.startswith("#EXT-X-TARGETDURATION:"):
+            result = re.search(r'#EXT-X-TARGETDURATION:(\d+)', line, re.IGNORECASE)
+            if result:
+                params_target_duration = int(result.group(1))
+
+        elif line.startswith("#EXT-X-INDEPENDENT-SEGMENTS"):
+            params_independent_segments = True
+
+        elif line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            result = re.search(r'#EXT-X-MEDIA-SEQUENCE:(\d+)', line, re.IGNORECASE)
+            if result:
+                params_media_sequence = segment_num = int(result.group(1))
+
+        elif line.startswith("#EXT-X-MAP:"):
+            result_uri = re.search(r'URI'+attr_pattern, line, re.IGNORECASE)
+            if result_uri:
+                params_map_uri = ensure_absolute_url(master_url, result_uri.group(1).strip('\'"'))
+
+        elif line.startswith("#EXT-X-SERVER-CONTROL:"):
+            can_block_reload = re.search(r'CAN-BLOCK-RELOAD=(\w+)', line, re.IGNORECASE)
+            if can_block_reload:
+                params_server_control_can_block_reload = can_block_reload.group(1).upper() == 'YES'
+            part_hold_back = re.search(r'PART-HOLD-BACK=([\d.]+)', line, re.IGNORECASE)
+            if part_hold_back:
+                params_server_control_part_hold_back = float(part_hold_back.group(1))
+
+        elif line.startswith("#EXT-X-PART-INF:"):
+            part_target = re.search(r'PART-TARGET=([\d.]+)', line, re.IGNORECASE)
+            if part_target:
+                params_part_target = float(part_target.group(1))
+
+        elif line.startswith("#EXT-X-PART:"):
+            result_uri = re.search(r'URI'+attr_pattern, line, re.IGNORECASE)
+            result_duration = re.search(r'DURATION=([\d.]+)', line, re.IGNORECASE)
+            result_independent = re.search(r'INDEPENDENT=(\w+)', line, re.IGNORECASE)
+
+            uri = result_uri.group(1).strip('\'"') if result_uri else ""
+            duration = float(result_duration.group(1).strip('\'"')) if result_duration else 0.0
+            independent = result_independent.group(1).upper() == 'YES' if result_independent else False
+
+            url = ensure_absolute_url(master_url, uri)
+
+            media_parts.append(MediaPart(segment_num, part_num, url, duration, independent))
+
+            part_num += 1
+
+        elif line.startswith("#EXT-X-PRELOAD-HINT:"):
+            result_preload_type = re.search(r'TYPE'+attr_pattern, line, re.IGNORECASE)
+            result_uri = re.search(r'URI'+attr_pattern, line, re.IGNORECASE)
+            if result_preload_type and result_preload_type.group(1).strip('\'"').upper() == "PART":
+                url = ensure_absolute_url(master_url, result_uri.group(1).strip('\'"') if result_uri else "")
+                media_parts_preload_hint_uri = url
+
+        elif line.startswith("#EXT-X-RENDITION-REPORT:"):
+            result_uri = re.search(r'URI'+attr_pattern, line, re.IGNORECASE)
+            result_last_msn = re.search(r'LAST-MSN=(\d+)', line, re.IGNORECASE)
+            result_last_part = re.search(r'LAST-PART=(\d+)', line, re.IGNORECASE)
+
+            rendition_uri = result_uri.group(1).strip('\'"') if result_uri else ""
+            rendition_last_msn = int(result_last_msn.group(1).strip('\'"')) if result_last_msn else 0
+            rendition_last_part = int(result_last_part.group(1).strip('\'"')) if result_last_part else 0
+
+            url = ensure_absolute_url(master_url, rendition_uri)
+
+            media_rendition_reports.append(RenditionReport(url, rendition_last_msn, rendition_last_part))
+
+        elif line.startswith("#EXTINF:"):
+            result_duration = re.search(r'#EXTINF:([\d.]+),?', line, re.IGNORECASE)
+            if result_duration:
+                previous_extinf = float(result_duration.group(1))
+
+        elif len(line) == 0:
+            pass
+            
+        elif not line.startswith("#"):
+            parsed_filename = urlparse(line)
+            if bool(parsed_filename.path):
+                url = ensure_absolute_url(master_url, parsed_filename.geturl())
+                
+                media_segments.append(MediaSegment(segment_num, url, previous_extinf))
+                
+                previous_extinf = 0.0
+                segment_num += 1
+                part_num = 0
+                if len(media_parts) > 0:
+                    media_parts[len(media_parts)-1].Final = True
+        i += 1
+
+    manifest = None
+
+    # Decide what type of manifest it is: master, media, etc:
+    if len(media_streams) > 0:
+        # It's master manifest
+        manifest = M3U8(TypeM3U8.MASTER)
+        manifest.EXT_X_Independent_Segments = params_independent_segments
+        manifest.Media_Streams = media_streams
+        manifest.Media_Audios = media_audios
+
+    elif len(media_segments) > 0:
+        # It's media manifest
+        manifest = M3U8(TypeM3U8.VIDEO)
+        manifest.EXT_X_Target_Duration = params_target_duration
+        manifest.EXT_X_Independent_Segments = params_independent_segments
+        manifest.EXT_X_Media_Sequence = params_media_sequence
+        manifest.EXT_X_Map_URI = params_map_uri
+        manifest.EXT_X_Server_Control_Can_Block_Reload = params_server_control_can_block_reload
+        manifest.EXT_X_Server_Control_Part_Hold_Back = params_server_control_part_hold_back
+        manifest.EXT_X_PartInf_Part_Target = params_part_target
+        manifest.Media_Segments = media_segments
+        manifest.Media_Parts = media_parts
+        manifest.EXT_X_Preload_Hint_URI = media_parts_preload_hint_uri
+        manifest.RenditionReports = media_rendition_reports
+
+    return manifest
+
+
+# URIs which urljoin() resolves differently from appending them to the directory of the playlist, and some which it doesn't
+EDGE_CASE_URIS = ["media.m4s", "sub/media.m4s", "media.m4s?token=a/b", "./media.m4s", "../media.m4s", "sub/../media.m4s",
+                  "foo/.", "foo/..", "foo/.?x=1", "foo/..?x=1", ".", "..", "/abs/media.m4s", "//cdn.example.com/media.m4s",
+                  "https://other.example.com/media.m4s", "media.m4s#f", "media;p.m4s", "?x=1", "media.m4s?", "a:b.m4s"]
+
+def edge_case_playlists() -> List[tuple[str, bytes]]:
+    # master and media playlist with every URI of EDGE_CASE_URIS
+    master = ["#EXTM3U"]
+    media = ["#EXTM3U", "#EXT-X-TARGETDURATION:1", "#EXT-X-PART-INF:PART-TARGET=0.5"]
+    for uri in EDGE_CASE_URIS:
+        master += ['#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="audio",URI="' + uri + '"', "#EXT-X-STREAM-INF:BANDWIDTH=1000000", uri]
+        media += ['#EXT-X-PART:DURATION=0.5,URI="' + uri + '"', "#EXTINF:1.0,", uri]
+    return [("master, edge case URIs", ("\n".join(master) + "\n").encode()), ("media, edge case URIs", ("\n".join(media) + "\n").encode())]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the M3U8 parser against the previous regex based one")
+    parser.add_argument('--segments', type=int, nargs="+", default=[10, 100, 1000], help='number of segments in the media playlist (default is 10 100 1000)')
+    parser.add_argument('--parts', type=int, default=6, help='number of parts per segment (default is 6)')
+    parser.add_argument('--seconds', type=float, default=2.0, help='time to run each measurement (default is 2.0)')
+    args = parser.parse_args()
+
+    url = "https://cdn.example.com/live/stream_1/media_0.m3u8?_HLS_msn=1000&_HLS_part=3"
+    playlists = [(f"master, 4 renditions", generate_master_playlist(), "https://cdn.example.com/live/stream_1/master.m3u8")]
+    playlists += [(f"media, {segments} segments x {args.parts} parts", generate_media_playlist(segments, args.parts), url) for segments in args.segments]
+
+    for name, data in edge_case_playlists():
+        for playlist_url in [url, "https://cdn.example.com/live/stream_1/", "https://cdn.example.com"]:
+            if manifest_to_compare(m3u8.parse_m3u8(bytearray(data), playlist_url)) != manifest_to_compare(parse_m3u8_legacy(bytearray(data), playlist_url)):
+                print(f"{name} of {playlist_url}: parsers return different results")
+                exit(1)
+
+    print(f"{'playlist':<34} {'size':>9} {'legacy/s':>10} {'parser/s':>10} {'speed-up':>9}")
+    for name, data, playlist_url in playlists:
+        if manifest_to_compare(m3u8.parse_m3u8(bytearray(data), playlist_url)) != manifest_to_compare(parse_m3u8_legacy(bytearray(data), playlist_url)):
+            print(f"{name}: parsers return different results")
+            exit(1)
+
+        legacy_rate = measure(parse_m3u8_legacy, data, playlist_url, args.seconds)
+        rate = measure(m3u8.parse_m3u8, data, playlist_url, args.seconds)
+        print(f"{name:<34} {len(data):>9} {legacy_rate:>10.1f} {rate:>10.1f} {rate / legacy_rate:>8.2f}x")
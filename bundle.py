@@ -0,0 +1,150 @@
+import datetime
+import gzip
+import json
+import os
+import socket
+from typing import Dict, List
+from urllib.parse import urlparse
+
+import stats
+
+# Result bundle of a run: one gzip JSON file with metadata of the probe and, per rendition and type of file,
+# counts of OK/STALE/DELAY/ERROR and quantile sketches (stats.RequestStats), no raw samples. A bundle of a long
+# run of many renditions takes tens of KB. Bundles of probes in different locations are merged by adding
+# buckets of sketches, so hundreds of them are merged in seconds:
+#
+# python app.py https://example.com/master.m3u8 --probe fra-1 --bundle fra-1.json.gz
+# python app.py merge *.json.gz --output all.json.gz
+#
+# {"version": 1, "probe": "fra-1", "host": "...", "started": "...", "finished": "...", "settings": {...},
+#  "renditions": [{"stream": "...", "url": "...", "uri": "...", "resolution": "...", "bandwidth": 800000, "part_duration": 0.5,
+#                  "types": {"FILE_PART": {"counts": {"ok": 100, ...}, "stats": {...}}, "MANIFEST_MEDIA": {...}},
+#                  "delta": {"full": 10, "delta": 90, ...}}]}     #delta only with --delta, its counters are summed by the merge
+
+BUNDLE_VERSION = 1
+STATUSES = ["ok", "stale", "delay", "error"]
+
+def now_text() -> str:
+    return datetime.datetime.now(datetime.UTC).isoformat(timespec="seconds")
+
+def new_bundle(probe: str, started: str, settings: Dict, renditions: List[Dict]) -> Dict:
+    return {
+        "version": BUNDLE_VERSION,
+        "probe": probe or socket.gethostname(),
+        "host": socket.gethostname(),
+        "started": started,
+        "finished": now_text(),
+        "settings": settings,
+        "renditions": renditions,
+    }
+
+def write_bundle(path: str, bundle: Dict):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(bundle, f, separators=(",", ":"))
+
+def load_bundle(path: str) -> Dict:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        bundle = json.load(f)
+    if bundle.get("version") != BUNDLE_VERSION:
+        raise ValueError(f"Bundle {path} has version {bundle.get('version')}, expected {BUNDLE_VERSION}")
+    return bundle
+
+
+def rendition_key(rendition: Dict) -> tuple[str, str]:
+    # renditions of different probes are matched by stream and path of the URI (CDN tokens of queries differ),
+    # a stream without a name in the config is named by its URL
+    stream = rendition["stream"]
+    if stream == rendition["url"]:
+        stream = stream.split("?")[0]
+    return (stream, os.path.basename(urlparse(rendition["uri"]).path))
+
+class MergedType:
+    # one type of file of one rendition: counts and sketches of every probe and of all of them
+    Counts: Dict[str, List[int]]            #probe -> counts in order of STATUSES
+    Stats: Dict[str, stats.RequestStats]    #probe -> sketches
+    Total_counts: List[int]
+    Total_stats: stats.RequestStats
+
+    def __init__(self):
+        self.Counts = {}
+        self.Stats = {}
+        self.Total_counts = [0] * len(STATUSES)
+        self.Total_stats = stats.RequestStats()
+
+    def add(self, probe: str, counts: Dict[str, int], request_stats: stats.RequestStats):
+        probe_counts = self.Counts.setdefault(probe, [0] * len(STATUSES))
+        for i, status in enumerate(STATUSES):
+            probe_counts[i] += counts.get(status, 0)
+            self.Total_counts[i] += counts.get(status, 0)
+        if probe in self.Stats:
+            self.Stats[probe].merge(request_stats)
+        else:
+            self.Stats[probe] = request_stats
+        self.Total_stats.merge(request_stats)
+
+def merge_bundles(bundles: List[Dict]) -> Dict[tuple[str, str], Dict[str, MergedType]]:
+    # (stream, rendition) -> type of file -> counts and sketches by probe, in order of the first appearance
+    merged: Dict[tuple[str, str], Dict[str, MergedType]] = {}
+    for bundle in bundles:
+        for rendition in bundle["renditions"]:
+            types = merged.setdefault(rendition_key(rendition), {})
+            for type_name, result in rendition["types"].items():
+                types.setdefault(type_name, MergedType()).add(bundle["probe"], result["counts"], stats.RequestStats.from_dict(result["stats"]))
+    return merged
+
+def merged_bundle(bundles: List[Dict], merged: Dict[tuple[str, str], Dict[str, MergedType]]) -> Dict:
+    # bundle of all probes, so merged bundles can be merged again
+    renditions = []
+    first_of_key = {}
+    for bundle in bundles:
+        for rendition in bundle["renditions"]:
+            first_of_key.setdefault(rendition_key(rendition), rendition)
+    deltas = {}
+    for bundle in bundles:
+        for rendition in bundle["renditions"]:
+            if "delta" in rendition:
+                delta = deltas.setdefault(rendition_key(rendition), {})
+                for name, value in rendition["delta"].items():
+                    delta[name] = delta.get(name, 0) + value
+    for key, types in merged.items():
+        rendition = dict(first_of_key[key])
+        rendition.pop("delta", None)
+        if key in deltas:
+            rendition["delta"] = deltas[key]
+        rendition["types"] = {type_name: {"counts": dict(zip(STATUSES, t.Total_counts)), "stats": t.Total_stats.to_dict()}
+                              for type_name, t in types.items()}
+        renditions.append(rendition)
+    probes = sorted({bundle["probe"] for bundle in bundles})
+    return new_bundle(f"merged: {', '.join(probes)}", min(bundle["started"] for bundle in bundles), {"probes": probes}, renditions)
+
+def print_report(bundles: List[Dict], merged: Dict[tuple[str, str], Dict[str, MergedType]]):
+    # per rendition and type of file: a row of every probe and a row of all probes
+    print(f"PROBES: {len(bundles)}")
+    for bundle in bundles:
+        print(f"  {bundle['probe']}: {bundle['host']}, {bundle['started']} - {bundle['finished']}")
+    print()
+    print(f"{'':<24} {'count':>7} {'ok':>7} {'stale':>6} {'delay':>6} {'error':>6} | {'response p50':>12} {'p95':>7} {'p99':>7} | {'download p50':>12} {'p95':>7} | {'Mbps p50':>8}")
+    for (stream, rendition), types in merged.items():
+        print(f"{stream} {rendition}")
+        for type_name, t in types.items():
+            print(f"  {type_name}")
+            for probe, counts in list(t.Counts.items()) + [("ALL", t.Total_counts)]:
+                request_stats = t.Stats[probe] if probe != "ALL" else t.Total_stats
+                response_p50, response_p95, response_p99 = request_stats.Response_time.quantiles([0.50, 0.95, 0.99])
+                download_p50, download_p95 = request_stats.Download_time.quantiles([0.50, 0.95])
+                speed_p50 = request_stats.Download_speed.quantile(0.50)
+                count = sum(counts)
+                print(f"    {probe[:20]:<20} {count:>7} {counts[0]:>7} {counts[1]:>6} {counts[2]:>6} {counts[3]:>6} | "
+                      f"{response_p50:>12.1f} {response_p95:>7.1f} {response_p99:>7.1f} | {download_p50:>12.1f} {download_p95:>7.1f} | {speed_p50/1000/1000:>8.1f}")
+    print()
+
+def merge_command(paths: List[str], output: str = None):
+    bundles = [load_bundle(path) for path in paths]
+    merged = merge_bundles(bundles)
+    print_report(bundles, merged)
+    if output:
+        write_bundle(output, merged_bundle(bundles, merged))
+        print(f"Merged bundle saved: {output}")
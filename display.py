@@ -1,16 +1,17 @@
+import collections
 import datetime
 from enum import Enum
 import os
+import queue
 import threading
+import time
 from typing import Dict, List
 from urllib.parse import parse_qs, urlparse
-import curses
-import statistics
-import numpy as np
 
 import logs
 from m3u8 import M3U8, DownloadMetrics
 import m3u8
+from stats import QuantileSketch, RequestStats
 
 class Colors(Enum):
     BLACK = 0
@@ -31,18 +32,122 @@ _display_buffer_lines: List[str] = []
 # A lock object to ensure thread-safe printing
 _global_print_lock = threading.Lock()
 
-#curses._CursesWindow
+#curses._CursesWindow, curses is imported by init_display() only, headless mode never loads it
 _stdscr = None
+curses = None
+
+# Download threads only put events into the queue, the render thread is the only one which touches curses:
+# it applies events to the grid model and redraws changed cells at most _frames_per_second times a second.
+# Keys pressed are read by the render thread too, see display_getch().
+_frames_per_second = 20
+_events: queue.SimpleQueue = queue.SimpleQueue()
+_keys: queue.SimpleQueue = queue.SimpleQueue()
+_render_thread: threading.Thread = None
+_render_stop = threading.Event()
+
+# Worker processes of sharded monitoring (see sharding.py) have no screen: their events are queued as usual,
+# taken by display_take_events() and put into the queue of the parent process by display_remote_events().
+_forwarding = False
 
-_current_ipart: int = 0
-_current_part = (0,0,0)
-_processed_parts : List[int] = []
-_last_line: int = -1
 _line_counter: int = 1
 
 _text_column_width = 29
 _first_column_width = 45 + 4
 _number_of_data_columns: int = 0
+_column_headers: List[str] = []
+_column_in_flight: Dict[int, int] = {}
+_column_live_latency: Dict[int, float] = {}    #ms behind the live edge of the latest playlist or part
+_column_skew: Dict[int, int] = {}               #parts behind the leader of the stream in the latest playlist
+_header_text: str = ""
+_header_dirty = False
+
+class ScreenRowIndex:
+    # Rows printed on the screen: (segment, part, TypeDownload) -> number of the row, the latest row of the key wins.
+    # Rows are numbered from the start, the grid keeps the last rows, see _grid_row().
+    # As the old backward scan of the rows: a row is not found any more if a row of the same type which is
+    # Rotten_segments older than it is printed after it (a lagging rendition), keys (0, 0, type) are never rotten.
+    # Rows scrolled out of the screen are evicted.
+    Rotten_segments: int
+    Count: int
+    Rows: Dict[tuple, int]
+
+    def __init__(self, rotten_segments: int = 3):
+        self.Rotten_segments = rotten_segments
+        self.Count = 0
+        self.Rows = {}
+        self._order = collections.deque()                           #(key, row) in order of rows
+        self._newest: Dict[m3u8.TypeDownload, tuple[int, int]] = {}  #newest (segment, part) per type
+
+    def _is_rotten(self, item: tuple, target: tuple) -> bool:
+        # item is too old to be printed after the target
+        rotten = target[0] - self.Rotten_segments
+        return item[0] < rotten or (item[0] == rotten and item[1] < target[1])
+
+    def add(self, key: tuple):
+        segment, part, filetype = key
+        if not (segment == 0 and part == 0):
+            newest = self._newest.get(filetype)
+            if newest is not None and self._is_rotten(key, newest):
+                # rare: rows of the type which are too new for this one can't be found any more
+                for other in [k for k in self.Rows if k[2] == filetype and not (k[0] == 0 and k[1] == 0) and self._is_rotten(key, k)]:
+                    del self.Rows[other]
+            if newest is None or (segment, part) > newest:
+                self._newest[filetype] = (segment, part)
+        self.Rows[key] = self.Count
+        self._order.append((key, self.Count))
+        self.Count += 1
+
+    def evict_scrolled_out(self, height: int):
+        while self._order and self._order[0][1] < self.Count - height:
+            key, row = self._order.popleft()
+            # the key may have been printed again later, only its last row is in the index
+            if self.Rows.get(key) == row:
+                del self.Rows[key]
+
+    def find(self, key: tuple) -> int:
+        # row of the key, -1 if it is not on the screen or it is rotten
+        return self.Rows.get(key, -1)
+
+    def clear(self):
+        self.Count = 0
+        self.Rows.clear()
+        self._order.clear()
+        self._newest.clear()
+
+_screen_rows = ScreenRowIndex()
+
+
+class ScreenRow:
+    # One line of the grid: label (counter, segment-part, time, file) and a cell per rendition
+    Key: tuple
+    Text: str                                   #file name of the start event, copied to a new line of the same key
+    Label: str
+    Dim: bool
+    Cells: Dict[int, List[tuple[str, Colors]]]  #media index -> texts with colors
+    Dirty_cells: set                            #media indexes to redraw, None = the whole line
+
+    def __init__(self, key: tuple, text: str, label: str):
+        self.Key = key
+        self.Text = text
+        self.Label = label
+        self.Dim = check_for_dimming(key)
+        self.Cells = {}
+        self.Dirty_cells = None
+
+    def plain_text(self) -> str:
+        line = self.Label[:_first_column_width].ljust(_first_column_width)
+        for i in range(_number_of_data_columns):
+            cell = "".join(text for text, _ in self.Cells.get(i, []))
+            line += "|" + cell[:_text_column_width - 1].ljust(_text_column_width - 1)
+        return line + "|"
+
+# rows on the screen below the header, oldest first; the row number of _grid_rows[0] is _screen_rows.Count - len(_grid_rows)
+_grid_rows: collections.deque = collections.deque()
+_grid_scrolled = 0          #rows scrolled out since the last frame
+
+def _grid_row(row: int) -> ScreenRow:
+    i = row - (_screen_rows.Count - len(_grid_rows))
+    return _grid_rows[i] if 0 <= i < len(_grid_rows) else None
 
 def check_for_dimming(item: tuple) -> bool:
     return item[2] == m3u8.TypeDownload.FILE_PART
@@ -52,250 +157,188 @@ def _safe_print(*args, **kwargs):
     with _global_print_lock:
         print(*args, **kwargs)
 
-def _safe_print_curses(*args, **kwargs):
-    with _global_print_lock:
-        _safe_print_curses_internal(*args, **kwargs)
-
-def _safe_print_curses_internal(text: str, item_to_add: tuple, media_index: int, force_new_line_if_not_empty: bool = False): 
-    if _debug:
-        return
-
-    if _stdscr is None:
-        return
 
-    global _last_line
-    global _processed_parts
-    global _current_part
-    global _display_buffer_lines
-    global _display_buffer_lines_limit
+def _apply_start(text: str, item_to_add: tuple, media_index: int, time_text: str, force_new_line_if_not_empty: bool = False):
     global _line_counter
+    global _grid_scrolled
 
-    # Get the screen dimensions
-    height, width = _stdscr.getmaxyx()   
-
-    
-    # if filename is already prined on the screen, then job has been done already
-    text2 = ""
-    found_item = find_or_nearest_tuple(_processed_parts, item_to_add)
-    if found_item >= 0:
-        if force_new_line_if_not_empty == False:
-            return 
-        else:
-            # so it's force_new_line_if_not_empty == True
-            x = _first_column_width + media_index * _text_column_width + 1 #48 27,  (4) is for counter
-            if x >= width:
-                # return, because we do not track values wich do not fit the screen, so nothing to print here
-                return 
-            line_from_bottom = len(_processed_parts) - found_item - 1 
-            if _last_line < height:
-                y = _last_line - line_from_bottom
-            else:
-                y = height - 1 - line_from_bottom 
-            if y >= 0:  # and x < width
-                text2 = _stdscr.instr(y, x, _text_column_width-1).decode().strip()
-                if len(text2) == 0:
-                    return
-
-
-    ## Get the current cursor position
-    #y, x = stdscr.getyx()
-
-    # Determine the position for the text
-    x = 0 
-    y = 0   
-    if _last_line < 0:
-        y = 0
-    else:
-        y = _last_line
-    
-    ## Move to the y position just before the last line, scroll content up
-    #stdscr.move(y, x)
-
-    # If we are at the bottom of the screen, scroll the window
-    if y == height - 1:
-        text1 = _stdscr.instr(0, 0, curses.COLS).decode()
-        _display_buffer_lines.append(text1)
-
-        y -= 1 #because in the next step we increase a line again
-        _stdscr.scroll(1)
-    elif y > height - 1:
-        for i in range(2):
-            text1 = _stdscr.instr(i, 0, curses.COLS).decode()
-            _display_buffer_lines.append(text1)
-
-        y = height - 2 #because in the next step we increase a line again
-        _stdscr.scroll(2)
-        _stdscr.addstr(y, 0, "...")
-        _processed_parts.clear()
-
-    # keep in the buffer limited number of lines, so saving last N lines only
-    if len(_display_buffer_lines) > _display_buffer_lines_limit:
-        _display_buffer_lines = _display_buffer_lines[-_display_buffer_lines_limit:]
-
-    # Move to the next line and print text
-    y = y + 1
-    _stdscr.move(y, 0)
+    # if filename is already printed on the screen, then job has been done already
+    found_row = _grid_row(_screen_rows.find(item_to_add))
+    if found_row is not None:
+        if not force_new_line_if_not_empty:
+            return
+        # the line is reused while the cell of the rendition is empty
+        if not found_row.Cells.get(media_index):
+            return
 
     segmentnum, partnum, filetype = item_to_add
-    text = f"{_line_counter:03d} {segmentnum:04d}-{partnum:02d} {datetime.datetime.now(datetime.UTC).strftime('%H:%M:%S.%f')[:-3]} {text}"
+    label = f"{_line_counter:03d} {segmentnum:04d}-{partnum:02d} {time_text} {text}"
     _line_counter += 1
 
-    tw_max = min(width-x-1, _first_column_width)
-
-    #if file then change background for better visibility
-    dim = curses.A_DIM if check_for_dimming(item_to_add) else 0
-    _stdscr.addstr(y, x, text[:tw_max], curses.color_pair(0) | dim)
-
-    # if check_for_dimming(item_to_add):
-    #     # # Define original and darker background colors
-    #     # original_bg = curses.COLOR_WHITE
-    #     # darker_bg = 16  # The index for the new color, should be between 0 and 255
-    #
-    #     # # Get original RGB values
-    #     # old_r, old_g, old_b = curses.color_content(original_bg)
-    #     # h, l, s = colorsys.rgb_to_hls(old_r, old_g, old_b)
-    #     # scale_l = 0.2
-    #     # if l < 500:
-    #     #     scale_l = 1 + scale_l
-    #     # else:
-    #     #     scale_l = 1 - scale_l
-    #     # darker_color_r, darker_color_g, darker_color_b = colorsys.hls_to_rgb(h, max(min(l * scale_l, 1000.0),0.0), s)
-    #     # # Reinit dark color
-    #     # curses.init_color(darker_bg, int(darker_color_r), int(darker_color_g), int(darker_color_b))
-    #       
-    #     # # Initialize color pair with the new background
-    #     # curses.init_pair(8, curses.COLOR_WHITE, darker_bg)
-    #
-    #     _stdscr.addstr(y, x, text[:tw_max], curses.A_DIM)  # curses.color_pair(8) Ensuring the text fits in the width
-    # else:
-    #     _stdscr.addstr(y, x, text[:tw_max])  # Ensuring the text fits in the width
-    
-    #_first_column_width
-    for i in range (_number_of_data_columns+1):
-        x = _first_column_width + i * _text_column_width #48 27,  (4) is for counter
-        if x < width:
-            _stdscr.addstr(y, x, "|")
-
-    _stdscr.refresh()
-
-    _current_part = item_to_add
-    _processed_parts.append(item_to_add)
+    _grid_rows.append(ScreenRow(item_to_add, text, label))
+    _screen_rows.add(item_to_add)
 
-    _last_line = y
+    height, width = _stdscr.getmaxyx()
+    visible = max(height - 1, 1)
+    while len(_grid_rows) > visible:
+        _display_buffer_lines.append(_grid_rows.popleft().plain_text())
+        _grid_scrolled += 1
+    _screen_rows.evict_scrolled_out(visible)
 
-def _safe_print_curses_update_status(*args, **kwargs):
-    with _global_print_lock:
-        _safe_print_curses_update_status_internal(*args, **kwargs)
-
-def _safe_print_curses_update_status_internal(item_to_find: tuple, text: str, status: str, status_color: Colors, metrics_tuple: tuple, media_index: int, force_new_line: bool = True): 
-    if _debug:
-        print(f"[{threading.current_thread().name}, index = {media_index} - {item_to_find} - {status}]")
+def _apply_status(item_to_find: tuple, status: str, status_color: Colors, metrics_tuple: tuple, media_index: int, time_text: str):
+    row = _grid_row(_screen_rows.find(item_to_find))
+    if row is None or media_index < 0:
         return
 
-    global _processed_parts
-    global _text_column_width
-    global _first_column_width
-    
-    if _stdscr is None:
-        return
-
-    try:
-        # scan the list descending: from bottom to top
-        # -2 = didn't find it at all
-        # -1 = did not find the specified element, but an older one has already been found
-        # 0+ = element is found, exact position in the list is returned
-        i = find_or_nearest_tuple(_processed_parts, item_to_find)
-        if i == -2:
-            return
-        elif i == -1:
+    # the cell is taken by an earlier result of the same key, so the result goes to a new line
+    if row.Cells.get(media_index):
+        _apply_start(row.Text, item_to_find, media_index, time_text, force_new_line_if_not_empty = True)
+        row = _grid_row(_screen_rows.find(item_to_find))
+        if row is None:
             return
-        else:
-            line_from_bottom = len(_processed_parts) - i - 1 #len(_processed_parts) - i - 1
 
-        # Get the screen dimensions
-        height, width = _stdscr.getmaxyx()    
-
-        # Determine the position for the text
+    cell = []
+    for text, color in metrics_tuple:
+        if cell:
+            cell.append(("/", None))
+        cell.append((text, color))
+    cell.append((" " + status[:_text_column_width-18], status_color))
+    row.Cells[media_index] = cell
+    if row.Dirty_cells is not None:
+        row.Dirty_cells.add(media_index)
+
+def _apply_event(event: tuple):
+    global _header_dirty
+
+    kind = event[0]
+    if kind == "start":
+        _apply_start(*event[1:])
+    elif kind == "status":
+        _apply_status(*event[1:])
+    elif kind == "in_flight":
+        _column_in_flight[event[1]] = event[2]
+        _header_dirty = True
+    elif kind == "live_latency":
+        _column_live_latency[event[1]] = event[2]
+        _header_dirty = True
+    elif kind == "skew":
+        _column_skew[event[1]] = event[2]
+        _header_dirty = True
+
+
+def _draw_header(width: int):
+    _stdscr.move(0, 0)
+    _stdscr.clrtoeol()
+    _stdscr.addstr(0, 0, _header_text[:width-1])
+    for i, header in enumerate(_column_headers):
+        text = header
+        if i in _column_in_flight:
+            text += f" [{_column_in_flight[i]}]"
+        if i in _column_live_latency:
+            text += f" {_column_live_latency[i]/1000:.2f}s"
+        if _column_skew.get(i, 0) > 0:
+            text += f" -{_column_skew[i]}p"
+        x = _first_column_width + i * _text_column_width + int(_text_column_width/2.0 - len(header)/2.0) #48 27,  (4) is for counter
+        if x < width:
+            _stdscr.addstr(0, x, text[:width-x-1])
 
-        x = _first_column_width + media_index * _text_column_width + 1 #48 27,  (4) is for counter
-        if _last_line < height:
-            y = _last_line - line_from_bottom
+def _draw_cell(y: int, row: ScreenRow, media_index: int, width: int):
+    x = _first_column_width + media_index * _text_column_width + 1 #48 27,  (4) is for counter
+    if x >= width:
+        return
+    dim = curses.A_DIM if row.Dim else 0
+    _stdscr.addstr(y, x, " " * min(_text_column_width - 1, width - x - 1))
+    for text, color in row.Cells.get(media_index, []):
+        if x >= width - 1:
+            break
+        _stdscr.addstr(y, x, text[:width-x-1], curses.color_pair(color.value if color is not None else 0) | dim)
+        x += len(text)
+
+def _draw_row(y: int, row: ScreenRow, width: int):
+    if row.Dirty_cells is None:
+        _stdscr.move(y, 0)
+        _stdscr.clrtoeol()
+        #if file then change background for better visibility
+        dim = curses.A_DIM if row.Dim else 0
+        _stdscr.addstr(y, 0, row.Label[:min(width-1, _first_column_width)], curses.color_pair(0) | dim)
+        for i in range(_number_of_data_columns+1):
+            x = _first_column_width + i * _text_column_width #48 27,  (4) is for counter
+            if x < width - 1:
+                _stdscr.addstr(y, x, "|")
+        for media_index in row.Cells:
+            _draw_cell(y, row, media_index, width)
+    else:
+        for media_index in row.Dirty_cells:
+            _draw_cell(y, row, media_index, width)
+    row.Dirty_cells = set()
+
+def _draw_frame():
+    # redraws changed lines and cells only, lines moved by scrolling are shifted by curses
+    global _grid_scrolled
+    global _header_dirty
+
+    height, width = _stdscr.getmaxyx()
+    changed = _header_dirty or _grid_scrolled > 0
+    if _grid_scrolled > 0:
+        if _grid_scrolled >= height - 1:
+            for row in _grid_rows:
+                row.Dirty_cells = None
         else:
-            y = height - 1 - line_from_bottom 
-        if y < 0:
-            return
+            _stdscr.scroll(_grid_scrolled)
+        _grid_scrolled = 0
+    if _header_dirty:
+        _draw_header(width)
+        _header_dirty = False
+    for y, row in enumerate(_grid_rows, start=1):
+        if y >= height:
+            break
+        if row.Dirty_cells is None or row.Dirty_cells:
+            _draw_row(y, row, width)
+            changed = True
+    if changed:
+        _stdscr.refresh()
 
-        if force_new_line == True:
-            if x < width: 
-                text2 = _stdscr.instr(y, x, _text_column_width-1).decode().strip()
-                if len(text2) > 0:
-                    text1 = _stdscr.instr(y, 0, _first_column_width).decode().strip()
-
-                    ## Split the text at the first occurrence of space because of Number in it
-                    #parts = text1.split(' ', 1)
-                    # Split the text at the third occurrence of space because of Number in it
-                    parts = text1.split(' ', 3)
-                    # Use part after the first space if it exists, otherwise return an empty string
-                    if len(parts) > 3:
-                        text1 = parts[3]
-
-                    _safe_print_curses_internal(text1, item_to_find, media_index, force_new_line_if_not_empty = True)
-                    # call itself again to print info on the new line, 
-                    # but with force_new_line=FALSE
-                    _safe_print_curses_update_status_internal(item_to_find, text, status, status_color, metrics_tuple, media_index, False)
-                    return
-
-        if False: #if _debug #for checking adjustment
-            if x >= width: 
-                return
-            text = f"[i{media_index}s{item_to_find[0]}p{item_to_find[1]}t{item_to_find[2]}]"
-            _stdscr.addstr(y, x, text[:width-x-1])
-            _stdscr.refresh()
+def _read_keys():
+    while True:
+        key = _stdscr.getch()
+        if key == -1:
             return
+        _keys.put(key)
 
-        dim = curses.A_DIM if check_for_dimming(item_to_find) else 0
-
-        isfirst = True
-        for text, color in metrics_tuple:
-            if x >= width: 
-                break
-            if not isfirst:
-                if x < width: 
-                    _stdscr.addstr(y, x, "/"[:width-x-1], curses.color_pair(0) | dim)
-                x += 1
-            if color is not None:
-                if x < width: 
-                    _stdscr.addstr(y, x, text[:width-x-1], curses.color_pair(color.value) | dim) 
-            else:
-                if x < width: 
-                    _stdscr.addstr(y, x, text[:width-x-1], curses.color_pair(0) | dim) 
-            x += len(text)          
-            isfirst = False
-        
-        # Ensuring the text fits in the width
-        x += 1
-        tw_max = min(width-x-1, _text_column_width-18)
-        if status_color:
-            if x < width: 
-                _stdscr.addstr(y, x, status[:tw_max], curses.color_pair(status_color.value) | dim) 
-        else:
-            if x < width: 
-                _stdscr.addstr(y, x, status[:tw_max], curses.color_pair(0) | dim) 
-        _stdscr.refresh()
+def _render_frame():
+    while True:
+        try:
+            _apply_event(_events.get_nowait())
+        except queue.Empty:
+            break
+    _draw_frame()
+    _read_keys()
+
+def _render_loop():
+    frame_time = 1.0 / _frames_per_second
+    while not _render_stop.is_set():
+        frame_start = time.monotonic()
+        try:
+            _render_frame()
+        except Exception as e:
+            logs.write_exception(e)
+        _render_stop.wait(max(frame_time - (time.monotonic() - frame_start), 0.0))
+    # last events before the finish
+    _render_frame()
 
-    except Exception as e:
-        # Handle exceptions and print the error message
-        print(f"An error occurred: {e}")
-        logs.write_exception(e)
- 
-    
 
-def init_display(master_playlist: M3U8, limit_downloads: int):
+def init_display(master_playlist: M3U8, limit_downloads: int, stream_names: List[str] = None):
+    # stream_names = name of the stream of every rendition if many streams are monitored
+    global curses
     global _stdscr
     global _number_of_data_columns
+    global _header_text
+    global _header_dirty
+    global _render_thread
 
     print(f"\nSTART: {master_playlist.Type}, {master_playlist.Name}, {master_playlist.URI}")
-    print(master_playlist.FileDownloaded.Response_body.decode('utf-8'))
+    if master_playlist.FileDownloaded is not None:
+        print(master_playlist.FileDownloaded.Response_body.decode('utf-8'))
 
     _number_of_data_columns = len(master_playlist.Media_Streams)
 
@@ -309,6 +352,7 @@ def init_display(master_playlist: M3U8, limit_downloads: int):
         _stdscr = None
         return
 
+    import curses
     #curses._CursesWindow
     _stdscr = curses.initscr() 
 
@@ -319,90 +363,71 @@ def init_display(master_playlist: M3U8, limit_downloads: int):
     for i in range(0, curses.COLORS):
         curses.init_pair(i, i, -1)
 
+    # the header stays on the first line, rows scroll below it
+    height, width = _stdscr.getmaxyx() 
     _stdscr.scrollok(True)
     _stdscr.idlok(True)
+    if height > 2:
+        _stdscr.setscrreg(1, height - 1)
 
-    # Get the screen dimensions
-    height, width = _stdscr.getmaxyx() 
-    _stdscr.addstr(0, 0, f"Num of streams = {len(master_playlist.Media_Streams)}, Limit = {limit_downloads}")  
+    _header_text = f"Num of streams = {len(master_playlist.Media_Streams)}, Limit = {limit_downloads}"
     for i, stream in enumerate(master_playlist.Media_Streams):
         parsed_url = urlparse(stream.URI)                            
         filename = os.path.basename(parsed_url.path)
+        _column_headers.append(f"{stream_names[i] + ' ' if stream_names else ''}{filename} {stream.Resolution}")
+    _header_dirty = True
 
-        text = f"{filename} {stream.Resolution}"
+    _stdscr.nodelay(True)
 
-        x = _first_column_width + i * _text_column_width + int(_text_column_width/2.0 - len(text)/2.0) #48 27,  (4) is for counter
-        if x < width:
-            _stdscr.addstr(0, x, text[:width-x-1])
-    _stdscr.refresh()
+    _render_stop.clear()
+    _render_thread = threading.Thread(target=_render_loop, name="Display", daemon=True)
+    _render_thread.start()
 
-        #print(f'Stream {i + 1}: ' +  str(stream))
 
-    #for i, stream in enumerate(master_playlist.Media_Audios):
-    #    print(f'Audio {i + 1}: ' +  str(stream))
+def init_display_forwarding():
+    # worker process: events are kept for the parent process instead of being drawn
+    global _forwarding
+    _forwarding = True
 
-    _stdscr.nodelay(True)
-  
-
-def find_or_nearest_tuple(lst, target):
-    # scan the list descending: from bottom to top
-    # -2 = didn't find it at all
-    # -1 = did not find the specified element, but an older one has already been found
-    # 0+ = element is found, exact position in the list is returned
-
-    target_segment, target_part, target_filetype = target
-    #nearest_tuple = None
-    #smallest_diff = float('inf')  # Initialize with infinity
-
-    for i in range (len(lst) - 1, -1, -1):
-        item = lst[i]
-
-        if (item[0] == 0 and item[1] == 0):
-            if (target_segment == 0 and target_part == 0):
-                if item[2] == target_filetype:
-                    return i
-                else:
-                    continue
-            else:
-                continue
+def display_take_events() -> List[tuple]:
+    # events queued since the last call, worker process only
+    events = []
+    try:
+        while True:
+            events.append(_events.get_nowait())
+    except queue.Empty:
+        pass
+    return events
+
+def display_remote_events(events: List[tuple]):
+    # events of worker processes, drawn by the render thread as local ones
+    if _debug:
+        for event in events:
+            if event[0] == "status":
+                print(f"[remote, index = {event[5]} - {event[1]} - {event[2]}]")
+        return
+    if _stdscr is None:
+        return
+    for event in events:
+        _events.put(event)
 
-        if item[0] == target_segment and item[1] == target_part and item[2] == target_filetype:
-            return i
-        
-        #how much to check old segments affects the likelihood of a long response
-        rotten_segment = 3
-        if ((item[0] < target_segment-rotten_segment) or (item[0] == target_segment-rotten_segment and item[1] < target_part)) and (item[2] == target_filetype):
-            return -1
-    
-    #for part1, part2 in lst:
-    #    if (part1, part2) == (target1, target2):
-    #        return (part1, part2)
-    #    
-    #    if part1 >= target1 and part2 >= target2:
-    #        diff = (part1 - target1) + (part2 - target2)
-    #        if diff < smallest_diff:
-    #            smallest_diff = diff
-    #            nearest_tuple = (part1, part2)
-
-    #didn't find it at all
-    return -2
 
 def display_getch(wait_for_key: bool = False) -> int:
-    global _stdscr
-
+    # keys are read by the render thread, -1 if no key is pressed
     if _debug:
         return
     
     if not _stdscr:
         return
 
-    _stdscr.nodelay(not wait_for_key)
-
-    # Wait for user input to exit    
-    return _stdscr.getch()
+    try:
+        return _keys.get(block=wait_for_key)
+    except queue.Empty:
+        return -1
 
 def display_finish():
     global _stdscr
+    global _render_thread
 
     if _debug:
         return
@@ -410,12 +435,16 @@ def display_finish():
     if not _stdscr:
         return
 
-    # Get the screen dimensions
-    height, width = _stdscr.getmaxyx()    
-    for i in range(height):
-        text1 = _stdscr.instr(i, 0, curses.COLS).decode().strip()
-        if len(text1) > 0:
-            _display_buffer_lines.append(text1)
+    if _render_thread is not None:
+        _render_stop.set()
+        _render_thread.join()
+        _render_thread = None
+
+    # lines which are still on the screen
+    for row in _grid_rows:
+        _display_buffer_lines.append(row.plain_text())
+    _grid_rows.clear()
+    _screen_rows.clear()
 
     # Explicitly reset terminal settings
     curses.nocbreak()
@@ -426,27 +455,19 @@ def display_finish():
     #print("curses.endwin()")
 
     #write all the buffer to the screen
-    for l in _display_buffer_lines:
+    for l in _display_buffer_lines[-_display_buffer_lines_limit:]:
         print(l)
     _display_buffer_lines.clear()
 
 
 def display_downloadstatus(type: m3u8.TypeDownload, segmentnum: int, partnum: int, status: str, status_color: Colors, metrics_tuple: tuple, download_metrics: DownloadMetrics, media_index: int = None):
-    global _processed_parts
-
-#    _current_ipart = i_part
-#    _current_part = (last_part.Segment, last_part.PartNum)
-#                        s = i_part_to_download // max_parts_in_segment
-#                        p = i_part_to_download % max_parts_in_segment
-#                            part_to_download = playlist0.Media_Parts[len(playlist0.Media_Parts) - (i_part - i_part_to_download) - 1]
-#                            processed_parts.append(i_part_to_download)
-#   
     text = ""
     if metrics_tuple is None and download_metrics is not None:
         #Response_time – ms
-        #Download_time – ms
-        #Download_speed – bits per second
+        #Download_time – ms
+        #Download_speed – bits per second
         text = f"{(download_metrics.Download_time):5.1f}/{download_metrics.Response_time:4.0f}/{download_metrics.Download_speed/1000/1000:5.1f}"
+        metrics_tuple = [(text, None)]
     
     if status is None:
         status = download_metrics.Status
@@ -454,8 +475,36 @@ def display_downloadstatus(type: m3u8.TypeDownload, segmentnum: int, partnum: in
     if media_index is None:
         media_index = -1
 
-    _safe_print_curses_update_status((segmentnum, partnum, type), text, status, status_color, metrics_tuple, media_index)
+    if _debug:
+        print(f"[{threading.current_thread().name}, index = {media_index} - {(segmentnum, partnum, type)} - {status}]")
+        return
+
+    if _stdscr is None and not _forwarding:
+        return
+
+    _events.put(("status", (segmentnum, partnum, type), status, status_color, metrics_tuple or [], media_index, _time_text()))
     
+def display_in_flight(media_index: int, depth: int):
+    # live number of requests in flight of the rendition, next to its column header
+    if _debug or (not _stdscr and not _forwarding) or media_index is None:
+        return
+    _events.put(("in_flight", media_index, depth))
+
+def display_live_latency(media_index: int, latency_ms: float):
+    # live-edge latency of the rendition (see monitoring.measure_live_latency), next to its column header
+    if _debug or (not _stdscr and not _forwarding) or media_index is None:
+        return
+    _events.put(("live_latency", media_index, latency_ms))
+
+def display_rendition_skew(media_index: int, parts: int):
+    # parts behind the leader of the stream (see monitoring.record_rendition_skew), next to the column header if behind
+    if _debug or (not _stdscr and not _forwarding) or media_index is None:
+        return
+    _events.put(("skew", media_index, parts))
+
+def _time_text() -> str:
+    return datetime.datetime.now(datetime.UTC).strftime('%H:%M:%S.%f')[:-3]
+
 def format_string_15(input_str: str, max: int = 23):
     try:
         # Ensure the string is at most 15 characters
@@ -470,7 +519,7 @@ def format_string_15(input_str: str, max: int = 23):
         logs.write_exception(e)
 
 def display_downloadstarted(type: m3u8.TypeDownload, segmentnum: int, partnum: int, url_to_download: str, media_index: int, force_new_line: bool = False):
-    if _debug:
+    if _debug or (_stdscr is None and not _forwarding):
         return
     
     try:
@@ -496,8 +545,7 @@ def display_downloadstarted(type: m3u8.TypeDownload, segmentnum: int, partnum: i
         text = f"{format_string_15(filename)}"
 
         #text = f"Dload: {segmentnum}-{partnum} {filename + query}"
-        #last_line = 
-        _safe_print_curses(text, (segmentnum, partnum, type), media_index, force_new_line)
+        _events.put(("start", text, (segmentnum, partnum, type), media_index, _time_text(), force_new_line))
 
 
         #_safe_print(f"Dload: {segmentnum}-{partnum} {filename + query}")
@@ -507,25 +555,17 @@ def display_downloadstarted(type: m3u8.TypeDownload, segmentnum: int, partnum: i
         logs.write_exception(e)
 
 def display_message(message: str):
+    if _forwarding:
+        return
     _safe_print(f"Info:  {message}")
 
 def display_error(message: str):
     _safe_print(f"ERROR: {message}")
 
 
-def calc_stat_values(float_values: List[float]):
-    # Calculate minimum, average, and maximum
-    min_value = min(float_values)
-    max_value = max(float_values)
-    average_value = statistics.mean(float_values)
-
-    # Calculate percentiles using numpy
-    p50_value = np.percentile(float_values, 50)
-    p75_value = np.percentile(float_values, 75)
-    p95_value = np.percentile(float_values, 95)
-    p99_value = np.percentile(float_values, 99)
-
-    return (min_value, average_value, max_value, p50_value, p75_value, p95_value, p99_value)
+def calc_stat_values(sketch: QuantileSketch, scale: float = 1.0):
+    # min, avg, max, p50, p75, p95, p99 of the sketch, percentiles are within its relative accuracy
+    return tuple(value * scale for value in sketch.stat_values())
 
 def color_stat_value(value: float, limit: float, reverse: bool = False) -> str:
     if (not reverse and value >= limit) or (reverse and value < limit):
@@ -559,35 +599,65 @@ def color_response_value(value: int, text: str, color: Colors) -> str:
         return text
 
 
-def display_summary_substat_nocurses(section_name: str, responses: List[int], stat: List[tuple[float, float, float]], bandwidth_limit: float, part_duration_limit: float):
+def display_summary_substat_nocurses(section_name: str, responses: List[int], stat: RequestStats, bandwidth_limit: float, part_duration_limit: float):
     print(f"{section_name}\t", end="")
-    if responses is None:
+    if responses is None or stat is None:
         print("NO DATA")
         return
-    #delay_value = for [tup[0] for tup in stat]
-    delay_value = sum(tup[0] for tup in stat if tup[0] > part_duration_limit * 1000)
+    # blocking playlist requests: the expected hold is not a delay, only the excess is summed
+    delay_stat = stat.Excess_time if stat.Excess_time.Count > 0 else stat.Response_time
+    delay_value = delay_stat.sum_above(part_duration_limit * 1000)
 
     print(f"total: {responses[0]+responses[1]+responses[2]+responses[3]}\t| sum_delay={delay_value/1000:.1f}s") #sum(responses)
 
     print(f"\tok   : {responses[0]}\t|\t\t\t    min     avg     max     p50     p75     p95     p99")
 
-    t = calc_stat_values([tup[0] for tup in stat])
-    print(f"\t{color_response_value(responses[1], "stale", Colors.MAGENTA)}\t| response_time (ms):\t", end="") #MAGENTA
+    t = calc_stat_values(stat.Response_time)
+    print(f"\t{color_response_value(responses[1], 'stale', Colors.MAGENTA)}\t| response_time (ms):\t", end="") #MAGENTA
     for s in t:
         print(color_stat_value(s, part_duration_limit * 1000), end=" ")
     print()
 
-    t = calc_stat_values([tup[1] for tup in stat])
-    print(f"\t{color_response_value(responses[2], "delay", Colors.YELLOW)}\t| download_time (ms):\t", end="") #YELLOW
+    t = calc_stat_values(stat.Download_time)
+    print(f"\t{color_response_value(responses[2], 'delay', Colors.YELLOW)}\t| download_time (ms):\t", end="") #YELLOW
     for s in t:
         print(color_stat_value(s, 150), end=" ")
     print()    
 
-    t = calc_stat_values([tup[2]/1000/1000 for tup in stat])
-    print(f"\t{color_response_value(responses[3], "error", Colors.RED)}\t| download_speed(Mbps):\t", end="") #RED
+    t = calc_stat_values(stat.Download_speed, 1/1000/1000)
+    print(f"\t{color_response_value(responses[3], 'error', Colors.RED)}\t| download_speed(Mbps):\t", end="") #RED
     for s in t:
         print(color_stat_value(s, bandwidth_limit, reverse=True), end=" ")
-    print()    
+    print()
+
+    # response time of requests on a new connection includes TCP and TLS handshakes, so show it apart from warm ones
+    for sketch, text in [(stat.Response_time_new_conn, "new conn"), (stat.Response_time_reused_conn, "reused conn")]:
+        if sketch.Count == 0:
+            continue
+        print(f"\t{text}: {sketch.Count}\t| response_time (ms):\t", end="")
+        for s in calc_stat_values(sketch):
+            print(color_stat_value(s, part_duration_limit * 1000), end=" ")
+        print()
+
+    # response time of blocking playlist requests = expected hold (till the part is published, see holdtime.py) + excess,
+    # live edge = arrival behind the end of the newest part in program time, players stay PART-HOLD-BACK (>= 3 parts) behind it
+    for sketch, text, limit in [(stat.Hold_time, "hold", part_duration_limit), (stat.Excess_time, "excess", part_duration_limit), (stat.Live_latency, "live edge", part_duration_limit * 3)]:
+        if sketch.Count == 0:
+            continue
+        print(f"\t\t| {text + ' (ms):':<16}\t", end="")
+        for s in calc_stat_values(sketch):
+            print(color_stat_value(s, limit * 1000), end=" ")
+        print()
+
+    # where the response time goes: dns, connect, tls, send, wait (blocking-reload hold), body
+    for phase in ["dns", "connect", "tls", "send", "wait", "body"]:
+        sketch = stat.Phases.get(phase)
+        if sketch is None or sketch.Count == 0:
+            continue
+        print(f"\t\t| {phase + ' (ms):':<16}\t", end="")
+        for s in calc_stat_values(sketch):
+            print(color_stat_value(s, part_duration_limit * 1000), end=" ")
+        print()
     print()
 
     # print(f"total: {responses[0]+responses[1]+responses[2]}\t\t\t\t    min     avg     max     p50     p75     p95     p99")
@@ -616,11 +686,13 @@ def display_summary_substat_nocurses(section_name: str, responses: List[int], st
     # print(f"\terrors: {responses[2]}\tdownload_speed (Mbps):\tmin={t[0]:7.1f}, avg={t[1]:7.1f}, max={t[2]:7.1f}, p50={t[3]:7.1f}, p75={t[4]:7.1f}, p95={t[5]:7.1f}, p99={t[6]:7.1f}")
     # print()
 
-def display_summary_nocurses(master_playlist: M3U8, summary_response_manifests: Dict[int, List[int]], summary_stat_manifests: Dict[int, List[tuple[float, float, float]]], summary_response_parts: Dict[int, List[int]], summary_stat_parts: Dict[int, List[tuple[float, float, float]]], summary_manifest_part_durations: Dict[int, float] ) :
-    print(f"\nSUMMARY: {master_playlist.URI}\n")
+def display_summary_nocurses(master_playlist: M3U8, summary_response_manifests: Dict[int, List[int]], summary_stat_manifests: Dict[int, RequestStats], summary_response_parts: Dict[int, List[int]], summary_stat_parts: Dict[int, RequestStats], summary_manifest_part_durations: Dict[int, float], summary_suppressed_parts: Dict[int, tuple[int, int]] = None, media_indexes: List[int] = None, title: str = None) :
+    # media_indexes = media index of every rendition of the playlist (many streams in one process), 0..N-1 by default
+    print(f"\nSUMMARY: {title + ', ' if title else ''}{master_playlist.URI}\n")
 
-    media_index = 0
-    for media in master_playlist.Media_Streams:
+    if media_indexes is None:
+        media_indexes = list(range(len(master_playlist.Media_Streams)))
+    for media_index, media in zip(media_indexes, master_playlist.Media_Streams):
         parsed_url = urlparse(media.URI)                            
         filename = os.path.basename(parsed_url.path)        
 
@@ -637,6 +709,77 @@ def display_summary_nocurses(master_playlist: M3U8, summary_response_manifests:
         print(f"MEDIA #{media_index+1}: {filename}, {media.Resolution}, {bandwidth/1000/1000:.1f} Mbps ({media.Bandwidth}), Part={part_duration:.3f} sec")
         display_summary_substat_nocurses("  M3U8", summary_response_manifests.get(media_index), summary_stat_manifests.get(media_index), bandwidth/1000.0/1000.0, part_duration)
         display_summary_substat_nocurses("  PARTS", summary_response_parts.get(media_index), summary_stat_parts.get(media_index), bandwidth/1000.0/1000.0, part_duration)
+        if summary_suppressed_parts and media_index in summary_suppressed_parts:
+            duplicates, late = summary_suppressed_parts[media_index]
+            print(f"\tsuppressed parts: duplicate {duplicates}, late {late} (older than the playlist window)")
         print()
 
-        media_index += 1
+def display_h2_summary_nocurses(edge_stats: List[m3u8.H2EdgeStats]):
+    # multiplexing of streams over HTTP2 connections per edge
+    print("HTTP2 EDGES:")
+    for stats in edge_stats:
+        connections = len(stats.Streams_per_connection)
+        streams_per_connection = stats.Streams / connections if connections > 0 else 0.0
+        queue_time_avg = stats.Queue_time_total / stats.Streams if stats.Streams > 0 else 0.0
+        print(f"  {stats.Edge}")
+        print(f"	connections: {connections}	| streams: {stats.Streams} ({streams_per_connection:.1f} per connection), max concurrent: {stats.Max_in_flight}")
+        print(f"	behind blocking playlist: {stats.Requests_behind_playlist}	| queue before sending request (ms): avg {queue_time_avg:.1f}, max {stats.Queue_time_max:.1f}")
+    print()
+
+def display_delta_summary_nocurses(master_playlist: M3U8, delta_stats: Dict[int, m3u8.DeltaPlaylistStats]):
+    # delta playlists (_HLS_skip) per rendition, savings are against the last full playlist
+    print("DELTA PLAYLISTS:")
+    for media_index, media in enumerate(master_playlist.Media_Streams):
+        stats = delta_stats.get(media_index)
+        if stats is None:
+            continue
+        filename = os.path.basename(urlparse(media.URI).path)
+        bytes_saved_avg = stats.Bytes_Saved / stats.Delta_Requests if stats.Delta_Requests > 0 else 0.0
+        parse_time_saved_avg = stats.Parse_Time_Saved / stats.Delta_Requests if stats.Delta_Requests > 0 else 0.0
+        print(f"  MEDIA #{media_index+1}: {filename}")
+        print(f"	full: {stats.Full_Requests}	| delta: {stats.Delta_Requests}, merge failures: {stats.Merge_Failures}")
+        print(f"	bytes saved: {stats.Bytes_Saved/1000:.1f} KB ({bytes_saved_avg/1000:.1f} KB per delta)	| parse time saved: {stats.Parse_Time_Saved:.1f} ms ({parse_time_saved_avg:.2f} ms per delta)")
+    print()
+
+def display_prefetch_summary_nocurses(master_playlist: M3U8, prefetch_stats: Dict[int, "monitoring.PrefetchStats"]):
+    # parts of preload hints requested with the blocking playlist request, which one of them was available first and by how much
+    print("PRELOAD HINT PREFETCH:")
+    for media_index, media in enumerate(master_playlist.Media_Streams):
+        stats = prefetch_stats.get(media_index)
+        if stats is None:
+            continue
+        filename = os.path.basename(urlparse(media.URI).path)
+        print(f"  MEDIA #{media_index+1}: {filename}")
+        print(f"	pairs: {stats.Requests}, failed: {stats.Failed}	| part first: {stats.Part_First}	| playlist first: {stats.Playlist_First}")
+        for name, sketch in [("part lead", stats.Part_Lead), ("playlist lead", stats.Playlist_Lead)]:
+            if sketch.Count == 0:
+                continue
+            p50, p95, p99 = sketch.quantiles([0.50, 0.95, 0.99])
+            print(f"	{name}: p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms, max {sketch.Max:.1f} ms")
+    print()
+
+def display_skew_summary_nocurses(master_playlist: M3U8, skew: Dict[int, "monitoring.RenditionSkew"]):
+    # lag behind the leader of the stream by rendition reports of the playlists of the rendition
+    print("RENDITION SKEW (behind the leader of the stream):")
+    for media_index, media in enumerate(master_playlist.Media_Streams):
+        rendition_skew = skew.get(media_index)
+        if rendition_skew is None or rendition_skew.Samples == 0:
+            continue
+        filename = os.path.basename(urlparse(media.URI).path)
+        parts_p50, parts_p95 = rendition_skew.Parts.quantiles([0.50, 0.95])
+        lag_p50, lag_p95 = rendition_skew.Lag_time.quantiles([0.50, 0.95])
+        print(f"  MEDIA #{media_index+1}: {filename}")
+        print(f"	playlists: {rendition_skew.Samples}, behind: {rendition_skew.Behind} ({rendition_skew.Behind/rendition_skew.Samples:.0%})	| latest: {rendition_skew.Last_Parts} parts")
+        print(f"	parts: p50 {parts_p50:.1f}, p95 {parts_p95:.1f}, max {rendition_skew.Parts.Max:.0f}	| lag: p50 {lag_p50:.0f} ms, p95 {lag_p95:.0f} ms, max {rendition_skew.Lag_time.Max:.0f} ms")
+    print()
+
+def display_in_flight_summary_nocurses(master_playlist: M3U8, shards: Dict[int, "monitoring.InFlightShard"]):
+    # requests which never completed: timed out (evicted after the TTL) or orphaned (no result at all)
+    print("IN-FLIGHT REQUESTS:")
+    for media_index, media in enumerate(master_playlist.Media_Streams):
+        shard = shards.get(media_index)
+        if shard is None:
+            continue
+        filename = os.path.basename(urlparse(media.URI).path)
+        print(f"  MEDIA #{media_index+1}: {filename}\tmax in flight: {shard.Max_Depth}\t| timed out: {shard.Timed_Out}, orphaned: {shard.Orphaned}, finished after timeout: {shard.Finished_After_Timeout}")
+    print()
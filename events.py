@@ -0,0 +1,264 @@
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+
+import logs
+import m3u8
+import stats
+import timing
+
+# Columnar store of every finished request (playlists, parts, init files).
+# Every field is a numpy array (struct of arrays), rows are appended into chunks of CHUNK_ROWS.
+# A row takes ~69 bytes (ROW_BYTES) instead of ~1 KB of Python tuples and floats.
+# When chunks in RAM exceed the budget, the oldest full chunks are spilled to memory-mapped .npy files
+# (one file per column and chunk), so long runs keep all samples with bounded RAM.
+# Spilling is done by a background thread, add() only queues the full chunk; a full chunk is never written to,
+# so it's read by select() from RAM until the thread swaps it for its memory-mapped files.
+# The summary computes exact statistics from the columns with vectorised numpy, see request_stats().
+
+CHUNK_ROWS = 16384
+
+# NaN is "not measured" for float columns, -1 is "unknown" for integer columns
+COLUMNS: Dict[str, np.dtype] = {
+    "Timestamp": np.dtype(np.float64),          #unix time (s) when the request finished
+    "Media_index": np.dtype(np.int16),
+    "Segment": np.dtype(np.int64),              #media sequence number
+    "Part": np.dtype(np.int16),
+    "Type": np.dtype(np.int8),                  #index in TYPES
+    "HTTP_code": np.dtype(np.int16),
+    "Status": np.dtype(np.int8),                #monitoring.SummaryStatus value
+    "Connection_reused": np.dtype(np.int8),     #0 new, 1 reused, -1 unknown
+    "Response_time": np.dtype(np.float32),      #ms
+    "Download_time": np.dtype(np.float32),      #ms
+    "Download_speed": np.dtype(np.float32),     #bps
+}
+for _phase in timing.PHASES:
+    COLUMNS[f"Time_{_phase}"] = np.dtype(np.float32)  #ms
+COLUMNS["Time_hold"] = np.dtype(np.float32)     #ms, expected blocking-reload hold, see holdtime.py
+COLUMNS["Live_latency"] = np.dtype(np.float32)  #ms behind the live edge (EXT-X-PROGRAM-DATE-TIME)
+
+TYPES: List[m3u8.TypeDownload] = list(m3u8.TypeDownload)
+_TYPE_INDEX = {t: i for i, t in enumerate(TYPES)}
+
+_MEASURED_COLUMNS = ["Response_time", "Download_time", "Download_speed"] + [f"Time_{phase}" for phase in timing.PHASES] + ["Time_hold", "Live_latency"]
+
+ROW_BYTES = sum(dtype.itemsize for dtype in COLUMNS.values())
+
+
+def _new_chunk() -> Dict[str, np.ndarray]:
+    return {name: np.empty(CHUNK_ROWS, dtype) for name, dtype in COLUMNS.items()}
+
+def _value(value, default):
+    return default if value is None else value
+
+
+class EventStats:
+    # Exact statistics of selected events with the attributes of stats.RequestStats
+    Response_time: stats.ArrayStats
+    Download_time: stats.ArrayStats
+    Download_speed: stats.ArrayStats
+    Response_time_new_conn: stats.ArrayStats
+    Response_time_reused_conn: stats.ArrayStats
+    Phases: Dict[str, stats.ArrayStats]
+    Hold_time: stats.ArrayStats
+    Excess_time: stats.ArrayStats
+    Live_latency: stats.ArrayStats
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        response_time = columns["Response_time"]
+        self.Response_time = stats.ArrayStats(response_time)
+        self.Download_time = stats.ArrayStats(columns["Download_time"])
+        self.Download_speed = stats.ArrayStats(columns["Download_speed"])
+        self.Response_time_new_conn = stats.ArrayStats(response_time[columns["Connection_reused"] == 0])
+        self.Response_time_reused_conn = stats.ArrayStats(response_time[columns["Connection_reused"] == 1])
+        self.Phases = {phase: stats.ArrayStats(columns[f"Time_{phase}"]) for phase in timing.PHASES}
+        hold_time = columns["Time_hold"]
+        self.Hold_time = stats.ArrayStats(hold_time)
+        self.Excess_time = stats.ArrayStats(response_time - hold_time)
+        self.Live_latency = stats.ArrayStats(columns["Live_latency"])
+
+
+class EventStore:
+    Ram_budget: int                     #bytes of chunks kept in RAM
+    Spill_dir: str                      #directory of spilled chunks, temporary if not set
+    Count: int
+    Spilled_chunks: int
+
+    def __init__(self, ram_budget: int = 64 * 1024 * 1024, spill_dir: str = None):
+        self.Ram_budget = max(ram_budget, CHUNK_ROWS * ROW_BYTES)
+        self.Spill_dir = spill_dir
+        self.Count = 0
+        self.Spilled_chunks = 0
+        self._own_spill_dir = False
+        self._lock = threading.Lock()
+        self._chunks: List[Dict[str, np.ndarray]] = []  #full chunks, in RAM or memory-mapped
+        self._chunks_in_ram: List[int] = []              #indexes of full chunks in RAM, oldest first
+        self._current = _new_chunk()
+        self._rows = 0
+        self._spill_queue: queue.Queue = queue.Queue()  #indexes of full chunks to spill, None stops the thread
+        self._spill_thread: threading.Thread = None
+        self._spill_pending = 0                          #chunks queued and not spilled yet, still in RAM
+
+    def add(self, type: m3u8.TypeDownload, media_index: int, segment: int, part: int, status: int, metrics: m3u8.DownloadMetrics = None):
+        with self._lock:
+            row = self._rows
+            c = self._current
+            c["Timestamp"][row] = time.time()
+            c["Media_index"][row] = _value(media_index, -1)
+            c["Segment"][row] = _value(segment, -1)
+            c["Part"][row] = _value(part, -1)
+            c["Type"][row] = _TYPE_INDEX.get(type, 0)
+            c["Status"][row] = status
+            if metrics is None:
+                c["HTTP_code"][row] = -1
+                c["Connection_reused"][row] = -1
+                for name in _MEASURED_COLUMNS:
+                    c[name][row] = np.nan
+            else:
+                c["HTTP_code"][row] = _value(metrics.HTTP_code, -1)
+                c["Connection_reused"][row] = -1 if metrics.Connection_reused is None else int(metrics.Connection_reused)
+                c["Response_time"][row] = _value(metrics.Response_time, np.nan)
+                c["Download_time"][row] = _value(metrics.Download_time, np.nan)
+                c["Download_speed"][row] = _value(metrics.Download_speed, np.nan)
+                for phase, value in metrics.phases_ms().items():
+                    c[f"Time_{phase}"][row] = _value(value, np.nan)
+                c["Time_hold"][row] = _value(metrics.Time_hold, np.nan)
+                c["Live_latency"][row] = _value(metrics.Live_latency, np.nan)
+            self._rows += 1
+            self.Count += 1
+            if self._rows == CHUNK_ROWS:
+                self._chunks.append(self._current)
+                self._chunks_in_ram.append(len(self._chunks) - 1)
+                self._current = _new_chunk()
+                self._rows = 0
+                while (len(self._chunks_in_ram) + 1) * CHUNK_ROWS * ROW_BYTES > self.Ram_budget:
+                    self._queue_spill(self._chunks_in_ram.pop(0))
+
+    def _queue_spill(self, chunk_index: int):
+        # called with self._lock held
+        if self._spill_thread is None:
+            self._spill_thread = threading.Thread(target=self._run_spill, name="EventSpill", daemon=True)
+            self._spill_thread.start()
+        self._spill_pending += 1
+        self._spill_queue.put(chunk_index)
+
+    def _run_spill(self):
+        while True:
+            chunk_index = self._spill_queue.get()
+            try:
+                if chunk_index is None:
+                    return
+                self._spill(chunk_index)
+            except OSError as e:
+                # the chunk stays in RAM
+                with self._lock:
+                    self._spill_pending -= 1
+                logs.write_exception(e)
+            finally:
+                self._spill_queue.task_done()
+
+    def _spill(self, chunk_index: int):
+        # files are written without the lock, only the swap of the chunk for its memory-mapped files takes it
+        if self.Spill_dir is None:
+            self.Spill_dir = tempfile.mkdtemp(prefix="ll-hls-events_")
+            self._own_spill_dir = True
+        os.makedirs(self.Spill_dir, exist_ok=True)
+        with self._lock:
+            chunk = self._chunks[chunk_index]
+        mapped_chunk = {}
+        for name, values in chunk.items():
+            path = os.path.join(self.Spill_dir, f"chunk{chunk_index:06d}_{name}.npy")
+            mapped = np.lib.format.open_memmap(path, mode="w+", dtype=values.dtype, shape=values.shape)
+            mapped[:] = values
+            mapped.flush()
+            del mapped
+            mapped_chunk[name] = np.load(path, mmap_mode="r")
+        with self._lock:
+            self._chunks[chunk_index] = mapped_chunk
+            self._spill_pending -= 1
+            self.Spilled_chunks += 1
+
+    def wait_spilled(self):
+        # blocks until every queued chunk is spilled
+        self._spill_queue.join()
+
+    @property
+    def nbytes_in_ram(self) -> int:
+        with self._lock:
+            return (len(self._chunks_in_ram) + self._spill_pending + 1) * CHUNK_ROWS * ROW_BYTES
+
+    def select(self, media_index: int = None, types: List[m3u8.TypeDownload] = None, names: List[str] = None) -> Dict[str, np.ndarray]:
+        # columns of matching events, only matching rows of every chunk are copied
+        names = names or list(COLUMNS)
+        with self._lock:
+            chunks = self._chunks + [{name: values[:self._rows] for name, values in self._current.items()}]
+        type_codes = [_TYPE_INDEX[t] for t in types] if types is not None else None
+        parts: Dict[str, List[np.ndarray]] = {name: [] for name in names}
+        for chunk in chunks:
+            mask = np.ones(len(chunk["Type"]), dtype=bool)
+            if media_index is not None:
+                mask &= chunk["Media_index"] == media_index
+            if type_codes is not None:
+                mask &= np.isin(chunk["Type"], type_codes)
+            for name in names:
+                parts[name].append(chunk[name][mask])
+        return {name: np.concatenate(parts[name]) for name in names}
+
+    def request_stats(self, media_index: int, types: List[m3u8.TypeDownload]) -> EventStats:
+        return EventStats(self.select(media_index, types))
+
+    def save(self):
+        # spills every chunk, so Spill_dir keeps all events for post-run analysis (see load_event_store)
+        with self._lock:
+            if self._rows > 0:
+                self._chunks.append({name: values[:self._rows].copy() for name, values in self._current.items()})
+                self._chunks_in_ram.append(len(self._chunks) - 1)
+                self._current = _new_chunk()
+                self._rows = 0
+            while self._chunks_in_ram:
+                self._queue_spill(self._chunks_in_ram.pop(0))
+        self.wait_spilled()
+
+    def close(self):
+        # events are saved to the directory set by the user, the temporary spill directory is removed
+        if self.Spill_dir is not None and not self._own_spill_dir:
+            self.save()
+        self.wait_spilled()
+        if self._spill_thread is not None:
+            self._spill_queue.put(None)
+            self._spill_thread.join()
+            self._spill_thread = None
+        with self._lock:
+            self._chunks = []
+            self._chunks_in_ram = []
+            if self._own_spill_dir:
+                shutil.rmtree(self.Spill_dir, ignore_errors=True)
+                self.Spill_dir = None
+                self._own_spill_dir = False
+
+    def __len__(self):
+        return self.Count
+
+    def __repr__(self):
+        return f"EventStore(Count={self.Count}, Spilled_chunks={self.Spilled_chunks}, Spill_dir={self.Spill_dir})"
+
+
+def load_event_store(directory: str) -> EventStore:
+    # memory-maps events saved by EventStore.save()
+    store = EventStore(spill_dir=directory)
+    chunk_index = 0
+    while True:
+        files = {name: os.path.join(directory, f"chunk{chunk_index:06d}_{name}.npy") for name in COLUMNS}
+        if not all(os.path.exists(path) for path in files.values()):
+            break
+        store._chunks.append({name: np.load(path, mmap_mode="r") for name, path in files.items()})
+        store.Count += len(store._chunks[-1]["Type"])
+        chunk_index += 1
+    store.Spilled_chunks = chunk_index
+    return store
@@ -0,0 +1,237 @@
+import http.server
+import math
+import threading
+from typing import Callable, Dict, List
+
+import m3u8
+
+# Prometheus/OpenMetrics endpoint of a running probe, no dependencies (http.server of the standard library):
+#
+# python app.py https://example.com/master.m3u8 --headless --metrics-port 9464
+# curl http://localhost:9464/metrics
+#
+# Series are labelled by stream, rendition, type (m3u8.TypeDownload) and status (monitoring.SummaryStatus):
+#   llhls_requests_total                    counter of requests (OK, STALE, DELAY, ERROR by the status label)
+#   llhls_response_seconds                  histogram of the response time (request to the last byte)
+#   llhls_hold_seconds                      histogram of the server wait (request sent to headers, includes blocking-reload hold)
+#   llhls_download_seconds                  histogram of the body download time
+#   llhls_throughput_bits_per_second        histogram of the download speed
+#   llhls_live_edge_seconds                 histogram of the arrival behind the end of the newest part in program time
+#   llhls_live_edge_ahead_total             counter of arrivals ahead of the live edge (probe clock behind the packager),
+#   llhls_live_edge_ahead_seconds_total     and how far ahead; they are not observed by the histogram, so its _sum never goes down
+# The text formats have classic buckets only, here they are powers of 2 as the buckets of native histograms with schema 0.
+#
+# Requests are observed by download threads without a shared lock: every thread counts into its own shard
+# and a scrape adds the shards up. Worker processes (see sharding.py) send snapshots of their series to the parent.
+
+# bucket boundaries 2^exponent, values above the last one are counted in +Inf
+SECONDS_EXPONENTS = (-10, 6)            #~1 ms .. 64 s
+BITS_PER_SECOND_EXPONENTS = (16, 34)    #~65 kbps .. ~17 Gbps
+
+class Histogram:
+    Name: str
+    Help: str
+    Min_exponent: int
+    Max_exponent: int
+    Bounds: List[float]
+
+    def __init__(self, name: str, help: str, exponents: tuple[int, int]):
+        self.Name = name
+        self.Help = help
+        self.Min_exponent, self.Max_exponent = exponents
+        self.Bounds = [2.0 ** e for e in range(self.Min_exponent, self.Max_exponent + 1)]
+
+    def bucket(self, value: float) -> int:
+        # index of the first bound >= value, len(Bounds) = +Inf; frexp is exact for powers of 2
+        if value <= 0:
+            return 0
+        mantissa, exponent = math.frexp(value)     #value = mantissa * 2^exponent, 0.5 <= mantissa < 1
+        if mantissa == 0.5:
+            exponent -= 1
+        return min(max(exponent - self.Min_exponent, 0), len(self.Bounds))
+
+LIVE_EDGE = Histogram("llhls_live_edge_seconds", "Arrival behind the end of the newest part in program time (EXT-X-PROGRAM-DATE-TIME)", SECONDS_EXPONENTS)
+
+HISTOGRAMS = [
+    Histogram("llhls_response_seconds", "Response time of requests (request to the last byte)", SECONDS_EXPONENTS),
+    Histogram("llhls_hold_seconds", "Server wait from request sent to response headers, includes blocking-reload hold", SECONDS_EXPONENTS),
+    Histogram("llhls_download_seconds", "Download time of response bodies", SECONDS_EXPONENTS),
+    Histogram("llhls_throughput_bits_per_second", "Download speed of response bodies", BITS_PER_SECOND_EXPONENTS),
+    LIVE_EDGE,
+]
+
+def _values_of(metrics: m3u8.DownloadMetrics) -> List[float]:
+    # in order of HISTOGRAMS, None = not measured (e.g. hold time of some protocols)
+    return [
+        metrics.Response_time / 1000 if metrics.Response_time is not None else None,
+        metrics.Time_wait / 1000 if metrics.Time_wait is not None else None,
+        metrics.Download_time / 1000 if metrics.Download_time is not None else None,
+        metrics.Download_speed,
+        metrics.Live_latency / 1000 if metrics.Live_latency is not None else None,
+    ]
+
+
+class SeriesValues:
+    # counter and histograms of one label set, written by one thread only
+    Count: int
+    Buckets: List[List[int]]    #per histogram: counts of buckets (not cumulative), the last one is +Inf
+    Sums: List[float]
+    Ahead: int                  #negative live-edge latencies, not observed by LIVE_EDGE
+    Ahead_sum: float            #seconds ahead (absolute values)
+
+    def __init__(self):
+        self.Count = 0
+        self.Buckets = [[0] * (len(h.Bounds) + 1) for h in HISTOGRAMS]
+        self.Sums = [0.0] * len(HISTOGRAMS)
+        self.Ahead = 0
+        self.Ahead_sum = 0.0
+
+    def add(self, metrics: m3u8.DownloadMetrics):
+        self.Count += 1
+        if metrics is None:
+            return
+        for i, value in enumerate(_values_of(metrics)):
+            if value is None:
+                continue
+            if value < 0 and HISTOGRAMS[i] is LIVE_EDGE:
+                self.Ahead += 1
+                self.Ahead_sum -= value
+                continue
+            self.Buckets[i][HISTOGRAMS[i].bucket(value)] += 1
+            self.Sums[i] += value
+
+    def merge(self, other: "SeriesValues"):
+        self.Count += other.Count
+        for i in range(len(HISTOGRAMS)):
+            buckets = self.Buckets[i]
+            for j, count in enumerate(other.Buckets[i]):
+                buckets[j] += count
+            self.Sums[i] += other.Sums[i]
+        self.Ahead += other.Ahead
+        self.Ahead_sum += other.Ahead_sum
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_bound(bound: float) -> str:
+    return repr(bound) if bound < 1 else f"{bound:.1f}"
+
+
+class MetricsRegistry:
+    # series by (media index, type, status), labels of a media index are resolved at scrape time
+    Labels: Callable[[int], tuple[str, str]]    #media index -> (stream, rendition)
+
+    def __init__(self, labels: Callable[[int], tuple[str, str]] = None):
+        self.Labels = labels or (lambda media_index: ("", str(media_index)))
+        self._local = threading.local()
+        self._shards: List[Dict[tuple, SeriesValues]] = []
+        self._shards_lock = threading.Lock()
+        self._remote: Dict[int, Dict[tuple, SeriesValues]] = {}
+        self._server: http.server.ThreadingHTTPServer = None
+
+    def _shard(self) -> Dict[tuple, SeriesValues]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            # once per thread
+            shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def observe(self, type: m3u8.TypeDownload, media_index: int, status_name: str, metrics: m3u8.DownloadMetrics = None):
+        shard = self._shard()
+        key = (media_index, type.name, status_name)
+        series = shard.get(key)
+        if series is None:
+            series = shard[key] = SeriesValues()
+        series.add(metrics)
+
+    def snapshot(self) -> Dict[tuple, SeriesValues]:
+        # all shards added up; a series being written may be one request behind, the next scrape has it
+        with self._shards_lock:
+            shards = list(self._shards)
+        merged: Dict[tuple, SeriesValues] = {}
+        for shard in shards + list(self._remote.values()):
+            for key, series in list(shard.items()):     #list() of a dict is atomic, a writer may add keys meanwhile
+                merged.setdefault(key, SeriesValues()).merge(series)
+        return merged
+
+    def set_remote(self, worker: int, snapshot: Dict[tuple, SeriesValues]):
+        # the latest snapshot of a worker process, its series are cumulative
+        self._remote[worker] = snapshot
+
+    def _label_text(self, media_index: int, type_name: str, status_name: str) -> str:
+        stream, rendition = self.Labels(media_index)
+        return f'stream="{_escape(stream)}",rendition="{_escape(rendition)}",type="{type_name}",status="{status_name}"'
+
+    def render(self, openmetrics: bool = False) -> str:
+        series = sorted(self.snapshot().items())
+        labels = {key: self._label_text(*key) for key, _ in series}
+
+        # OpenMetrics names the counter family without the _total suffix of its samples, the text format names it as the samples
+        counter = "llhls_requests" if openmetrics else "llhls_requests_total"
+        lines = [
+            f"# HELP {counter} Requests by summary status",
+            f"# TYPE {counter} counter",
+        ]
+        for key, values in series:
+            lines.append(f"llhls_requests_total{{{labels[key]}}} {values.Count}")
+        for i, histogram in enumerate(HISTOGRAMS):
+            lines.append(f"# HELP {histogram.Name} {histogram.Help}")
+            lines.append(f"# TYPE {histogram.Name} histogram")
+            for key, values in series:
+                # +Inf and _count are the total of the same copy of bucket counts, so a request observed meanwhile can't make them lower than a bucket
+                buckets = list(values.Buckets[i])
+                total = sum(buckets)
+                if total == 0:
+                    continue
+                cumulative = 0
+                for bound, count in zip(histogram.Bounds, buckets):
+                    cumulative += count
+                    lines.append(f'{histogram.Name}_bucket{{{labels[key]},le="{_format_bound(bound)}"}} {cumulative}')
+                lines.append(f'{histogram.Name}_bucket{{{labels[key]},le="+Inf"}} {total}')
+                lines.append(f"{histogram.Name}_sum{{{labels[key]}}} {values.Sums[i]}")
+                lines.append(f"{histogram.Name}_count{{{labels[key]}}} {total}")
+        for name, help, value_of in [("llhls_live_edge_ahead", "Arrivals ahead of the live edge in program time (probe clock behind the packager)", lambda v: v.Ahead),
+                                     ("llhls_live_edge_ahead_seconds", "Seconds ahead of the live edge of arrivals ahead of it", lambda v: v.Ahead_sum)]:
+            family = name if openmetrics else f"{name}_total"
+            lines.append(f"# HELP {family} {help}")
+            lines.append(f"# TYPE {family} counter")
+            for key, values in series:
+                if values.Ahead > 0:
+                    lines.append(f"{name}_total{{{labels[key]}}} {value_of(values)}")
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, address: str = ""):
+        # scrapes are served by their own threads, downloads never wait for them
+        registry = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+                body = registry.render(openmetrics).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8" if openmetrics else "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer((address, port), MetricsHandler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="MetricsExporter", daemon=True).start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
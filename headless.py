@@ -0,0 +1,93 @@
+import datetime
+import json
+import sys
+import threading
+from typing import Callable, Dict, List, TextIO
+
+import m3u8
+
+# Headless mode for probes without a terminal: curses is never imported and nothing is drawn.
+# Every finished request is written as one JSON line (NDJSON) to the stream (stdout by default),
+# and a summary of all renditions is written every Summary_interval seconds and once at the end.
+#
+# {"event": "request", "ts": "...", "media_index": 0, "type": "FILE_PART", "segment": 101, "part": 2, "summary": "OK", ...}
+# {"event": "summary", "ts": "...", "final": false, "renditions": [{"media_index": 0, "parts": {...}, ...}]}
+
+class HeadlessReporter:
+    Stream: TextIO
+    Summary_interval: float     #seconds, 0 = only the final summary
+
+    def __init__(self, stream: TextIO = None, summary_interval: float = 60.0):
+        self.Stream = stream if stream is not None else sys.stdout
+        self.Summary_interval = summary_interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread = None
+        self._summary: Callable[[], List[Dict]] = None
+
+    def _write(self, record: Dict):
+        line = json.dumps(record, separators=(",", ":"), default=str)
+        with self._lock:
+            self.Stream.write(line + "\n")
+
+    def write_line(self, line: str):
+        # a line written by the reporter of a worker process (see sharding.py)
+        with self._lock:
+            self.Stream.write(line + "\n")
+
+    def write_request(self, type: m3u8.TypeDownload, media_index: int, segment: int, part: int, summary: str, status: str, metrics: m3u8.DownloadMetrics = None):
+        record = {
+            "event": "request",
+            "ts": datetime.datetime.now(datetime.UTC).isoformat(timespec="milliseconds"),
+            "media_index": media_index,
+            "type": str(type),
+            "segment": segment,
+            "part": part,
+            "summary": summary,
+            "status": status,
+        }
+        if metrics is not None:
+            record.update({
+                "http_code": metrics.HTTP_code,
+                "response_ms": metrics.Response_time,
+                "download_ms": metrics.Download_time,
+                "speed_bps": metrics.Download_speed,
+                "reused": metrics.Connection_reused,
+                "phases_ms": metrics.phases_ms(),
+                "hold_ms": metrics.Time_hold,
+                "excess_ms": metrics.excess_time() if metrics.Time_hold is not None else None,
+                "live_ms": metrics.Live_latency,
+            })
+        self._write(record)
+
+    def write_summary(self, final: bool = False):
+        if self._summary is None:
+            return
+        self._write({
+            "event": "summary",
+            "ts": datetime.datetime.now(datetime.UTC).isoformat(timespec="milliseconds"),
+            "final": final,
+            "renditions": self._summary(),
+        })
+        self.Stream.flush()
+
+    def start(self, summary: Callable[[], List[Dict]]):
+        # summary() returns the current summary per rendition, it's called from the reporter thread
+        self._summary = summary
+        if self.Summary_interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="HeadlessSummary", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.Summary_interval):
+            self.write_summary()
+
+    def stop(self):
+        # writes the final summary
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.write_summary(final=True)
@@ -0,0 +1,85 @@
+import collections
+import threading
+from typing import Dict
+
+import m3u8
+
+# A blocking playlist request (_HLS_msn=N&_HLS_part=P) is held by the server till part N.P is published, so its
+# response time = expected hold (waiting for the part) + excess (delivery, the rest). Only the excess is a delay.
+#
+# The publish time of a part is estimated by the PublishClock of the stream, shared by all its renditions
+# (renditions of a stream are published in lockstep with the same MSN and part numbers; with --processes they stay
+# in one worker, see sharding.shard_renditions):
+# – with EXT-X-PROGRAM-DATE-TIME: end of the part in program time + offset of the packager clock to this one;
+#   the offset is the minimum of (first seen − end of the part) over recent parts, a part is never seen before
+#   it's published
+# – without it: the first time any rendition saw the previous part + duration of the part
+# The first rendition which sees a part bounds its publish time for all of them, so a delivery delay common to all
+# requests of all renditions is in the offset and not in the excess: the excess is the delay above the best delivery.
+
+FIRST_SEEN_PARTS = 512      #parts with the time they were first seen in a playlist, oldest are dropped
+OFFSET_SAMPLES = 256        #recent (first seen − end of the part) samples, the offset is their minimum
+
+def _hold(published_at: float, sent_at: float, arrived_at: float) -> float:
+    return min(max(published_at - sent_at, 0.0), arrived_at - sent_at) * 1000
+
+class PublishClock:
+    Name: str
+    First_seen: Dict[tuple[int, int], float]    #(msn, part) -> unix time of the first playlist with the part as the last one
+    Offsets: collections.deque                  #seconds
+
+    def __init__(self, name: str = ""):
+        self.Name = name
+        self.First_seen = collections.OrderedDict()
+        self.Offsets = collections.deque(maxlen=OFFSET_SAMPLES)
+        self._lock = threading.Lock()
+
+    def _seen(self, part: m3u8.MediaPart, arrived_at: float):
+        key = (part.Segment, part.PartNum)
+        first_seen = self.First_seen.get(key)
+        if first_seen is not None and first_seen <= arrived_at:
+            return
+        self.First_seen[key] = arrived_at
+        if first_seen is None and len(self.First_seen) > FIRST_SEEN_PARTS:
+            self.First_seen.popitem(last=False)
+        if part.Program_time is not None:
+            self.Offsets.append(arrived_at - part.Program_time - part.Duration)
+
+    def expected_hold(self, playlist: m3u8.M3U8, msn: int, part_num: int, sent_at: float, arrived_at: float) -> float:
+        # ms of the response of a blocking request for msn.part_num the server was expected to hold it,
+        # None if the publish time of the part cannot be estimated (e.g. the part is not in the playlist)
+        parts = playlist.Media_Parts
+        if not parts:
+            return None
+        target = previous = None
+        for i in range(len(parts) - 1, -1, -1):
+            if parts[i].Segment == msn and parts[i].PartNum == part_num:
+                target = parts[i]
+                previous = parts[i - 1] if i > 0 else None
+                break
+            if parts[i].Segment < msn:
+                break
+
+        with self._lock:
+            self._seen(parts[-1], arrived_at)
+            if target is None:
+                return None
+            if target.Program_time is not None and self.Offsets:
+                published_at = target.Program_time + target.Duration + min(self.Offsets)
+            elif previous is not None and (previous.Segment, previous.PartNum) in self.First_seen:
+                published_at = self.First_seen[(previous.Segment, previous.PartNum)] + target.Duration
+            else:
+                return None
+        return _hold(published_at, sent_at, arrived_at)
+
+    def expected_hold_after(self, previous: tuple[int, int], duration: float, sent_at: float, arrived_at: float) -> float:
+        # ms of the response of a request for the part after `previous` (msn, part) which is not in any playlist yet,
+        # e.g. a preload hint requested before the playlist with the part; None if the previous part was never seen
+        with self._lock:
+            first_seen = self.First_seen.get(previous)
+        if first_seen is None:
+            return None
+        return _hold(first_seen + duration, sent_at, arrived_at)
+
+    def __repr__(self):
+        return f"PublishClock(Name='{self.Name}', First_seen={len(self.First_seen)}, Offsets={len(self.Offsets)})"
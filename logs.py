@@ -1,48 +1,171 @@
+import csv
+import io
+import json
 import logging
 import logging.handlers
-from datetime import datetime
+from datetime import datetime, timezone
+from enum import Enum
 import os
+import queue
 import sys
 import threading
+import time
 import traceback
 import atexit
 
-from httpx import ProtocolError, RequestError
+from httpx import RequestError
 
 _logger: logging.Logger = None
-
-def init_logs():
-    global _logger
+_listener: logging.handlers.QueueListener = None
+_log_format = None
+
+class LogFormat(Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
+
+    def __str__(self):
+        return self.value
+
+# Records are written by a background thread, the download thread only puts the record into a queue.
+# The file is flushed every FLUSH_RECORDS records or FLUSH_INTERVAL_S seconds (also when no record follows) and on exit,
+# so a slow disk is never waited for by the thread that measures the next request.
+FLUSH_RECORDS = 256
+FLUSH_INTERVAL_S = 1.0
+
+def _fields(value) -> list:
+    # values of a record in order, dicts (e.g. response headers) are flattened
+    if isinstance(value, dict):
+        fields = []
+        for v in value.values():
+            fields.extend(_fields(v) if isinstance(v, dict) else [v])
+        return fields
+    if isinstance(value, (tuple, list)):
+        return list(value)
+    return [value]
+
+class CsvFormatter(logging.Formatter):
+    # time,level,field,... with quoting of csv (commas, quotes and new lines of values are kept)
+    def format(self, record: logging.LogRecord) -> str:
+        fields = [f"{self.formatTime(record, '%Y-%m-%d %H:%M:%S')}.{int(record.msecs):03d}", record.levelname]
+        fields.extend(_fields(record.msg) if isinstance(record.msg, (dict, tuple)) else [record.getMessage()])
+        if record.exc_info:
+            fields.append(self.formatException(record.exc_info))
+        if record.stack_info:
+            fields.append(self.formatStack(record.stack_info))
+        text = io.StringIO()
+        csv.writer(text, lineterminator="").writerow(["" if f is None else f for f in fields])
+        return text.getvalue()
+
+class NdjsonFormatter(logging.Formatter):
+    # {"ts": ..., "level": ..., field: value, ...} one JSON object per line
+    def format(self, record: logging.LogRecord) -> str:
+        obj = {"ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"), "level": record.levelname}
+        if isinstance(record.msg, dict):
+            obj.update(record.msg)
+        elif isinstance(record.msg, tuple):
+            obj["fields"] = record.msg
+        else:
+            obj["message"] = record.getMessage()
+        if record.exc_info:
+            obj["traceback"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            obj["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(obj, separators=(",", ":"), default=str)
+
+class BatchedFileHandler(logging.FileHandler):
+    # FileHandler flushes after every record, here the file buffer is flushed on size or time
+    def __init__(self, filename: str, flush_records: int = FLUSH_RECORDS, flush_interval: float = FLUSH_INTERVAL_S):
+        super().__init__(filename, "a", encoding="utf-8")
+        self.Flush_records = flush_records
+        self.Flush_interval = flush_interval
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        # called by emit() after every record
+        self._pending += 1
+        now = time.monotonic()
+        if self._pending >= self.Flush_records or now - self._last_flush >= self.Flush_interval:
+            self._flush_now(now)
+
+    def _flush_now(self, now: float):
+        super().flush()
+        self._pending = 0
+        self._last_flush = now
+
+    def flush_due(self):
+        # called by the listener when no record came, so records are not kept in the buffer longer than Flush_interval
+        self.acquire()
+        try:
+            now = time.monotonic()
+            if self.stream is not None and self._pending > 0 and now - self._last_flush >= self.Flush_interval:
+                self._flush_now(now)
+        finally:
+            self.release()
+
+    def close(self):
+        self.acquire()
+        try:
+            if self.stream is not None:
+                self._flush_now(time.monotonic())
+        finally:
+            self.release()
+        super().close()
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # QueueHandler formats the message on the calling thread, here the record goes to the queue as it is
+    # and the listener thread formats it (messages are tuples/dicts/strings created for the record)
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+class BatchedQueueListener(logging.handlers.QueueListener):
+    # waits for a record at most FLUSH_INTERVAL_S, then flushes the records buffered by BatchedFileHandler
+    def dequeue(self, block: bool) -> logging.LogRecord:
+        while True:
+            try:
+                return self.queue.get(block, FLUSH_INTERVAL_S)
+            except queue.Empty:
+                if not block:
+                    raise
+                for handler in self.handlers:
+                    if isinstance(handler, BatchedFileHandler):
+                        handler.flush_due()
+
+def init_logs(log_format: LogFormat = LogFormat.CSV, suffix: str = ""):
+    # suffix of the file name, e.g. worker processes write their own files
+    global _logger, _listener, _log_format
 
     # Setup logger
     current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    log_filename = f"ll-hls-log_{current_time}.log"
+    log_filename = f"ll-hls-log_{current_time}{suffix}.{'ndjson' if log_format == LogFormat.NDJSON else 'log'}"
     log_directory = "logs/"
-    # logging.basicConfig(filename=log_filename,
-    #                 filemode='a',
-    #                 format='%(asctime)s.%(msecs)03d,%(levelname)s,%(message)s',
-    #                 datefmt='%Y-%m-%d %H:%M:%S',
-    #                 level=logging.INFO)
     
     l = logging.getLogger("ll-hls")
     l.setLevel(logging.INFO)
-    l.handlers.clear()    
+    l.handlers.clear()
+    l.propagate = False
     os.makedirs(log_directory, exist_ok=True)
-    h = logging.FileHandler(log_directory + log_filename, "a")
+    h = BatchedFileHandler(log_directory + log_filename)
     h.setLevel(logging.INFO)
-    h.setFormatter(logging.Formatter(fmt='%(asctime)s.%(msecs)03d,%(levelname)s,%(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
-    l.addHandler(h)
+    h.setFormatter(NdjsonFormatter() if log_format == LogFormat.NDJSON else CsvFormatter())
 
-    # l.debug("This is a debug message")
-    # l.info("This is an info message")
-    # l.warning("This is a warning message")
-    # l.error("This is an error message")
-    # l.exception("This is an exception message")
-    # l.critical("This is a critical message")
+    if _listener is not None:
+        _listener.stop()
+    _listener = BatchedQueueListener(queue.SimpleQueue(), h, respect_handler_level=True)
+    l.addHandler(DeferredQueueHandler(_listener.queue))
+    _listener.start()
 
     _logger = l
+    _log_format = log_format
     pass
 
+def get_log_format() -> LogFormat:
+    return _log_format
+
+
+def print_error(message: str):
+    # messages for the user go to stderr: in headless mode stdout carries only NDJSON records
+    print(message, file=sys.stderr)
 
 # Function to handle uncaught exceptions
 def log_uncaught_exceptions(ex_cls, ex, tb):
@@ -55,65 +178,47 @@ sys.excepthook = log_uncaught_exceptions
 def close_log_handlers():
     global _logger
 
+    # logs are not initialized by tools which only import modules, e.g. benchmarks
+    if _logger is None:
+        return
+
     #_logger.info("Shutting down logging system.")
-    for handler in _logger.handlers:
+    for handler in list(_logger.handlers):
         handler.close()
         _logger.removeHandler(handler)
+    # writes the queued records and closes the file
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
 
 atexit.register(close_log_handlers)
 
 
-def escape_comma(obj: tuple) -> str:
-    text = ""
-    if isinstance(obj, str):
-        text = obj.replace(',', '.')
-    elif isinstance(obj, tuple):
-        escaped_elements = []
-        for element in obj:
-            escaped_elements.append(str(element).replace(',', '.'))
-        text = ",".join(escaped_elements)   
-    else:
-        text = str(obj)
-        text = text.replace(',', '.')
-    return text
-
-def write_info(obj: tuple):
+def write_info(obj):
     global _logger
 
-    text = escape_comma(obj)
-    _logger.info(text)
+    _logger.info(obj)
 
-def write_warning(obj: tuple):
+def write_warning(obj):
     global _logger
 
-    text = escape_comma(obj)
-    _logger.warning(text)
+    _logger.warning(obj)
 
-def write_error(obj: tuple):
+def write_error(obj):
     global _logger
 
-    text = escape_comma(obj)
-    _logger.error(text)
+    _logger.error(obj)
 
 def write_exception(e):
     global _logger
 
-    # threading.current_thread().name,
-    if isinstance(e, ProtocolError):
-        _logger.error(",\"%s %s %s %s %s\"", type(e), e, e.args, e.request, threading.current_thread().name) 
-        #_logger.error("This is an ProtocolError error message")
-        pass
     if isinstance(e, RequestError):
-        _logger.error(",\"%s %s %s %s %s\"", type(e), e, e.args, e.request, threading.current_thread().name)
-        #_logger.error("This is an RequestError error message")
-        pass
-    elif isinstance(e, Exception):
-        _logger.exception(",\"%s %s %s %s\"", type(e), e, e.args, threading.current_thread().name, exc_info=True, stack_info=True, stacklevel=1)
-        #_logger.error("This is an Exception error message")
-        pass
+        # ProtocolError is a RequestError too, the request is not set if the exception was raised outside of a client
+        try:
+            request = e.request
+        except RuntimeError:
+            request = None
+        _logger.error({"exception": type(e).__name__, "message": str(e), "args": e.args, "request": request, "thread": threading.current_thread().name})
     else:
-        _logger.exception(",\"%s %s %s\"", type(e), e, threading.current_thread().name, exc_info=True, stack_info=True)
-        #_logger.error("This is an general error message")
-        pass
-    
-
+        _logger.exception({"exception": type(e).__name__, "message": str(e), "args": getattr(e, "args", ()), "thread": threading.current_thread().name}, exc_info=True, stack_info=True, stacklevel=2)
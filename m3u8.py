@@ -1,3 +1,5 @@
+import datetime
+import functools
 import os
 import random
 import threading
@@ -10,17 +12,165 @@ from urllib.parse import urljoin, urlparse
 from enum import Enum
 
 import logs
+import timing
 
 def init_client_h2() -> httpx.Client:
-    return httpx.Client(http2 = True, 
+    client = httpx.Client(http2 = True, 
                             trust_env = False, 
                             timeout = httpx.Timeout(10.0, connect=10.0, pool=60.0), 
                             limits = httpx.Limits(max_connections=500) #, max_keepalive_connections=300, keepalive_expiry=10
                             )
+    # measure DNS apart from TCP connect
+    timing.install_timed_backend(client)
+    return client
 
 # global variable for HTTP2 client
 _client_h2 = init_client_h2()
 
+class HttpProtocol(Enum):
+    H1 = "h1"
+    H2 = "h2"
+
+    def __str__(self):
+        return '%s' % self.value
+
+# transport used for all manifests, parts and init files
+_protocol: HttpProtocol = HttpProtocol.H1
+
+def set_protocol(protocol: HttpProtocol):
+    global _protocol
+    _protocol = protocol
+
+def get_protocol() -> HttpProtocol:
+    return _protocol
+
+def init_client_async() -> httpx.AsyncClient:
+    client = httpx.AsyncClient(http2 = _protocol == HttpProtocol.H2,
+                            trust_env = False,
+                            timeout = httpx.Timeout(10.0, connect=10.0, pool=60.0),
+                            limits = httpx.Limits(max_connections=500)
+                            )
+    # measure DNS apart from TCP connect
+    timing.install_timed_backend(client)
+    return client
+
+# global variable for asyncio client, must be created inside of the running event loop
+_client_async: httpx.AsyncClient = None
+
+# HTTP1 sessions with keep-alive connection pools, one session per origin (scheme://host:port)
+_sessions_h1: Dict[str, requests.Session] = {}
+_sessions_h1_lock = threading.Lock()
+_sessions_h1_pool_size: int = 10
+
+def init_sessions_http1(pool_size: int):
+    # pool_size = number of connections kept alive per origin,
+    # should be enough for all renditions multiplied by parts in flight
+    global _sessions_h1_pool_size
+
+    close_sessions_http1()
+    _sessions_h1_pool_size = max(pool_size, 1)
+
+def close_sessions_http1():
+    with _sessions_h1_lock:
+        for session in _sessions_h1.values():
+            session.close()
+        _sessions_h1.clear()
+
+def get_session_http1(url: str) -> requests.Session:
+    parsed_url = urlparse(url)
+    origin = f"{parsed_url.scheme}://{parsed_url.netloc}"
+
+    with _sessions_h1_lock:
+        session = _sessions_h1.get(origin)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=_sessions_h1_pool_size)
+            # connections of the pool measure DNS, connect, TLS, send and wait phases of requests
+            timing.install_timed_pools(adapter)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions_h1[origin] = session
+        return session
+
+class H2EdgeStats:
+    # Multiplexing of requests over HTTP2 connections to one edge (scheme://host:port)
+    Edge: str
+    Streams: int
+    Streams_per_connection: Dict[int, int]  #id of network stream -> highest stream number seen
+    In_flight: int
+    In_flight_playlists: int    #blocking playlist requests waiting for the next part
+    Max_in_flight: int
+    Requests_behind_playlist: int   #parts and init files started while a blocking playlist was in flight
+    Queue_time_total: float     #ms, from start of request till its headers are sent
+    Queue_time_max: float       #ms
+
+    def __init__(self, edge: str):
+        self.Edge = edge
+        self.Streams = 0
+        self.Streams_per_connection = {}
+        self.In_flight = 0
+        self.In_flight_playlists = 0
+        self.Max_in_flight = 0
+        self.Requests_behind_playlist = 0
+        self.Queue_time_total = 0.0
+        self.Queue_time_max = 0.0
+
+    def __repr__(self):
+        return (f"H2EdgeStats(Edge='{self.Edge}', Streams={self.Streams}, "
+                f"Connections={len(self.Streams_per_connection)}, Max_in_flight={self.Max_in_flight}, "
+                f"Requests_behind_playlist={self.Requests_behind_playlist}, Queue_time_max={self.Queue_time_max:.1f} ms)")
+
+_h2_edge_stats: Dict[str, H2EdgeStats] = {}
+_h2_edge_stats_lock = threading.Lock()
+
+def is_blocking_playlist_request(url: str) -> bool:
+    return "_HLS_msn=" in urlparse(url).query
+
+def _h2_stats_request_started(url: str):
+    parsed_url = urlparse(url)
+    edge = f"{parsed_url.scheme}://{parsed_url.netloc}"
+    blocking = is_blocking_playlist_request(url)
+
+    with _h2_edge_stats_lock:
+        stats = _h2_edge_stats.get(edge)
+        if stats is None:
+            stats = _h2_edge_stats[edge] = H2EdgeStats(edge)
+        if not blocking and stats.In_flight_playlists > 0:
+            stats.Requests_behind_playlist += 1
+        stats.In_flight += 1
+        stats.Max_in_flight = max(stats.Max_in_flight, stats.In_flight)
+        if blocking:
+            stats.In_flight_playlists += 1
+
+def _h2_stats_request_finished(url: str, timer: timing.RequestTimer, response: httpx.Response = None):
+    parsed_url = urlparse(url)
+    edge = f"{parsed_url.scheme}://{parsed_url.netloc}"
+    blocking = is_blocking_playlist_request(url)
+
+    with _h2_edge_stats_lock:
+        stats = _h2_edge_stats.get(edge)
+        if stats is None:
+            return
+        stats.In_flight -= 1
+        if blocking:
+            stats.In_flight_playlists -= 1
+
+        if timer is not None and timer.Send_start is not None:
+            queue_time_ms = timer.elapsed_ms("Send_start")
+            stats.Queue_time_total += queue_time_ms
+            stats.Queue_time_max = max(stats.Queue_time_max, queue_time_ms)
+
+        if response is not None and response.extensions.get("http_version") == b"HTTP/2":
+            # stream ids of client requests are odd numbers growing on each connection: 1, 3, 5...
+            stats.Streams += 1
+            connection_id = id(response.extensions.get("network_stream"))
+            stream_number = (response.extensions.get("stream_id", 1) + 1) // 2
+            stats.Streams_per_connection[connection_id] = max(stats.Streams_per_connection.get(connection_id, 0), stream_number)
+
+def get_h2_edge_stats() -> List[H2EdgeStats]:
+    with _h2_edge_stats_lock:
+        return list(_h2_edge_stats.values())
+
 def beautify_number(number):
     return "{:,.0f}".format(number).replace(',', ' ')
 
@@ -34,8 +184,18 @@ class DownloadMetrics:
     Download_time: float    #ms
     Response_time: float    #ms
     Headers: List[tuple[str,str]] #tuple(str,str)
-
-    def __init__(self, http_code: int, status: str, response_body: bytearray = None, ttfb: float = None, time_headers: float = None, download_speed: float = None, downloading_time: float = None, response_time: float = None, response_headers: List[tuple[str,str]] = None):
+    Connection_reused: bool #None = unknown
+    # phases of the request, ms, None if phase did not happen or was not measured
+    Time_dns: float
+    Time_connect: float
+    Time_tls: float
+    Time_send: float
+    Time_wait: float        #server wait from request sent till response headers, includes blocking-reload hold
+    Time_body: float
+    Time_hold: float        #ms of the response expected to be the blocking-reload hold (see holdtime.py), None if not estimated
+    Live_latency: float     #ms from the end of the newest part in program time (EXT-X-PROGRAM-DATE-TIME) till arrival, None if unknown
+
+    def __init__(self, http_code: int, status: str, response_body: bytearray = None, ttfb: float = None, time_headers: float = None, download_speed: float = None, downloading_time: float = None, response_time: float = None, response_headers: List[tuple[str,str]] = None, connection_reused: bool = None, phases: Dict[str, float] = None):
         self.HTTP_code = http_code
         self.Status = status
         self.Response_body = response_body
@@ -45,6 +205,36 @@ class DownloadMetrics:
         self.Download_time = downloading_time
         self.Response_time = response_time
         self.Headers = response_headers
+        self.Connection_reused = connection_reused
+        phases = phases or {}
+        self.Time_dns = phases.get("dns")
+        self.Time_connect = phases.get("connect")
+        self.Time_tls = phases.get("tls")
+        self.Time_send = phases.get("send")
+        self.Time_wait = phases.get("wait")
+        self.Time_body = phases.get("body")
+        self.Time_hold = None
+        self.Live_latency = None
+
+    def succeeded(self) -> bool:
+        # 206 is the answer to a Range request (byte-range parts)
+        return self.HTTP_code in (200, 206)
+
+    def excess_time(self) -> float:
+        # response time without the expected blocking-reload hold, ms
+        if self.Response_time is None:
+            return None
+        return self.Response_time - self.Time_hold if self.Time_hold is not None else self.Response_time
+
+    def phases_ms(self) -> Dict[str, float]:
+        return {
+            "dns": self.Time_dns,
+            "connect": self.Time_connect,
+            "tls": self.Time_tls,
+            "send": self.Time_send,
+            "wait": self.Time_wait,
+            "body": self.Time_body,
+        }
 
     def __repr__(self):
         return (f'DownloadMetrics(http_code={self.HTTP_Code} {self.Status}'
@@ -54,7 +244,9 @@ class DownloadMetrics:
                 f'download_body_speed={self.Download_speed:.0f} bps, '
                 f'download_body_time={self.Download_time:.1f} ms, '
                 f'response_body_length={len(self.Response_body)} bytes, '
-                f'response_headers={len(self.Headers)} items')
+                f'response_headers={len(self.Headers)} items, '
+                f'connection_reused={self.Connection_reused}, '
+                f'phases={self.phases_ms()})')
 
 
 class MediaAudio:
@@ -104,13 +296,17 @@ class MediaPart:
     URI: str
     Independent: bool
     Final: bool = False
+    Program_time: float     #unix time of the start of the part (EXT-X-PROGRAM-DATE-TIME), None if unknown
+    Byterange: tuple[int, int]  #(offset, length) of the part in the resource of URI (BYTERANGE), None = the whole resource
     
-    def __init__(self, segment: int, partnum: int, uri: str, duration: float, independent: bool):
+    def __init__(self, segment: int, partnum: int, uri: str, duration: float, independent: bool, program_time: float = None, byterange: tuple[int, int] = None):
         self.Segment = segment
         self.PartNum = partnum
         self.URI = uri
         self.Duration = duration
         self.Independent = independent
+        self.Program_time = program_time
+        self.Byterange = byterange
 
     def __repr__(self):
         return (
@@ -119,7 +315,9 @@ class MediaPart:
                 f"URI='{self.URI}', "
                 f"Duration={self.Duration}, "
                 f"Independent={self.Independent}, "
-                f"Final={self.Final})")
+                f"Final={self.Final}, "
+                f"Program_time={self.Program_time}, "
+                f"Byterange={self.Byterange})")
 
     def __str__(self):
         return (f"Media Part Info:\n"
@@ -134,14 +332,16 @@ class MediaSegment:
     URI: str
     Duration: float
     SegmentNum: int
+    Program_time: float     #unix time of the start of the segment (EXT-X-PROGRAM-DATE-TIME), None if unknown
 
-    def __init__(self, segment: int, uri: str, duration: float):
+    def __init__(self, segment: int, uri: str, duration: float, program_time: float = None):
         self.URI = uri
         self.Duration = duration
         self.SegmentNum = segment
+        self.Program_time = program_time
 
     def __repr__(self):
-        return (f"MediaSegment(SegmentNum={self.SegmentNum}, URI='{self.URI}', Duration={self.Duration}))")
+        return (f"MediaSegment(SegmentNum={self.SegmentNum}, URI='{self.URI}', Duration={self.Duration}, Program_time={self.Program_time}))")
 
     def __str__(self):
         return (f"Media Segment Info:\n"
@@ -193,8 +393,12 @@ class M3U8:
     EXT_X_Map_URI: str
     EXT_X_Server_Control_Can_Block_Reload: bool
     EXT_X_Server_Control_Part_Hold_Back: float
+    EXT_X_Server_Control_Can_Skip_Until: float  #0 = server can't produce delta playlists
+    EXT_X_Server_Control_Can_Skip_Dateranges: bool
+    EXT_X_Skip_Skipped_Segments: int    #>0 = it's delta playlist (or merged from delta playlist)
     EXT_X_PartInf_Part_Target: float
     EXT_X_Preload_Hint_URI: str
+    EXT_X_Preload_Hint_Byterange: tuple[int, int]   #(start, length) of the hint, length None = open-ended; None = the whole resource
     Media_Audios: List[MediaAudio]
     Media_Streams: List[MediaStream]
     Media_Parts: List[MediaPart]
@@ -203,6 +407,7 @@ class M3U8:
     URI: str
     Name: str
     FileDownloaded: DownloadMetrics
+    Parse_Time: float   #ms
 
     def __init__(self, type_m3u8: TypeM3U8):
         self.Type = type_m3u8
@@ -212,7 +417,12 @@ class M3U8:
         self.EXT_X_Map_URI = ""
         self.EXT_X_Server_Control_Can_Block_Reload = False
         self.EXT_X_Server_Control_Part_Hold_Back = 0.0
+        self.EXT_X_Server_Control_Can_Skip_Until = 0.0
+        self.EXT_X_Server_Control_Can_Skip_Dateranges = False
+        self.EXT_X_Skip_Skipped_Segments = 0
         self.EXT_X_PartInf_Part_Target = 0.0
+        self.EXT_X_Preload_Hint_URI = ""
+        self.EXT_X_Preload_Hint_Byterange = None
         self.Media_Audios: List[MediaAudio] = []
         self.Media_Streams: List[MediaStream] = []
         self.Media_Parts: List[MediaPart] = []
@@ -221,6 +431,7 @@ class M3U8:
         self.URI = None
         self.Name = None
         self.FileDownloaded = None
+        self.Parse_Time = 0.0
 
     def __repr__(self):
         return (f"M3U8Wrapper(Type={self.Type}, "
@@ -230,6 +441,9 @@ class M3U8:
                 f"EXT_X_Map_URI='{self.EXT_X_Map_URI}', "
                 f"EXT_X_Server_Control_Can_Block_Reload={self.EXT_X_Server_Control_Can_Block_Reload}, "
                 f"EXT_X_Server_Control_Part_Hold_Back={self.EXT_X_Server_Control_Part_Hold_Back}, "
+                f"EXT_X_Server_Control_Can_Skip_Until={self.EXT_X_Server_Control_Can_Skip_Until}, "
+                f"EXT_X_Server_Control_Can_Skip_Dateranges={self.EXT_X_Server_Control_Can_Skip_Dateranges}, "
+                f"EXT_X_Skip_Skipped_Segments={self.EXT_X_Skip_Skipped_Segments}, "
                 f"EXT_X_PartInf_Part_Target={self.EXT_X_PartInf_Part_Target}, "
                 f"Media_Audios={self.Media_Audios}, "
                 f"Media_Streams={self.Media_Streams}, "
@@ -254,7 +468,7 @@ def ensure_absolute_url(base_url: str, url: str):
         # If not, it’s a relative URL, combine it with the base URL
         return urljoin(base_url, url)
 
-def download_file_http2(url, path_to_save: str = None) -> DownloadMetrics:
+def download_file_http2(url, path_to_save: str = None, byterange: tuple[int, int] = None) -> DownloadMetrics:
     global _client_h2
     
     parsed_url = urlparse(url)
@@ -268,7 +482,7 @@ def download_file_http2(url, path_to_save: str = None) -> DownloadMetrics:
     save_file = path_to_save is not None
     
     # timer to measure response time
-    timer_start: float = None    
+    timer: timing.RequestTimer = None
     time_to_firstbyte_ms: float = 0.0
     time_to_get_headers_ms: float = 0.0
     timer_body_received: float = 0.0
@@ -296,16 +510,19 @@ def download_file_http2(url, path_to_save: str = None) -> DownloadMetrics:
                 pass
             i_try -= 1
 
+            response_h2: httpx.Response = None
+            _h2_stats_request_started(url)
             try:
                 # Start the timer to measure response time
-                timer_start = time.time()
+                timer = timing.start_request_timer()
 
                 if _client_h2.is_closed:
                     _client_h2 = init_client_h2()
 
-                with _client_h2.stream("GET", url) as response_h2:
+                with _client_h2.stream("GET", url, headers=_range_headers(byterange), extensions={"trace": timer}) as response_h2:
                     # Measure Time to First Byte (TTFB)
-                    time_to_firstbyte_ms = time_to_get_headers_ms = (time.time() - timer_start) * 1000
+                    time_to_get_headers_ms = timer.elapsed_ms()
+                    time_to_firstbyte_ms = timer.elapsed_ms("Headers_received") or time_to_get_headers_ms
 
                     ## Time to get headers (using elapsed time from response)
                     #time_to_firstbyte_ms = time_to_get_headers_ms = response_h2.elapsed.total_seconds() * 1000   – impossible to calculate in that library
@@ -325,10 +542,10 @@ def download_file_http2(url, path_to_save: str = None) -> DownloadMetrics:
                     #    if random.randint(0, 100) > 70:
                     #        http_code = 599
                     
-                    if http_code != 200:
+                    if not _is_expected_code(http_code, byterange):
                         #display.display_error(f"Failed to download. HTTP Status Code: {http_code}")
                         #print(f"Failed to download. HTTP Status Code: {http_code}")
-                        return DownloadMetrics(http_code, f"ERROR {http_code}")
+                        return DownloadMetrics(http_code, f"ERROR {http_code}", response_headers=response_headers, connection_reused=timer.Connect_start is None, phases=timer.phases_ms())
                     else:
                         http_status = "OK"
 
@@ -337,7 +554,7 @@ def download_file_http2(url, path_to_save: str = None) -> DownloadMetrics:
                     if content_type not in valid_content_types:
                         #display.display_error(f"Invalid Content-Type: {content_type}")
                         #print(f"Invalid Content-Type: {content_type}")
-                        return DownloadMetrics(0, f"ERROR Invalid {content_type}", response_headers=response_headers)
+                        return DownloadMetrics(0, f"ERROR Invalid {content_type}", response_headers=response_headers, connection_reused=timer.Connect_start is None, phases=timer.phases_ms())
                     else:
                         #safe_print("Valid Content-Type found:", content_type)
                         pass
@@ -347,7 +564,6 @@ def download_file_http2(url, path_to_save: str = None) -> DownloadMetrics:
                     time_body_downloading_by_chunks_s = 0.0
 
                     # Start the timer to measure the time to get the body
-                    timer_body_start = timer_body_received = time.time()
 
                     # Download data, measure, and save the file
                     content = bytearray()
@@ -356,9 +572,9 @@ def download_file_http2(url, path_to_save: str = None) -> DownloadMetrics:
                         if save_file:
                             file = open(path_to_save, 'wb')
 
-                        timer_body_downloading = time.time()
+                        timer_body_downloading = time.perf_counter_ns()
                         for chunk in response_h2.iter_bytes(chunk_size = 10000000):
-                            time_body_downloading_by_chunks_s += (time.time() - timer_body_downloading)
+                            time_body_downloading_by_chunks_s += (time.perf_counter_ns() - timer_body_downloading) / 1000000000
                             if chunk:
                                 content.extend(chunk)
                                 body_total_size += len(chunk)
@@ -368,15 +584,13 @@ def download_file_http2(url, path_to_save: str = None) -> DownloadMetrics:
                         # Handle exceptions and print the error message
                         #print(f"An error occurred: {e}")
                         logs.write_exception(e)
-                        if _client_h2:
-                            _client_h2.close()
 
                         http_code = 0
                         http_status = f"ERROR {threading.current_thread().name} {e} i_try={i_try} {url}"
                         return DownloadMetrics(http_code, http_status, response_headers=response_headers)
                         #raise e
                     finally:
-                        timer_body_received = time.time()
+                        timer.mark("Body_end")
                         if file is not None:
                             file.close()
                 
@@ -387,16 +601,23 @@ def download_file_http2(url, path_to_save: str = None) -> DownloadMetrics:
                 # Handle exceptions and print the error message
                 #print(f"ERROR: [{threading.current_thread().name} {e} i_try={i_try} {url}]")
                 #raise e
+                # _client_h2 is not closed here: other streams are multiplexed over the same connection,
+                # and httpcore drops broken connections from the pool by itself
                 logs.write_exception(e)
-                if _client_h2:
-                    _client_h2.close()
 
                 http_code = 0
                 http_status = f"ERROR {threading.current_thread().name} {e} i_try={i_try} {url}"
                 return DownloadMetrics(http_code, http_status, response_headers=response_headers)
+            finally:
+                _h2_stats_request_finished(url, timer, response_h2)
 
     # Calculate total response time
-    time_to_finish_ms = (timer_body_received - timer_start) * 1000
+    time_to_finish_ms = timer.elapsed_ms("Body_end")
+
+    # throughput of a byte-range part is of the range bytes only
+    if byterange is not None and http_code == 200:
+        content = _range_of_body(content, byterange)
+        body_total_size = len(content)
     
     # Calculate download speed of body only (as Safari and Chrome calculate it)
     ##downloading_time_s = (time_to_finish_ms - time_to_firstbyte_ms) / 1000
@@ -431,14 +652,151 @@ def download_file_http2(url, path_to_save: str = None) -> DownloadMetrics:
         download_speed=download_speed,
         downloading_time=body_downloading_time_s * 1000,
         response_time=time_to_finish_ms,
-        response_headers=response_headers
+        response_headers=response_headers,
+        connection_reused=timer.Connect_start is None,
+        phases=timer.phases_ms()
     )
 
     return metrics
 
 
+async def close_client_async():
+    global _client_async
+
+    if _client_async is not None:
+        await _client_async.aclose()
+        _client_async = None
+
+async def download_file_async(url, path_to_save: str = None, byterange: tuple[int, int] = None) -> DownloadMetrics:
+    global _client_async
 
-def download_file_http1(url, path_to_save: str = None) -> DownloadMetrics:
+    parsed_url = urlparse(url)
+    if parsed_url is None or not bool(parsed_url.path):
+        return None
+
+    save_file = path_to_save is not None
+
+    # timer to measure response time
+    timer: timing.RequestTimer = None
+    time_to_firstbyte_ms: float = 0.0
+    time_to_get_headers_ms: float = 0.0
+    timer_body_received: float = 0.0
+
+    time_body_downloading_by_chunks_s: float = 0.0
+    body_total_size: int = 0
+
+    http_status: str = ""
+    http_code: int = 0
+    content = bytearray()
+    download_speed = 0.0
+    body_downloading_time_s = 0.0
+    time_to_finish_ms = 0.0
+    response_headers: List[tuple[str,str]] = []
+
+    response: httpx.Response = None
+    if _protocol == HttpProtocol.H2:
+        _h2_stats_request_started(url)
+    try:
+        # Start the timer to measure response time, the timer is bound to the current asyncio task
+        timer = timing.start_request_timer()
+
+        # _client_async is shared by all coroutines of the event loop, so connections are reused
+        if _client_async is None or _client_async.is_closed:
+            _client_async = init_client_async()
+
+        async with _client_async.stream("GET", url, headers=_range_headers(byterange), extensions={"trace": timer.trace_async}) as response:
+            # Measure Time to First Byte (TTFB)
+            time_to_get_headers_ms = timer.elapsed_ms()
+            time_to_firstbyte_ms = timer.elapsed_ms("Headers_received") or time_to_get_headers_ms
+
+            # Get HTTP code
+            http_code = response.status_code
+            content_type = response.headers.get('Content-Type', '')
+
+            headers_to_save = ["cache", "date", "content-type", "traceparent", "x-id", "x-id-fe"]
+            for h in response.headers:
+                if h in headers_to_save:
+                    response_headers.append((h, response.headers.get(h)))
+
+            if not _is_expected_code(http_code, byterange):
+                return DownloadMetrics(http_code, f"ERROR {http_code}", response_headers=response_headers, connection_reused=timer.Connect_start is None, phases=timer.phases_ms())
+            else:
+                http_status = "OK"
+
+            # Parse and check content-type
+            valid_content_types = ["application/vnd.apple.mpegurl", "application/x-mpegURL", "video/mp4"]
+            if content_type not in valid_content_types:
+                return DownloadMetrics(http_code, f"ERROR Invalid {content_type}", response_headers=response_headers, connection_reused=timer.Connect_start is None, phases=timer.phases_ms())
+
+            # Download data, measure, and save the file
+            content = bytearray()
+            file = None
+            try:
+                if save_file:
+                    file = open(path_to_save, 'wb')
+
+                timer_body_downloading = time.perf_counter_ns()
+                async for chunk in response.aiter_bytes():
+                    time_body_downloading_by_chunks_s += (time.perf_counter_ns() - timer_body_downloading) / 1000000000
+                    if chunk:
+                        content.extend(chunk)
+                        body_total_size += len(chunk)
+                        if save_file:
+                            file.write(chunk)
+            finally:
+                timer.mark("Body_end")
+                if file is not None:
+                    file.close()
+    except Exception as e:
+        # Handle exceptions and print the error message
+        logs.write_exception(e)
+        http_code = 0
+        http_status = f"ERROR {e} {url}"
+        return DownloadMetrics(http_code, http_status, response_headers=response_headers)
+    finally:
+        if _protocol == HttpProtocol.H2:
+            _h2_stats_request_finished(url, timer, response)
+
+    # Calculate total response time
+    time_to_finish_ms = timer.elapsed_ms("Body_end")
+
+    # throughput of a byte-range part is of the range bytes only
+    if byterange is not None and http_code == 200:
+        content = _range_of_body(content, byterange)
+        body_total_size = len(content)
+
+    # Calculate download speed of body only (as Safari and Chrome calculate it)
+    body_downloading_time_s = time_body_downloading_by_chunks_s
+    if body_downloading_time_s > 0:
+        download_speed = (body_total_size) * 8 / (body_downloading_time_s)
+    else:
+        download_speed = 0
+
+    metrics = DownloadMetrics(
+        http_code=http_code,
+        status=http_status,
+        response_body=content,
+        ttfb=time_to_firstbyte_ms,
+        time_headers=time_to_get_headers_ms,
+        download_speed=download_speed,
+        downloading_time=body_downloading_time_s * 1000,
+        response_time=time_to_finish_ms,
+        response_headers=response_headers,
+        connection_reused=timer.Connect_start is None,
+        phases=timer.phases_ms()
+    )
+
+    return metrics
+
+
+def download_file(url, path_to_save: str = None, byterange: tuple[int, int] = None) -> DownloadMetrics:
+    # download with the transport selected by set_protocol(),
+    # byterange = (offset, length) of a byte-range part, a Range request over the same pooled connections
+    if _protocol == HttpProtocol.H2:
+        return download_file_http2(url, path_to_save, byterange)
+    return download_file_http1(url, path_to_save, byterange)
+
+def download_file_http1(url, path_to_save: str = None, byterange: tuple[int, int] = None) -> DownloadMetrics:
     parsed_url = urlparse(url)
     if parsed_url is None or not bool(parsed_url.path):
         return None
@@ -450,7 +808,7 @@ def download_file_http1(url, path_to_save: str = None) -> DownloadMetrics:
     save_file = path_to_save is not None
     
     # timer to measure response time
-    timer_start : float = None    
+    timer: timing.RequestTimer = None
     time_to_firstbyte_ms : float = 0
     time_to_get_headers_ms : float = 0
 
@@ -462,21 +820,27 @@ def download_file_http1(url, path_to_save: str = None) -> DownloadMetrics:
     time_to_finish_ms = 0.0
     response_headers: List[tuple[str,str]] = []
 
+    connection_reused: bool = None
+
     # Perform the GET request
     response_h1: requests.Response = None
     try:
+        # Session is shared per origin, so keep-alive connections are reused as a real player does
+        session_h1 = get_session_http1(url)
+
         # Start the timer to measure response time
-        timer_start = time.time()
+        timer = timing.start_request_timer()
 
-        response_h1 = requests.get(url, stream=True) #.__enter__()
+        response_h1 = session_h1.get(url, stream=True, headers=_range_headers(byterange)) #.__enter__()
         #response = requests.get(url)
+        # the timed connection of the pool marks TCP connect only for a new connection
+        connection_reused = timer.Connect_start is None
 
         # Calculate the time to get headers
-        timer_headers_received = time.time()
-        time_to_get_headers_ms = (timer_headers_received - timer_start) * 1000
+        time_to_get_headers_ms = timer.elapsed_ms()
 
         # Measure Time to First Byte (TTFB)
-        time_to_firstbyte_ms = response_h1.elapsed.total_seconds() * 1000
+        time_to_firstbyte_ms = timer.elapsed_ms("Headers_received") or time_to_get_headers_ms
 
         # Get HTTP code
         http_code = response_h1.status_code
@@ -491,11 +855,11 @@ def download_file_http1(url, path_to_save: str = None) -> DownloadMetrics:
                 response_headers.append((h.lower(), response_h1.headers.get(h)))
         pass
 
-        if http_code != 200:
+        if not _is_expected_code(http_code, byterange):
             #display.display_error(f"Failed to download. HTTP Status Code: {http_code}")
             #print(f"Failed to download. HTTP Status Code: {http_code}")
             #return None
-            return DownloadMetrics(http_code, f"ERROR {http_code}", response_headers=response_headers)
+            return DownloadMetrics(http_code, f"ERROR {http_code}", response_headers=response_headers, connection_reused=connection_reused, phases=timer.phases_ms())
         else:
             http_status = "OK"
 
@@ -507,9 +871,9 @@ def download_file_http1(url, path_to_save: str = None) -> DownloadMetrics:
         valid_content_types = ["application/vnd.apple.mpegurl", "application/x-mpegURL", "video/mp4"]
         if content_type not in valid_content_types:
             #display.display_error(f"Invalid Content-Type: {content_type}")
-            print(f"Invalid Content-Type: {content_type}")
+            logs.print_error(f"Invalid Content-Type: {content_type}")
             #return
-            return DownloadMetrics(http_code, f"ERROR Invalid {content_type}", response_headers=response_headers)
+            return DownloadMetrics(http_code, f"ERROR Invalid {content_type}", response_headers=response_headers, connection_reused=connection_reused, phases=timer.phases_ms())
         else:
             #safe_print("Valid Content-Type found:", content_type)
             pass
@@ -520,9 +884,6 @@ def download_file_http1(url, path_to_save: str = None) -> DownloadMetrics:
         body_total_size = 0
         time_body_downloading_by_chunks_s : float = 0
 
-        # Start the timer to measure the time to get the body
-        timer_body_start = timer_body_received = time.time()
-
         # Download data, measure, and save the file
         content = bytearray()
         try:
@@ -530,10 +891,10 @@ def download_file_http1(url, path_to_save: str = None) -> DownloadMetrics:
             if save_file:
                 file = open(path_to_save, 'wb')
 
-            timer_body_downloading = time.time()
+            timer_body_downloading = time.perf_counter_ns()
             #for chunk in response.iter_content():
             for chunk in response_h1.iter_content(chunk_size = None):
-                time_body_downloading_by_chunks_s += (time.time() - timer_body_downloading)
+                time_body_downloading_by_chunks_s += (time.perf_counter_ns() - timer_body_downloading) / 1000000000
                 if chunk:
                     content.extend(chunk)
                     body_total_size += len(chunk)
@@ -546,31 +907,37 @@ def download_file_http1(url, path_to_save: str = None) -> DownloadMetrics:
                 #    file.write(content)        
         except Exception as e:
             # Handle exceptions and print the error message
-            print(f"An error occurred: {e}")
+            logs.print_error(f"An error occurred: {e}")
             logs.write_exception(e)
             http_code = 0
             http_status = f"ERROR {threading.current_thread().name} {e}"
-            return DownloadMetrics(http_code, http_status, response_headers=response_headers)
+            return DownloadMetrics(http_code, http_status, response_headers=response_headers, connection_reused=connection_reused, phases=timer.phases_ms())
         finally:
-            timer_body_received = time.time()
+            timer.mark("Body_end")
             
             if file is not None:
                 file.close()
                 #safe_print(f"File saved successfully as {path_to_save}")
     except Exception as e:
         # Handle exceptions and print the error message
-        print(f"ERROR: [{threading.current_thread().name} {e}]")
+        logs.print_error(f"ERROR: [{threading.current_thread().name} {e}]")
         logs.write_exception(e)
         http_code = 0
         http_status = f"ERROR {threading.current_thread().name} {e}"
-        return DownloadMetrics(http_code, http_status, response_headers=response_headers)
-
-    #finally:
-    #    #response_h1.close()   HTTP1 has no "close()" method
+        return DownloadMetrics(http_code, http_status, response_headers=response_headers, connection_reused=connection_reused, phases=timer.phases_ms() if timer is not None else None)
+    finally:
+        # return the connection into the pool of the session, also if body was not read
+        if response_h1 is not None:
+            response_h1.close()
 
 
     # Calculate total response time
-    time_to_finish_ms = (timer_body_received - timer_start) * 1000
+    time_to_finish_ms = timer.elapsed_ms("Body_end")
+
+    # throughput of a byte-range part is of the range bytes only
+    if byterange is not None and http_code == 200:
+        content = _range_of_body(content, byterange)
+        body_total_size = len(content)
     
     # Calculate download speed of body only (as Safari and Chrome calculate it)
     ##downloading_time_s = (time_to_finish_ms - time_to_firstbyte_ms) / 1000
@@ -605,30 +972,141 @@ def download_file_http1(url, path_to_save: str = None) -> DownloadMetrics:
         download_speed=download_speed,
         downloading_time=body_downloading_time_s * 1000,
         response_time=time_to_finish_ms,
-        response_headers=response_headers
+        response_headers=response_headers,
+        connection_reused=connection_reused,
+        phases=timer.phases_ms()
     )
 
     return metrics
 
+# Attribute list of a tag (RFC 8216, 4.2): NAME=VALUE pairs separated by commas, quoted values may contain commas
+_ATTRIBUTE_RE = re.compile(rb'\s*([A-Za-z0-9-]+)\s*=\s*("[^"]*"|\'[^\']*\'|[^,]*)(?:,|$)')
+
+# Tags handled by the parser, the rest are ignored
+_TAG_MEDIA = 1
+_TAG_STREAM_INF = 2
+_TAG_TARGETDURATION = 3
+_TAG_INDEPENDENT_SEGMENTS = 4
+_TAG_MEDIA_SEQUENCE = 5
+_TAG_MAP = 6
+_TAG_SERVER_CONTROL = 7
+_TAG_PART_INF = 8
+_TAG_PART = 9
+_TAG_PRELOAD_HINT = 10
+_TAG_RENDITION_REPORT = 11
+_TAG_EXTINF = 12
+_TAG_SKIP = 13
+_TAG_PROGRAM_DATE_TIME = 14
+
+_TAGS: Dict[bytes, int] = {
+    b"#EXT-X-MEDIA": _TAG_MEDIA,
+    b"#EXT-X-STREAM-INF": _TAG_STREAM_INF,
+    b"#EXT-X-TARGETDURATION": _TAG_TARGETDURATION,
+    b"#EXT-X-INDEPENDENT-SEGMENTS": _TAG_INDEPENDENT_SEGMENTS,
+    b"#EXT-X-MEDIA-SEQUENCE": _TAG_MEDIA_SEQUENCE,
+    b"#EXT-X-MAP": _TAG_MAP,
+    b"#EXT-X-SERVER-CONTROL": _TAG_SERVER_CONTROL,
+    b"#EXT-X-PART-INF": _TAG_PART_INF,
+    b"#EXT-X-PART": _TAG_PART,
+    b"#EXT-X-PRELOAD-HINT": _TAG_PRELOAD_HINT,
+    b"#EXT-X-RENDITION-REPORT": _TAG_RENDITION_REPORT,
+    b"#EXTINF": _TAG_EXTINF,
+    b"#EXT-X-SKIP": _TAG_SKIP,
+    b"#EXT-X-PROGRAM-DATE-TIME": _TAG_PROGRAM_DATE_TIME,
+}
+
+def parse_attribute_list(value: bytes) -> Dict[bytes, bytes]:
+    # names are upper-cased, quotes are removed from values, the first occurrence of a name wins
+    attributes: Dict[bytes, bytes] = {}
+    for name, attribute_value in _ATTRIBUTE_RE.findall(value):
+        name = name.upper()
+        if name not in attributes:
+            attributes[name] = attribute_value.strip().strip(b'\'"')
+    return attributes
+
+def _to_int(value: bytes, default: int = 0) -> int:
+    try:
+        return int(value) if value else default
+    except ValueError:
+        return default
+
+def _to_float(value: bytes, default: float = 0.0) -> float:
+    try:
+        return float(value) if value else default
+    except ValueError:
+        return default
+
+def _to_byterange(value: bytes, previous_end: int) -> tuple[int, int]:
+    # BYTERANGE="<length>[@<offset>]", without the offset the range follows the previous part of the same resource
+    length, _, offset = value.partition(b"@")
+    return (_to_int(offset, previous_end), _to_int(length))
+
+def range_header(byterange: tuple[int, int]) -> str:
+    # (offset, length) -> value of the Range header, length None = open-ended (to the end of the resource)
+    start, length = byterange
+    return f"bytes={start}-" if length is None else f"bytes={start}-{start + length - 1}"
+
+def _range_headers(byterange: tuple[int, int]) -> Dict[str, str]:
+    return {"Range": range_header(byterange)} if byterange is not None else None
+
+def _is_expected_code(http_code: int, byterange: tuple[int, int]) -> bool:
+    # a Range request is answered by 206, or by 200 with the whole resource if the server ignores Range
+    return http_code == 200 or (byterange is not None and http_code == 206)
+
+def _range_of_body(content: bytearray, byterange: tuple[int, int]) -> bytearray:
+    # the server ignored Range and sent the whole resource (200), the part is the range of it
+    start, length = byterange
+    return content[start:] if length is None else content[start:start + length]
+
+def _to_program_time(value: bytes) -> float:
+    # ISO 8601 date and time with a time zone -> unix time, None if it cannot be parsed (a time without a zone is UTC)
+    try:
+        program_time = datetime.datetime.fromisoformat(value.strip().decode('utf-8').replace("Z", "+00:00").replace("z", "+00:00"))
+    except ValueError:
+        return None
+    if program_time.tzinfo is None:
+        program_time = program_time.replace(tzinfo=datetime.timezone.utc)
+    return program_time.timestamp()
+
+def _is_plain_relative_url(url: str) -> bool:
+    # relative path without scheme, dot segments, params, fragment or an empty query: urljoin() would only append it to the directory
+    return (bool(url) and url[0] not in "/.?#" and ":" not in url and "./" not in url and ";" not in url and "#" not in url and url[-1] != "?"
+            and not url.partition("?")[0].endswith(("/.", "/..")))
+
+@functools.lru_cache(maxsize=1024)
+def _directory_of(url: str) -> str:
+    # directory of an absolute playlist URL without query and fragment (they don't change it), None for a relative URL
+    parsed_url = urlparse(url)
+    return urljoin(url, ".") if parsed_url.scheme and parsed_url.netloc else None
+
+def _resolve_url(base_url: str, base_prefix: str, url: str) -> str:
+    # plain relative path (the usual URI of a part or a segment) is joined by concatenation with the directory of the playlist,
+    # anything else goes through urljoin
+    if base_prefix is not None and _is_plain_relative_url(url):
+        return base_prefix + url
+    return ensure_absolute_url(base_url, url)
+
 def parse_m3u8(data: bytearray, master_url: str) -> M3U8:
     if data is None or len(data) == 0:
         return None
 
-    # Convert bytearray to a string
-    text_data = data.decode('utf-8')
-    lines = text_data.splitlines()
+    # Work on bytes, only values used by the model are decoded
+    lines = bytes(data).splitlines()
 
     if len(lines) == 0:
         return None
     
     # Check the first line
-    if lines[0].strip() != "#EXTM3U":
+    if lines[0].strip() != b"#EXTM3U":
         #display.display_error(f"Invalid M3U8 file. First line: {lines[0]}")
-        print(f"Invalid M3U8 file. First line: {lines[0]}")
+        logs.print_error(f"Invalid M3U8 file. First line: {lines[0].decode('utf-8', 'replace')}")
         return None
     
     #print(f"Valid M3U8 file. First line: {lines[0]}")
 
+    # Directory of the playlist, relative URIs are appended to it; it's cached, reloads of a playlist differ only by the query
+    base_prefix = _directory_of(master_url.partition("?")[0].partition("#")[0]) if master_url else None
+
     # Initialize variables
     params_independent_segments = False
     params_target_duration = 0
@@ -637,7 +1115,13 @@ def parse_m3u8(data: bytearray, master_url: str) -> M3U8:
     params_map_uri = ""
     params_server_control_can_block_reload = False
     params_server_control_part_hold_back = 0.0
+    params_server_control_can_skip_until = 0.0
+    params_server_control_can_skip_dateranges = False
+    params_skip_skipped_segments = 0
     media_parts_preload_hint_uri = ""
+    media_parts_preload_hint_byterange = None
+    byterange_uri = None    #resource and end of the previous byte-range part, a BYTERANGE without offset follows it
+    byterange_end = 0
     media_rendition_reports : List[RenditionReport] = []
     media_audios: List[MediaAudio] = []
     media_streams : List[MediaStream] = []
@@ -647,128 +1131,157 @@ def parse_m3u8(data: bytearray, master_url: str) -> M3U8:
     previous_extinf : float = 0.0
     segment_num : int = params_media_sequence
     part_num : int = 0
+    # program time of the start of the current segment and of the next part, None until EXT-X-PROGRAM-DATE-TIME
+    segment_program_time : float = None
+    part_program_time : float = None
 
-    attr_pattern = r"=('([^']*)'|\"([^\"]*)\"|[^,\s]+)(?=,|$)"
-
+    tags = _TAGS
+    num_lines = len(lines)
     i = 1
-    while i < len(lines):
+    while i < num_lines:
         line = lines[i].strip()
 
-        if line.startswith("#EXT-X-MEDIA:"):
-            result_type = re.search(r'TYPE'+attr_pattern, line, re.IGNORECASE)
-            if result_type is not None and result_type.group(1).upper() == "AUDIO":
-                result_group_id = re.search(r'GROUP-ID'+attr_pattern, line, re.IGNORECASE)
-                result_uri = re.search(r'URI'+attr_pattern, line, re.IGNORECASE)
-                
-                groupid = result_group_id.group(1).strip('\'"') if result_group_id else None
-                url = result_uri.group(1).strip('\'"') if result_uri else None
-                url = ensure_absolute_url(master_url, url)
-                
-                media_audios.append(MediaAudio(groupid, url))
-
-        elif line.startswith("#EXT-X-STREAM-INF:"):
-            if i + 1 < len(lines):
-                parsed_filename = urlparse(lines[i + 1].strip())
-                if bool(parsed_filename.path): 
-                    result_bandwidth = re.search(r'BANDWIDTH=(\d+)', line, re.IGNORECASE)
-                    result_resolution = re.search(r'RESOLUTION=([0-9x]+)', line, re.IGNORECASE)
-                    result_audio = re.search(r'AUDIO'+attr_pattern, line, re.IGNORECASE)
-
-                    bandwidth = int(result_bandwidth.group(1).strip('\'"')) if result_bandwidth else 0
-                    resolution = result_resolution.group(1).strip('\'"') if result_resolution else None
-                    audio = result_audio.group(1).strip('\'"') if result_audio else None
-
-                    url = ensure_absolute_url(master_url, parsed_filename.geturl())
-
-                    media_streams.append(MediaStream(url, bandwidth, resolution, audio))
-                    i += 1
-
-        elif line.startswith("#EXT-X-TARGETDURATION:"):
-            result = re.search(r'#EXT-X-TARGETDURATION:(\d+)', line, re.IGNORECASE)
-            if result:
-                params_target_duration = int(result.group(1))
-
-        elif line.startswith("#EXT-X-INDEPENDENT-SEGMENTS"):
-            params_independent_segments = True
-
-        elif line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
-            result = re.search(r'#EXT-X-MEDIA-SEQUENCE:(\d+)', line, re.IGNORECASE)
-            if result:
-                params_media_sequence = segment_num = int(result.group(1))
-
-        elif line.startswith("#EXT-X-MAP:"):
-            result_uri = re.search(r'URI'+attr_pattern, line, re.IGNORECASE)
-            if result_uri:
-                params_map_uri = ensure_absolute_url(master_url, result_uri.group(1).strip('\'"'))
-
-        elif line.startswith("#EXT-X-SERVER-CONTROL:"):
-            can_block_reload = re.search(r'CAN-BLOCK-RELOAD=(\w+)', line, re.IGNORECASE)
-            if can_block_reload:
-                params_server_control_can_block_reload = can_block_reload.group(1).upper() == 'YES'
-            part_hold_back = re.search(r'PART-HOLD-BACK=([\d.]+)', line, re.IGNORECASE)
-            if part_hold_back:
-                params_server_control_part_hold_back = float(part_hold_back.group(1))
-
-        elif line.startswith("#EXT-X-PART-INF:"):
-            part_target = re.search(r'PART-TARGET=([\d.]+)', line, re.IGNORECASE)
-            if part_target:
-                params_part_target = float(part_target.group(1))
-
-        elif line.startswith("#EXT-X-PART:"):
-            result_uri = re.search(r'URI'+attr_pattern, line, re.IGNORECASE)
-            result_duration = re.search(r'DURATION=([\d.]+)', line, re.IGNORECASE)
-            result_independent = re.search(r'INDEPENDENT=(\w+)', line, re.IGNORECASE)
-
-            uri = result_uri.group(1).strip('\'"') if result_uri else ""
-            duration = float(result_duration.group(1).strip('\'"')) if result_duration else 0.0
-            independent = result_independent.group(1).upper() == 'YES' if result_independent else False
-
-            url = ensure_absolute_url(master_url, uri)
-
-            media_parts.append(MediaPart(segment_num, part_num, url, duration, independent))
-
-            part_num += 1
-
-        elif line.startswith("#EXT-X-PRELOAD-HINT:"):
-            result_preload_type = re.search(r'TYPE'+attr_pattern, line, re.IGNORECASE)
-            result_uri = re.search(r'URI'+attr_pattern, line, re.IGNORECASE)
-            if result_preload_type and result_preload_type.group(1).strip('\'"').upper() == "PART":
-                url = ensure_absolute_url(master_url, result_uri.group(1).strip('\'"') if result_uri else "")
-                media_parts_preload_hint_uri = url
-
-        elif line.startswith("#EXT-X-RENDITION-REPORT:"):
-            result_uri = re.search(r'URI'+attr_pattern, line, re.IGNORECASE)
-            result_last_msn = re.search(r'LAST-MSN=(\d+)', line, re.IGNORECASE)
-            result_last_part = re.search(r'LAST-PART=(\d+)', line, re.IGNORECASE)
-
-            rendition_uri = result_uri.group(1).strip('\'"') if result_uri else ""
-            rendition_last_msn = int(result_last_msn.group(1).strip('\'"')) if result_last_msn else 0
-            rendition_last_part = int(result_last_part.group(1).strip('\'"')) if result_last_part else 0
-
-            url = ensure_absolute_url(master_url, rendition_uri)
-
-            media_rendition_reports.append(RenditionReport(url, rendition_last_msn, rendition_last_part))
+        if not line:
+            pass
 
-        elif line.startswith("#EXTINF:"):
-            result_duration = re.search(r'#EXTINF:([\d.]+),?', line, re.IGNORECASE)
-            if result_duration:
-                previous_extinf = float(result_duration.group(1))
+        elif line[0] != 0x23: # not "#", so it's URI of a segment
+            url = line.decode('utf-8')
+            if base_prefix is None or not _is_plain_relative_url(url):
+                parsed_filename = urlparse(url)
+                url = ensure_absolute_url(master_url, parsed_filename.geturl()) if bool(parsed_filename.path) else None
+            else:
+                url = base_prefix + url
 
-        elif len(line) == 0:
-            pass
-            
-        elif not line.startswith("#"):
-            parsed_filename = urlparse(line)
-            if bool(parsed_filename.path):
-                url = ensure_absolute_url(master_url, parsed_filename.geturl())
-                
-                media_segments.append(MediaSegment(segment_num, url, previous_extinf))
+            if url is not None:
+                media_segments.append(MediaSegment(segment_num, url, previous_extinf, segment_program_time))
                 
+                if segment_program_time is not None:
+                    segment_program_time += previous_extinf
+                    part_program_time = segment_program_time
                 previous_extinf = 0.0
                 segment_num += 1
                 part_num = 0
                 if len(media_parts) > 0:
                     media_parts[len(media_parts)-1].Final = True
+
+        else:
+            tag, _, value = line.partition(b":")
+            tag_id = tags.get(tag)
+
+            if tag_id == _TAG_PART:
+                attributes = parse_attribute_list(value)
+                uri = attributes.get(b"URI", b"").decode('utf-8')
+                duration = _to_float(attributes.get(b"DURATION"))
+                independent = attributes.get(b"INDEPENDENT", b"").upper() == b"YES"
+
+                url = _resolve_url(master_url, base_prefix, uri)
+
+                byterange = None
+                if b"BYTERANGE" in attributes:
+                    byterange = _to_byterange(attributes[b"BYTERANGE"], byterange_end if url == byterange_uri else 0)
+                    byterange_uri, byterange_end = url, byterange[0] + byterange[1]
+
+                media_parts.append(MediaPart(segment_num, part_num, url, duration, independent, part_program_time, byterange))
+
+                part_num += 1
+                if part_program_time is not None:
+                    part_program_time += duration
+
+            elif tag_id == _TAG_PROGRAM_DATE_TIME:
+                # applies to the next segment and its parts, later segments follow by their durations
+                program_time = _to_program_time(value)
+                if program_time is not None:
+                    segment_program_time = part_program_time = program_time
+                    # the tag may follow parts of the segment (before EXTINF)
+                    for part in media_parts[len(media_parts) - part_num:] if part_num > 0 else []:
+                        part.Program_time = part_program_time
+                        part_program_time += part.Duration
+
+            elif tag_id == _TAG_EXTINF:
+                previous_extinf = _to_float(value.partition(b",")[0].strip())
+
+            elif tag_id == _TAG_PRELOAD_HINT:
+                attributes = parse_attribute_list(value)
+                if attributes.get(b"TYPE", b"").upper() == b"PART":
+                    media_parts_preload_hint_uri = _resolve_url(master_url, base_prefix, attributes.get(b"URI", b"").decode('utf-8'))
+                    if b"BYTERANGE-START" in attributes or b"BYTERANGE-LENGTH" in attributes:
+                        # without LENGTH the hint is the rest of the resource from START (open-ended range)
+                        length = _to_int(attributes.get(b"BYTERANGE-LENGTH"), None)
+                        media_parts_preload_hint_byterange = (_to_int(attributes.get(b"BYTERANGE-START")), length)
+
+            elif tag_id == _TAG_RENDITION_REPORT:
+                attributes = parse_attribute_list(value)
+                rendition_uri = attributes.get(b"URI", b"").decode('utf-8')
+                rendition_last_msn = _to_int(attributes.get(b"LAST-MSN"))
+                rendition_last_part = _to_int(attributes.get(b"LAST-PART"))
+
+                url = _resolve_url(master_url, base_prefix, rendition_uri)
+
+                media_rendition_reports.append(RenditionReport(url, rendition_last_msn, rendition_last_part))
+
+            elif tag_id == _TAG_MEDIA:
+                attributes = parse_attribute_list(value)
+                if attributes.get(b"TYPE", b"").upper() == b"AUDIO":
+                    groupid = attributes[b"GROUP-ID"].decode('utf-8') if b"GROUP-ID" in attributes else None
+                    url = attributes[b"URI"].decode('utf-8') if b"URI" in attributes else None
+                    url = _resolve_url(master_url, base_prefix, url)
+
+                    media_audios.append(MediaAudio(groupid, url))
+
+            elif tag_id == _TAG_STREAM_INF:
+                if i + 1 < num_lines:
+                    url = lines[i + 1].strip().decode('utf-8')
+                    if base_prefix is not None and _is_plain_relative_url(url):
+                        url = base_prefix + url
+                    else:
+                        parsed_filename = urlparse(url)
+                        url = ensure_absolute_url(master_url, parsed_filename.geturl()) if bool(parsed_filename.path) else None
+                    if url is not None:
+                        attributes = parse_attribute_list(value)
+
+                        bandwidth = _to_int(attributes.get(b"BANDWIDTH"))
+                        resolution = attributes[b"RESOLUTION"].decode('utf-8') if attributes.get(b"RESOLUTION") else None
+                        audio = attributes[b"AUDIO"].decode('utf-8') if b"AUDIO" in attributes else None
+
+                        media_streams.append(MediaStream(url, bandwidth, resolution, audio))
+                        i += 1
+
+            elif tag_id == _TAG_TARGETDURATION:
+                params_target_duration = _to_int(value.strip(), params_target_duration)
+
+            elif tag_id == _TAG_INDEPENDENT_SEGMENTS:
+                params_independent_segments = True
+
+            elif tag_id == _TAG_MEDIA_SEQUENCE:
+                params_media_sequence = segment_num = _to_int(value.strip(), params_media_sequence)
+
+            elif tag_id == _TAG_MAP:
+                attributes = parse_attribute_list(value)
+                if b"URI" in attributes:
+                    params_map_uri = _resolve_url(master_url, base_prefix, attributes[b"URI"].decode('utf-8'))
+
+            elif tag_id == _TAG_SERVER_CONTROL:
+                attributes = parse_attribute_list(value)
+                if b"CAN-BLOCK-RELOAD" in attributes:
+                    params_server_control_can_block_reload = attributes[b"CAN-BLOCK-RELOAD"].upper() == b"YES"
+                if b"PART-HOLD-BACK" in attributes:
+                    params_server_control_part_hold_back = _to_float(attributes[b"PART-HOLD-BACK"], params_server_control_part_hold_back)
+                if b"CAN-SKIP-UNTIL" in attributes:
+                    params_server_control_can_skip_until = _to_float(attributes[b"CAN-SKIP-UNTIL"], params_server_control_can_skip_until)
+                if b"CAN-SKIP-DATERANGES" in attributes:
+                    params_server_control_can_skip_dateranges = attributes[b"CAN-SKIP-DATERANGES"].upper() == b"YES"
+
+            elif tag_id == _TAG_SKIP:
+                # delta playlist: the first segments of the playlist are replaced by this tag, so numbering continues after them
+                attributes = parse_attribute_list(value)
+                params_skip_skipped_segments = _to_int(attributes.get(b"SKIPPED-SEGMENTS"))
+                segment_num += params_skip_skipped_segments
+
+            elif tag_id == _TAG_PART_INF:
+                attributes = parse_attribute_list(value)
+                if b"PART-TARGET" in attributes:
+                    params_part_target = _to_float(attributes[b"PART-TARGET"], params_part_target)
+
         i += 1
 
     manifest = None
@@ -790,20 +1303,82 @@ def parse_m3u8(data: bytearray, master_url: str) -> M3U8:
         manifest.EXT_X_Map_URI = params_map_uri
         manifest.EXT_X_Server_Control_Can_Block_Reload = params_server_control_can_block_reload
         manifest.EXT_X_Server_Control_Part_Hold_Back = params_server_control_part_hold_back
+        manifest.EXT_X_Server_Control_Can_Skip_Until = params_server_control_can_skip_until
+        manifest.EXT_X_Server_Control_Can_Skip_Dateranges = params_server_control_can_skip_dateranges
+        manifest.EXT_X_Skip_Skipped_Segments = params_skip_skipped_segments
         manifest.EXT_X_PartInf_Part_Target = params_part_target
         manifest.Media_Segments = media_segments
         manifest.Media_Parts = media_parts
         manifest.EXT_X_Preload_Hint_URI = media_parts_preload_hint_uri
+        manifest.EXT_X_Preload_Hint_Byterange = media_parts_preload_hint_byterange
         manifest.RenditionReports = media_rendition_reports
 
     return manifest
 
+class HlsSkip(Enum):
+    # value of _HLS_skip query parameter of delta playlist request
+    YES = "YES"     #skip segments
+    V2 = "v2"       #skip segments and EXT-X-DATERANGE tags
+
+    def __str__(self):
+        return '%s' % self.value
+
+def delta_playlist_skip(manifest: M3U8) -> HlsSkip:
+    # None if the server does not advertise delta playlists with CAN-SKIP-UNTIL
+    if manifest is None or manifest.EXT_X_Server_Control_Can_Skip_Until <= 0:
+        return None
+    return HlsSkip.V2 if manifest.EXT_X_Server_Control_Can_Skip_Dateranges else HlsSkip.YES
+
+def merge_delta_playlist(previous: M3U8, delta: M3U8) -> M3U8:
+    # Completes delta playlist by segments skipped by the server, they are taken from the previous playlist of the rendition.
+    # Returns None if the previous playlist does not contain all skipped segments
+    skipped = delta.EXT_X_Skip_Skipped_Segments
+    if skipped <= 0:
+        return delta
+    if previous is None or previous.Type != TypeM3U8.VIDEO or len(previous.Media_Segments) == 0:
+        return None
+
+    # segments are numbered one by one from EXT-X-MEDIA-SEQUENCE, so skipped ones are a slice of the previous list
+    first_skipped = delta.EXT_X_Media_Sequence
+    first_present = first_skipped + skipped
+    start = first_skipped - previous.Media_Segments[0].SegmentNum
+    end = start + skipped
+    if start < 0 or end > len(previous.Media_Segments) or previous.Media_Segments[end - 1].SegmentNum != first_present - 1:
+        return None
+
+    delta.Media_Segments = previous.Media_Segments[start:end] + delta.Media_Segments
+    delta.Media_Parts = [part for part in previous.Media_Parts if first_skipped <= part.Segment < first_present] + delta.Media_Parts
+    return delta
+
+class DeltaPlaylistStats:
+    # Delta playlists (EXT-X-SKIP) of one rendition, savings are against the last full playlist
+    Full_Requests: int
+    Delta_Requests: int
+    Merge_Failures: int     #previous playlist has no skipped segments, so the next request is for a full playlist
+    Full_Bytes: int         #size of the last full playlist
+    Full_Parse_Time: float  #ms, parse time of the last full playlist
+    Bytes_Saved: int
+    Parse_Time_Saved: float #ms, parse time of delta playlist and merge are subtracted
+
+    def __init__(self):
+        self.Full_Requests = 0
+        self.Delta_Requests = 0
+        self.Merge_Failures = 0
+        self.Full_Bytes = 0
+        self.Full_Parse_Time = 0.0
+        self.Bytes_Saved = 0
+        self.Parse_Time_Saved = 0.0
+
+    def __repr__(self):
+        return (f"DeltaPlaylistStats(Full_Requests={self.Full_Requests}, Delta_Requests={self.Delta_Requests}, "
+                f"Merge_Failures={self.Merge_Failures}, Bytes_Saved={self.Bytes_Saved}, Parse_Time_Saved={self.Parse_Time_Saved:.1f} ms)")
+
 def load_and_parse_master(url: str, path_to_save: str = None) -> M3U8:
     parsed_url = urlparse(url)
     if parsed_url is None or not bool(parsed_url.path):
         return None
     
-    file_metrics = download_file_http1(url, path_to_save)
+    file_metrics = download_file(url, path_to_save)
     if file_metrics:
         #print(file_metrics)
 
@@ -829,16 +1404,16 @@ def load_and_parse_manifest(url: str, path_to_save: str = None) -> M3U8:
         if parsed_url is None or not bool(parsed_url.path):
             return None
 
-        #HTTP1
-        file_metrics = download_file_http1(parsed_url.geturl(), path_to_save)        
-        #HTTP2
-        #file_metrics = download_file_http2(parsed_url.geturl(), path_to_save)
+        # HTTP1 or HTTP2, see set_protocol()
+        file_metrics = download_file(parsed_url.geturl(), path_to_save)
         if file_metrics is not None:
             #print(file_metrics)
 
+            timer_parse = time.perf_counter_ns()
             manifest = parse_m3u8(file_metrics.Response_body, parsed_url.geturl())
 
             if manifest:
+                manifest.Parse_Time = (time.perf_counter_ns() - timer_parse) / 1000000
                 manifest.URI = parsed_url.geturl()
                 manifest.Name = os.path.basename(parsed_url.path)
                 manifest.FileDownloaded = file_metrics
@@ -851,7 +1426,7 @@ def load_and_parse_manifest(url: str, path_to_save: str = None) -> M3U8:
                 return tmp
     except Exception as e:
         # Handle exceptions and print the error message
-        print(f"An error occurred: {e}")    
+        logs.print_error(f"An error occurred: {e}")
         logs.write_exception(e)
         status = str(e)
         #return None
@@ -862,6 +1437,36 @@ def load_and_parse_manifest(url: str, path_to_save: str = None) -> M3U8:
     tmp.FileDownloaded = DownloadMetrics(0, f"ERROR {e}")
     return tmp
 
+async def load_and_parse_manifest_async(url: str, path_to_save: str = None) -> M3U8:
+    status = "NO DATA"
+    parsed_url = urlparse(url)
+    try:
+        if parsed_url is None or not bool(parsed_url.path):
+            return None
+
+        file_metrics = await download_file_async(parsed_url.geturl(), path_to_save)
+        if file_metrics is not None:
+            timer_parse = time.perf_counter_ns()
+            manifest = parse_m3u8(file_metrics.Response_body, parsed_url.geturl())
+
+            if not manifest:
+                manifest = M3U8(TypeM3U8.UNDEFINED)
+            manifest.Parse_Time = (time.perf_counter_ns() - timer_parse) / 1000000
+            manifest.URI = parsed_url.geturl()
+            manifest.Name = os.path.basename(parsed_url.path)
+            manifest.FileDownloaded = file_metrics
+            return manifest
+    except Exception as e:
+        # Handle exceptions and print the error message
+        logs.write_exception(e)
+        status = str(e)
+
+    tmp = M3U8(TypeM3U8.UNDEFINED)
+    tmp.URI = parsed_url.geturl()
+    tmp.Name = os.path.basename(parsed_url.path)
+    tmp.FileDownloaded = DownloadMetrics(0, f"ERROR {status}")
+    return tmp
+
         
         
     
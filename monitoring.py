@@ -1,31 +1,162 @@
+import asyncio
+import contextlib
 import datetime
 from enum import Enum
 import os
 import sys
 import threading
+import itertools
 import time
 import traceback
 from typing import Dict, List
 from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
 import display
+import events
+import exporter
+import headless
+import holdtime
 import logs
 import m3u8
+import stats
+import streams
 import concurrent.futures
 
-# A lock object to ensure thread-safe printing
-_global_fileslog_lock = threading.Lock()
-_list_of_logged_files = {}
-_logged_files_id = 0
+# requests started and not finished yet, see InFlightRegistry (created below)
+_in_flight_ttl_s = 30.0    #longer than HTTP timeouts (m3u8.py) and a blocking playlist hold
 
 _global_summaryparts_lock = threading.Lock()
 _summary_response_parts: Dict[int, List[int]] = {}
-_summary_stat_parts: Dict[int, List[tuple[float, float, float]] ] = {}
+_summary_stat_parts: Dict[int, stats.RequestStats] = {}
 _summary_response_manifests: Dict[int, List[int]] = {}
-_summary_stat_manifests: Dict[int, List[tuple[float, float, float]] ] = {}
+_summary_stat_manifests: Dict[int, stats.RequestStats] = {}
 _summary_manifest_part_duration: Dict[int, float] = {}
+_summary_delta_playlists: Dict[int, m3u8.DeltaPlaylistStats] = {}
+_summary_suppressed_parts: Dict[int, tuple[int, int]] = {}   #(duplicates, late)
+_summary_prefetch: Dict[int, "PrefetchStats"] = {}
+_summary_skew: Dict[int, "RenditionSkew"] = {}
 
 _global_escape_pressed = False
 
+# blocking playlist request + parts downloaded in parallel, used to size keep-alive connection pools
+_parts_in_flight_per_rendition = 4
+
+# request delta playlists (_HLS_skip) if the server advertises CAN-SKIP-UNTIL
+_delta_playlists = False
+
+def set_delta_playlists(enabled: bool):
+    global _delta_playlists
+    _delta_playlists = enabled
+
+# request the part of the preload hint (EXT-X-PRELOAD-HINT) together with the blocking playlist request for it,
+# as LL-HLS players do, see PrefetchRequest
+_prefetch = False
+
+def set_prefetch(enabled: bool):
+    global _prefetch
+    _prefetch = enabled
+
+# EXT-X-RENDITION-REPORT: the first request of every rendition is a blocking one at the live edge (seeded by
+# one playlist of the stream, see seed_from_rendition_reports), and the lag of renditions behind the leader is tracked
+_rendition_reports = False
+_live_edge_seeds: Dict[int, tuple[int, int]] = {}   #media index -> (msn, part) of the first request
+
+def set_rendition_reports(enabled: bool):
+    global _rendition_reports
+    _rendition_reports = enabled
+
+# columnar store of all finished requests, None if disabled
+_event_store: events.EventStore = None
+_event_store_settings: tuple[int, str] = (0, None)  #(ram budget MB, directory)
+
+def set_event_store(ram_budget_mb: int, directory: str = None):
+    # ram_budget_mb = 0 disables the store, the summary is calculated from quantile sketches then
+    global _event_store
+    global _event_store_settings
+    _event_store = events.EventStore(ram_budget_mb * 1024 * 1024, directory) if ram_budget_mb > 0 else None
+    _event_store_settings = (ram_budget_mb, directory)
+
+# headless mode: no display, requests and periodic summaries are written as NDJSON, None if disabled
+_headless: headless.HeadlessReporter = None
+
+def set_headless(reporter: headless.HeadlessReporter):
+    global _headless
+    _headless = reporter
+
+# Prometheus/OpenMetrics series of finished requests, None if disabled
+_metrics: exporter.MetricsRegistry = None
+
+def set_metrics(registry: exporter.MetricsRegistry):
+    global _metrics
+    _metrics = registry
+
+# monitored renditions of all streams by media index, set by the coordinator
+_renditions: Dict[int, streams.MonitoredRendition] = {}
+
+def thresholds_of(media_index: int) -> streams.Thresholds:
+    rendition = _renditions.get(media_index)
+    return rendition.Stream.Thresholds if rendition is not None else streams.DEFAULT_THRESHOLDS
+
+def rendition_labels(media_index: int) -> tuple[str, str]:
+    # (stream, rendition) of metrics, the rendition is the path of its playlist relative to the master playlist
+    rendition = _renditions.get(media_index)
+    if rendition is None:
+        return ("", str(media_index))
+    path = urlparse(rendition.Media.URI).path
+    master_directory = os.path.dirname(urlparse(rendition.Stream.URL).path).rstrip("/") + "/"
+    return (rendition.Stream.Name, path[len(master_directory):] if path.startswith(master_directory) else path)
+
+# publish times of parts by stream (renditions of a stream share the clock), see holdtime.py
+_publish_clocks: Dict[str, holdtime.PublishClock] = {}
+_publish_clocks_lock = threading.Lock()
+
+def publish_clock_of(media_index: int) -> holdtime.PublishClock:
+    rendition = _renditions.get(media_index)
+    name = rendition.Stream.Name if rendition is not None else ""
+    clock = _publish_clocks.get(name)
+    if clock is None:
+        with _publish_clocks_lock:
+            clock = _publish_clocks.setdefault(name, holdtime.PublishClock(name))
+    return clock
+
+def estimate_hold(playlist0: m3u8.M3U8, url: str, msn: int, part: int, media_index: int):
+    # sets Time_hold of a blocking playlist request, called right after the playlist is loaded
+    metrics = playlist0.FileDownloaded if playlist0 is not None else None
+    if "_HLS_msn=" not in url or metrics is None or metrics.HTTP_code != 200 or metrics.Response_time is None or playlist0.Type != m3u8.TypeM3U8.VIDEO:
+        return
+    arrived_at = time.time() - playlist0.Parse_Time / 1000
+    sent_at = arrived_at - metrics.Response_time / 1000
+    metrics.Time_hold = publish_clock_of(media_index).expected_hold(playlist0, msn, part, sent_at, arrived_at)
+
+def measure_live_latency(type: m3u8.TypeDownload, segmentnum: int, partnum: int, metrics: m3u8.DownloadMetrics, manifest: m3u8.M3U8):
+    # sets Live_latency: arrival behind the end of the newest part in program time (EXT-X-PROGRAM-DATE-TIME),
+    # for a playlist its newest part (or segment), for a part the part itself; clocks of the packager and this host must be in sync (NTP)
+    if manifest is None or not metrics.succeeded():
+        return
+    arrived_at = time.time()
+    newest = None
+    if type == m3u8.TypeDownload.MANIFEST_MEDIA:
+        arrived_at -= manifest.Parse_Time / 1000
+        newest = manifest.Media_Parts[-1] if manifest.Media_Parts else (manifest.Media_Segments[-1] if manifest.Media_Segments else None)
+    elif type == m3u8.TypeDownload.FILE_PART:
+        for part in reversed(manifest.Media_Parts):
+            if part.Segment == segmentnum and part.PartNum == partnum:
+                newest = part
+                break
+    if newest is None or newest.Program_time is None:
+        return
+    metrics.Live_latency = (arrived_at - newest.Program_time - newest.Duration) * 1000
+
+# results of renditions monitored by worker processes (see sharding.py): current summary rows by worker, HTTP2 edges
+_remote_summary_rows: Dict[int, List[Dict]] = {}
+_remote_h2_edge_stats: List[m3u8.H2EdgeStats] = []
+
+# part downloads of all renditions of the async engine in parallel (global worker budget), None = no limit
+_part_slots: asyncio.Semaphore = None
+
+def close_event_store():
+    if _event_store is not None:
+        _event_store.close()
+
 class SummaryStatus(Enum):
     OK = 0
     STALE = 1
@@ -144,11 +275,8 @@ def _safe_add_summaryparts_to_list_internal(media_index: int, summary: SummarySt
         _summary_response_parts[media_index] = v
 
     if _summary_stat_parts.get(media_index) is None:
-        v = [tuple((metrics.Response_time, metrics.Download_time, metrics.Download_speed))]
-        _summary_stat_parts[media_index] = v
-    else:
-        v = _summary_stat_parts[media_index]
-        v.append(tuple((metrics.Response_time, metrics.Download_time, metrics.Download_speed)))
+        _summary_stat_parts[media_index] = stats.RequestStats()
+    _summary_stat_parts[media_index].add(metrics)
 
     pass
 
@@ -157,72 +285,175 @@ def _safe_add_summarymanifests_to_list(*args, **kwargs):
         return _safe_add_summarymanifests_to_list_internal(*args, **kwargs)
 
 # Function to add a new object to the dictionary
-def _safe_add_summarymanifests_to_list_internal(media_index: int, summary_response, summary_stat, summary_manifest_part_duration: float):
+def _safe_add_summarymanifests_to_list_internal(media_index: int, summary_response, summary_stat, summary_manifest_part_duration: float, summary_delta_playlists: m3u8.DeltaPlaylistStats = None, processed_parts: "ProcessedPartsWindow" = None):
     global _summary_response_manifests
     global _summary_stat_manifests
     global _summary_manifest_part_duration
+    global _summary_delta_playlists
+    global _summary_suppressed_parts
 
     _summary_response_manifests[media_index] = summary_response
     _summary_stat_manifests[media_index] = summary_stat
     _summary_manifest_part_duration[media_index] = summary_manifest_part_duration
+    if summary_delta_playlists is not None:
+        _summary_delta_playlists[media_index] = summary_delta_playlists
+    if processed_parts is not None:
+        _summary_suppressed_parts[media_index] = (processed_parts.Duplicates_Suppressed, processed_parts.Late_Suppressed)
 
     pass  
 
 
-def run_task_for_downloading_part_1(segmentnum: int, partnum: int, url_to_download: str, media_manifest: m3u8.MediaStream, manifest: m3u8.M3U8, path_to_save: str = None, media_index: int = None, file_id: int = None) -> bool:
+def run_task_for_downloading_part_1(segmentnum: int, partnum: int, url_to_download: str, media_manifest: m3u8.MediaStream, manifest: m3u8.M3U8, path_to_save: str = None, media_index: int = None, file_id: int = None, byterange: tuple[int, int] = None) -> bool:
     try:
-        #HTTP1
-        metrics = m3u8.download_file_http1(url_to_download, path_to_save)   #-> wait for response in parallel, and print result on screen
-        #HTTP2
-        #metrics = m3u8.download_file_http2(url_to_download, path_to_save)   #-> wait for response in parallel, and print result on screen
+        # HTTP1 or HTTP2, see m3u8.set_protocol()
+        metrics = m3u8.download_file(url_to_download, path_to_save, byterange)   #-> wait for response in parallel, and print result on screen
         #display.display_downloadstatus(m3u8.TypeDownload.FILE_PART, segmentnum, partnum, metrics)
         ssummary = display_status_of_download(m3u8.TypeDownload.FILE_PART, segmentnum, partnum, metrics, media_manifest, manifest, media_index, file_id)
         _safe_add_summaryparts_to_list(media_index, ssummary, metrics)
     except Exception as e:
         # Handle exceptions and print the error message
-        print(f"An error occurred: {e}")
+        logs.print_error(f"An error occurred: {e}")
         logs.write_exception(e)
+        _in_flight.abandon(media_index, file_id)
 
 
-def _safe_add_filetolog_to_dict(*args, **kwargs) -> int:
-    with _global_fileslog_lock:
-        return _safe_add_filetolog_to_dict_internal(*args, **kwargs)
-
-# Function to add a new object to the dictionary
-def _safe_add_filetolog_to_dict_internal(data) -> int:
-    global _logged_files_id
+def run_task_for_prefetching_part_1(prefetch: "PrefetchRequest", media_manifest: m3u8.MediaStream, path_to_save: str = None, media_index: int = None, file_id: int = None) -> bool:
+    # part of the preload hint, in parallel with the blocking playlist request for it
+    try:
+        sent_at = time.time()
+        metrics = m3u8.download_file(prefetch.URI, path_to_save, prefetch.Byterange)
+        prefetch_part_finished(prefetch, metrics, sent_at, media_index)
+        ssummary = display_status_of_download(m3u8.TypeDownload.FILE_PART, prefetch.Segment, prefetch.Part, metrics, media_manifest, prefetch.Playlist, media_index, file_id)
+        _safe_add_summaryparts_to_list(media_index, ssummary, metrics)
+    except Exception as e:
+        # Handle exceptions and print the error message
+        logs.print_error(f"An error occurred: {e}")
+        logs.write_exception(e)
+        _in_flight.abandon(media_index, file_id)
+
+
+class InFlightShard:
+    # Requests in flight of one rendition, with their own lock
+    Entries: Dict[int, tuple[float, dict]]     #file id -> (deadline, log data), in order of deadlines
+    Max_Depth: int
+    Timed_Out: int          #not finished before the deadline
+    Orphaned: int           #never finished: exception or the rendition loop ended before
+    Finished_After_Timeout: int
+
+    def __init__(self):
+        self.Entries = {}
+        self.Max_Depth = 0
+        self.Timed_Out = 0
+        self.Orphaned = 0
+        self.Finished_After_Timeout = 0
+        self.Lock = threading.Lock()
+
+
+class InFlightRegistry:
+    # Registry of requests from display_download_started() to display_status_of_download().
+    # Entries have a deadline (same TTL for all, so deadlines are in order of insertion and expired entries are
+    # evicted from the head of the dict), memory is bounded even if the result of a request never comes.
+    # Timed-out and orphaned requests are counted and written to the log as "NOT COMPLETED".
+    Ttl: float
+    Shards: Dict[int, InFlightShard]    #media index -> shard
+
+    def __init__(self, ttl: float):
+        self.Ttl = ttl
+        self.Shards = {}
+        self._ids = itertools.count(1)
+        self._shards_lock = threading.Lock()
+
+    def shard(self, media_index: int) -> InFlightShard:
+        shard = self.Shards.get(media_index)
+        if shard is None:
+            with self._shards_lock:
+                shard = self.Shards.setdefault(media_index, InFlightShard())
+        return shard
+
+    def start(self, media_index: int, data: dict) -> int:
+        file_id = next(self._ids)
+        shard = self.shard(media_index)
+        now = time.monotonic()
+        with shard.Lock:
+            expired = self._evict_expired(shard, now)
+            shard.Entries[file_id] = (now + self.Ttl, data)
+            shard.Max_Depth = max(shard.Max_Depth, len(shard.Entries))
+        self._log_not_completed(expired, "TIMEOUT")
+        return file_id
+
+    def finish(self, media_index: int, file_id: int) -> dict:
+        # Returns log data of the request, None if it was evicted
+        shard = self.shard(media_index)
+        with shard.Lock:
+            entry = shard.Entries.pop(file_id, None)
+            if entry is None:
+                shard.Finished_After_Timeout += 1
+                return None
+        return entry[1]
+
+    def abandon(self, media_index: int, file_id: int):
+        # the request failed without a result (exception)
+        shard = self.shard(media_index)
+        with shard.Lock:
+            entry = shard.Entries.pop(file_id, None)
+            if entry is not None:
+                shard.Orphaned += 1
+        if entry is not None:
+            self._log_not_completed([entry[1]], "ORPHANED")
+
+    def close_rendition(self, media_index: int):
+        # the rendition loop ended, whatever is left will never complete
+        shard = self.shard(media_index)
+        with shard.Lock:
+            orphaned = [data for _, data in shard.Entries.values()]
+            shard.Entries.clear()
+            shard.Orphaned += len(orphaned)
+        self._log_not_completed(orphaned, "ORPHANED")
+
+    def depth(self, media_index: int) -> int:
+        return len(self.shard(media_index).Entries)
+
+    def _evict_expired(self, shard: InFlightShard, now: float) -> List[dict]:
+        expired = []
+        while shard.Entries:
+            file_id, (deadline, data) = next(iter(shard.Entries.items()))
+            if deadline > now:
+                break
+            del shard.Entries[file_id]
+            expired.append(data)
+        shard.Timed_Out += len(expired)
+        return expired
 
-    _logged_files_id += 1
+    def _log_not_completed(self, entries: List[dict], reason: str):
+        for data in entries:
+            logs.write_error(data | {"status": "NOT COMPLETED", "reason": reason})
 
-    id = _logged_files_id
-    _list_of_logged_files[id] = data
-    return id
+_in_flight = InFlightRegistry(_in_flight_ttl_s)
 
-def _safe_get_filetolog_from_dict(*args, **kwargs) -> int:
-    with _global_fileslog_lock:
-        return _safe_get_filetolog_from_dict_internal(*args, **kwargs)
 
-# Function to add a new object to the dictionary
-def _safe_get_filetolog_from_dict_internal(file_id) -> any:
-    obj = _list_of_logged_files.pop(file_id, None)
-    if obj is not None:
-        return obj
-    else:
-        return None
+def connection_state_text(connection_reused: bool) -> str:
+    if connection_reused is None:
+        return ""
+    return "reused" if connection_reused else "new"
 
+def phases_fields(metrics: m3u8.DownloadMetrics) -> dict:
+    # dns, connect, tls, send, wait, body in ms, None if the phase did not happen
+    return {f"{phase}_ms": round(v, 1) if v is not None else None for phase, v in metrics.phases_ms().items()}
 
 def display_download_started(type: m3u8.TypeDownload, url: str, segment: int, part: int, media_index: int, initiator: str, force_new_line: bool = False) -> int:
-    fileid = _safe_add_filetolog_to_dict((
-        datetime.datetime.now(datetime.UTC).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
-        type, 
-        url, 
-        segment, 
-        part, 
-        media_index,
-        threading.current_thread().name,
-        initiator
-        ))
-    display.display_downloadstarted(type, segment, part, url, media_index, force_new_line)
+    fileid = _in_flight.start(media_index, {
+        "started": datetime.datetime.now(datetime.UTC).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
+        "type": type,
+        "url": url,
+        "segment": segment,
+        "part": part,
+        "media_index": media_index,
+        "thread": threading.current_thread().name,
+        "initiator": initiator,
+        })
+    if _headless is None:
+        display.display_downloadstarted(type, segment, part, url, media_index, force_new_line)
+        display.display_in_flight(media_index, _in_flight.depth(media_index))
     return fileid
 
 def display_status_of_download(type: m3u8.TypeDownload, segmentnum: int, partnum: int, metrics: m3u8.DownloadMetrics = None, media_manifest: m3u8.MediaStream = None, manifest: m3u8.M3U8 = None, media_index:int = None, file_id: int = None) -> SummaryStatus:    
@@ -234,6 +465,14 @@ def display_status_of_download(type: m3u8.TypeDownload, segmentnum: int, partnum
                 metrics = manifest.FileDownloaded
             else:
                 display.display_downloadstatus(type, segmentnum, partnum, "NO DATA", display.Colors.RED, [(" - ", display.Colors.RED),(" - ", display.Colors.RED),(" - ", display.Colors.RED)], None, media_index)
+                if _event_store is not None:
+                    _event_store.add(type, media_index, segmentnum, partnum, SummaryStatus.ERROR.value)
+                if _metrics is not None:
+                    _metrics.observe(type, media_index, SummaryStatus.ERROR.name)
+                if _headless is not None:
+                    _headless.write_request(type, media_index, segmentnum, partnum, SummaryStatus.ERROR.name, "NO DATA")
+                if file_id is not None:
+                    _in_flight.abandon(media_index, file_id)
                 return SummaryStatus.ERROR
 
         if metrics.Response_time is None:
@@ -243,13 +482,16 @@ def display_status_of_download(type: m3u8.TypeDownload, segmentnum: int, partnum
         if metrics.Download_speed is None:
             metrics.Download_speed = 0
 
+        measure_live_latency(type, segmentnum, partnum, metrics, manifest)
+
         status: str = metrics.Status
         status_color: display.Colors = None
         download_time_color: display.Colors = None
         response_time_color: display.Colors = None
         download_speed_color: display.Colors = None
+        thresholds = thresholds_of(media_index)
 
-        if metrics.HTTP_code != 200:
+        if not metrics.succeeded():
             #status = f'ERROR {metrics.HTTP_code} {status}'
             status = f'ERROR {metrics.HTTP_code}'
             status_color = display.Colors.RED 
@@ -262,7 +504,11 @@ def display_status_of_download(type: m3u8.TypeDownload, segmentnum: int, partnum
             # if metrics.Download_speed is below in the main part
 
         elif type == m3u8.TypeDownload.MANIFEST_MEDIA:
+            # the expected hold of a blocking request is not a delay, only the rest of the response time is
+            excess_time = metrics.excess_time()
             if manifest is None:
+                if file_id is not None:
+                    _in_flight.abandon(media_index, file_id)
                 return SummaryStatus.ERROR
 
             lastpart: m3u8.MediaPart = None
@@ -287,12 +533,12 @@ def display_status_of_download(type: m3u8.TypeDownload, segmentnum: int, partnum
                 status_color = display.Colors.MAGENTA
                 summary_status = SummaryStatus.STALE
             
-            if ((manifest.EXT_X_PartInf_Part_Target > 0 and metrics.Response_time > manifest.EXT_X_PartInf_Part_Target * 1000)
-                    or (metrics.Response_time > 500)):  #Response_time in ms, but PartTarget in sec
+            if ((manifest.EXT_X_PartInf_Part_Target > 0 and excess_time > manifest.EXT_X_PartInf_Part_Target * 1000)
+                    or (excess_time > thresholds.Playlist_response_ms)):  #excess_time in ms, but PartTarget in sec
                 status = status + " DELAY" if len(status)>0 else "DELAY"
                 response_time_color = display.Colors.CYAN
                 #summary_status = SummaryStatus.DELAY
-            if (manifest.EXT_X_Target_Duration > 0 and metrics.Response_time > manifest.EXT_X_Target_Duration * 1000):  #Response_time in ms, but TargetDuration in sec
+            if (manifest.EXT_X_Target_Duration > 0 and excess_time > manifest.EXT_X_Target_Duration * thresholds.Playlist_response_factor * 1000):  #excess_time in ms, but TargetDuration in sec
                 status = status + " DELAY" if len(status)>0 else "DELAY"
                 response_time_color = display.Colors.YELLOW
                 summary_status = SummaryStatus.DELAY
@@ -309,16 +555,17 @@ def display_status_of_download(type: m3u8.TypeDownload, segmentnum: int, partnum
                 download_speed_color = display.Colors.CYAN
 
         elif type == m3u8.TypeDownload.FILE_PART:
-            if metrics.Response_time > manifest.EXT_X_PartInf_Part_Target * 1000:  #Response_time in ms, but PartTarget in sec
+            # a part of the preload hint is held by the server till it's published, only the excess is a delay
+            if metrics.excess_time() > manifest.EXT_X_PartInf_Part_Target * thresholds.Part_response_factor * 1000:  #Response_time in ms, but PartTarget in sec
                 status = "DELAY"
                 response_time_color = display.Colors.YELLOW
                 summary_status = SummaryStatus.DELAY
             
             #Download_time in ms
             #Download_speed in bps = bits per second
-            if metrics.Download_time > 150 or (media_manifest is not None and metrics.Download_speed < media_manifest.Bandwidth):
+            if metrics.Download_time > thresholds.Part_download_ms or (media_manifest is not None and metrics.Download_speed < media_manifest.Bandwidth):
                 status += " SLOW"
-                if metrics.Download_time > 150:
+                if metrics.Download_time > thresholds.Part_download_ms:
                     download_time_color = display.Colors.YELLOW
                 else:
                     download_speed_color = display.Colors.CYAN
@@ -328,32 +575,42 @@ def display_status_of_download(type: m3u8.TypeDownload, segmentnum: int, partnum
 
         #metrics_str = f"{(metrics.Download_time):5.1f}/{metrics.Response_time:4.0f}/{metrics.Download_speed/1000/1000:5.1f}"
 
-        metrics_tuple = [
-            (f"{metrics.Response_time:4.0f}", response_time_color),
-            (f"{metrics.Download_time:5.1f}", download_time_color),
-            (f"{metrics.Download_speed/1000/1000:5.1f}", download_speed_color)
-        ]    
+        # nobody looks at the screen in headless mode
+        metrics_tuple = None
+        if _headless is None:
+            metrics_tuple = [
+                (f"{metrics.Response_time:4.0f}", response_time_color),
+                (f"{metrics.Download_time:5.1f}", download_time_color),
+                (f"{metrics.Download_speed/1000/1000:5.1f}", download_speed_color)
+            ]    
 
         #if status_color is None and (download_time_color is not None or response_time_color is not None or download_speed_color is not None):
         status_color = min([status_color, download_time_color, response_time_color, download_speed_color], key=lambda x: x.value if x is not None else 1000)
 
         #write to log
         if file_id is not None:
-            obj = _safe_get_filetolog_from_dict(file_id)
+            obj = _in_flight.finish(media_index, file_id)
+            if _headless is None:
+                display.display_in_flight(media_index, _in_flight.depth(media_index))
             if obj is not None:
-                object_to_print = (obj + (
-                                        status,
-                                        status_color,
-                                        metrics.HTTP_code,
-                                        metrics.Status,
-                                        f"{metrics.Time_headers:.1f}" if metrics and metrics.Time_headers is not None else "0",
-                                        f"{metrics.Download_time:.1f}" if metrics and metrics.Download_time is not None else "0",
-                                        f"{metrics.Response_time:.0f}" if metrics and metrics.Response_time is not None else "0",
-                                        f"{metrics.Download_speed/1000/1000:.1f}" if metrics and metrics.Download_speed is not None else "0"                                        
-                                    )
-                                    + (tuple([tup[1] for tup in metrics.Headers]) if metrics.Headers is not None else ()))
+                object_to_print = obj | {
+                    "status": status,
+                    "color": status_color,
+                    "http_code": metrics.HTTP_code,
+                    "http_status": metrics.Status,
+                    "headers_ms": round(metrics.Time_headers, 1) if metrics.Time_headers is not None else 0,
+                    "download_ms": round(metrics.Download_time, 1) if metrics.Download_time is not None else 0,
+                    "response_ms": round(metrics.Response_time) if metrics.Response_time is not None else 0,
+                    "speed_mbps": round(metrics.Download_speed/1000/1000, 1) if metrics.Download_speed is not None else 0,
+                    "connection": connection_state_text(metrics.Connection_reused),
+                    "hold_ms": round(metrics.Time_hold) if metrics.Time_hold is not None else None,
+                    "excess_ms": round(metrics.excess_time()) if metrics.Time_hold is not None else None,
+                    "live_ms": round(metrics.Live_latency) if metrics.Live_latency is not None else None,
+                    }
+                object_to_print.update(phases_fields(metrics))
+                object_to_print["headers"] = dict(metrics.Headers) if metrics.Headers is not None else {}
                 
-                if metrics.HTTP_code != 200 or (status_color is not None and status_color == display.Colors.RED):
+                if not metrics.succeeded() or (status_color is not None and status_color == display.Colors.RED):
                     logs.write_error(object_to_print)
                     pass
                 elif status_color is not None:
@@ -363,41 +620,512 @@ def display_status_of_download(type: m3u8.TypeDownload, segmentnum: int, partnum
                     logs.write_info(object_to_print)
                     pass
                 
-        display.display_downloadstatus(type, segmentnum, partnum, status, status_color, metrics_tuple, metrics, media_index)
+        if _event_store is not None:
+            _event_store.add(type, media_index, segmentnum, partnum, summary_status.value, metrics)
+        if _metrics is not None:
+            _metrics.observe(type, media_index, summary_status.name, metrics)
+
+        if _headless is not None:
+            _headless.write_request(type, media_index, segmentnum, partnum, summary_status.name, status, metrics)
+        else:
+            display.display_downloadstatus(type, segmentnum, partnum, status, status_color, metrics_tuple, metrics, media_index)
+            if metrics.Live_latency is not None:
+                display.display_live_latency(media_index, metrics.Live_latency)
 
         return summary_status
     except Exception as e:
         # Handle exceptions and print the error message
-        print(f"An error occurred: {e}")
+        logs.print_error(f"An error occurred: {e}")
         logs.write_exception(e)
         return SummaryStatus.ERROR
     
     
-def run_tasks_for_media_manifest_1(media_manifest: m3u8.M3U8, media_index: int, limit_downloads: int) -> bool:
-    global _global_escape_pressed
+class MonitoringEngine(Enum):
+    THREAD = "thread"
+    ASYNC = "async"
 
-    current_ipart: int = 0
-    current_part = (0,0)
-    processed_parts : List[int] = []
-    task_id = 0
-    num_of_errors_in_a_raw = 0
+    def __str__(self):
+        return '%s' % self.value
 
-    summary_response_manifests: List[int] = [0,0,0,0]
-    summary_stat_manifests: List[tuple[float, float, float]] = []
-    summary_manifest_part_duration = 0.0
 
-    # init as first playlist to download
-    url_llhls_playlist = media_manifest.URI
+class ProcessedPartsWindow:
+    # Parts already sent for downloading, by absolute part index (msn * parts in segment + part).
+    # Bitmap ring over the last Capacity indexes: O(1) test and insert, memory bounded by the playlist window.
+    # Indexes older than the window are evicted and treated as late, they are not downloaded again.
+    Capacity: int
+    Head: int                   #highest index seen, -1 if none
+    Duplicates_Suppressed: int  #index already processed
+    Late_Suppressed: int        #index older than the window
+
+    def __init__(self, capacity: int = 64):
+        self.Capacity = 1 << max(capacity - 1, 1).bit_length()
+        self.Head = -1
+        self.Duplicates_Suppressed = 0
+        self.Late_Suppressed = 0
+        self._bits = bytearray(self.Capacity)
+
+    def resize(self, window: int):
+        # the ring grows to the window of the playlist, only when the window gets bigger
+        if window <= self.Capacity:
+            return
+        old_bits, old_capacity = self._bits, self.Capacity
+        self.Capacity = 1 << (window - 1).bit_length()
+        self._bits = bytearray(self.Capacity)
+        for index in range(max(self.Head - old_capacity + 1, 0), self.Head + 1):
+            self._bits[index & (self.Capacity - 1)] = old_bits[index & (old_capacity - 1)]
+
+    def add(self, index: int) -> bool:
+        # Returns True if the part is new, False if it is a duplicate or too late
+        if self.Head >= 0 and index <= self.Head - self.Capacity:
+            self.Late_Suppressed += 1
+            return False
+        mask = self.Capacity - 1
+        if index > self.Head:
+            # slots of indexes between the old and the new head leave the window
+            if index - self.Head >= self.Capacity:
+                self._bits = bytearray(self.Capacity)
+            else:
+                for i in range(self.Head + 1, index + 1):
+                    self._bits[i & mask] = 0
+            self.Head = index
+        if self._bits[index & mask]:
+            self.Duplicates_Suppressed += 1
+            return False
+        self._bits[index & mask] = 1
+        return True
+
+    def __contains__(self, index: int) -> bool:
+        return self.Head - self.Capacity < index <= self.Head and self._bits[index & (self.Capacity - 1)] == 1
+
+
+class PrefetchStats:
+    # Parts of preload hints requested together with the blocking playlist request of one rendition (prefetch mode).
+    # Skew = playlist available − part available (response headers), both requests are held by the server
+    # till the part is published, so the skew is how much sooner one of them is released by the origin or CDN.
+    Requests: int
+    Failed: int                         #part failed or playlist without the part (STALE, error), no skew
+    Part_First: int
+    Playlist_First: int
+    Part_Lead: stats.QuantileSketch     #ms the part was available before the playlist
+    Playlist_Lead: stats.QuantileSketch #ms the playlist was available before the part
+
+    def __init__(self):
+        self.Requests = 0
+        self.Failed = 0
+        self.Part_First = 0
+        self.Playlist_First = 0
+        self.Part_Lead = stats.QuantileSketch()
+        self.Playlist_Lead = stats.QuantileSketch()
+
+    def add(self, skew_ms: float):
+        # skew_ms = None if the pair failed
+        self.Requests += 1
+        if skew_ms is None:
+            self.Failed += 1
+        elif skew_ms >= 0:
+            self.Part_First += 1
+            self.Part_Lead.add(skew_ms)
+        else:
+            self.Playlist_First += 1
+            self.Playlist_Lead.add(-skew_ms)
+
+    def merge(self, other: "PrefetchStats"):
+        self.Requests += other.Requests
+        self.Failed += other.Failed
+        self.Part_First += other.Part_First
+        self.Playlist_First += other.Playlist_First
+        self.Part_Lead.merge(other.Part_Lead)
+        self.Playlist_Lead.merge(other.Playlist_Lead)
+
+    def __repr__(self):
+        return (f"PrefetchStats(Requests={self.Requests}, Failed={self.Failed}, Part_First={self.Part_First}, "
+                f"Playlist_First={self.Playlist_First})")
+
+
+class PrefetchRequest:
+    # Part of the preload hint of a playlist, requested together with the blocking playlist request for the same part.
+    # Whichever of the two is reported the last records the skew.
+    Segment: int
+    Part: int
+    IPart: int                      #absolute part index, see ProcessedPartsWindow
+    URI: str
+    Byterange: tuple[int, int]      #(start, length) of a byte-range hint, length None = open-ended, None = the whole resource
+    Playlist: m3u8.M3U8             #playlist with the hint
+    Previous: tuple[int, int]       #(msn, part) of the last part of the playlist, the hinted part is the next one
+    Part_Available: float           #unix time of response headers, None if not reported or failed
+    Playlist_Available: float
+
+    def __init__(self, segment: int, part: int, i_part: int, uri: str, playlist: m3u8.M3U8, previous: tuple[int, int]):
+        self.Segment = segment
+        self.Part = part
+        self.IPart = i_part
+        self.URI = uri
+        self.Byterange = playlist.EXT_X_Preload_Hint_Byterange
+        self.Playlist = playlist
+        self.Previous = previous
+        self.Part_Available = None
+        self.Playlist_Available = None
+        self._reports = 0
+        self._lock = threading.Lock()
+
+    def report(self, is_part: bool, available_at: float) -> tuple[bool, float]:
+        # available_at = None if the request failed
+        # Returns (both requests are reported, skew in ms or None)
+        with self._lock:
+            if is_part:
+                self.Part_Available = available_at
+            else:
+                self.Playlist_Available = available_at
+            self._reports += 1
+            if self._reports < 2:
+                return False, None
+        if self.Part_Available is None or self.Playlist_Available is None:
+            return True, None
+        return True, (self.Playlist_Available - self.Part_Available) * 1000
+
+    def __repr__(self):
+        return f"PrefetchRequest(Segment={self.Segment}, Part={self.Part}, URI='{self.URI}')"
+
+def _report_prefetch(prefetch: PrefetchRequest, is_part: bool, metrics: m3u8.DownloadMetrics, sent_at: float, media_index: int):
+    available_at = None
+    if metrics is not None and metrics.succeeded() and metrics.Response_time is not None:
+        available_at = sent_at + (metrics.Time_headers if metrics.Time_headers is not None else metrics.Response_time) / 1000
+    done, skew_ms = prefetch.report(is_part, available_at)
+    if done:
+        with _global_summaryparts_lock:
+            _summary_prefetch.setdefault(media_index, PrefetchStats()).add(skew_ms)
+
+def prefetch_part_finished(prefetch: PrefetchRequest, metrics: m3u8.DownloadMetrics, sent_at: float, media_index: int):
+    # the part is not in any playlist yet, its hold is estimated from the first time the previous part was seen
+    if metrics is not None and metrics.succeeded() and metrics.Response_time is not None:
+        metrics.Time_hold = publish_clock_of(media_index).expected_hold_after(prefetch.Previous, prefetch.Playlist.EXT_X_PartInf_Part_Target,
+                                                                             sent_at, sent_at + metrics.Response_time / 1000)
+        # live latency as in measure_live_latency(), the part starts where the previous part ends, its duration is the part target
+        for part in reversed(prefetch.Playlist.Media_Parts):
+            if (part.Segment, part.PartNum) == prefetch.Previous:
+                if part.Program_time is not None:
+                    metrics.Live_latency = (time.time() - part.Program_time - part.Duration - prefetch.Playlist.EXT_X_PartInf_Part_Target) * 1000
+                break
+    _report_prefetch(prefetch, True, metrics, sent_at, media_index)
+
+def prefetch_playlist_finished(prefetch: PrefetchRequest, playlist0: m3u8.M3U8, sent_at: float, media_index: int):
+    # the playlist is available for the part only if it has the part (not STALE)
+    metrics = None
+    if playlist0 is not None and any(part.Segment == prefetch.Segment and part.PartNum == prefetch.Part for part in playlist0.Media_Parts[-8:]):
+        metrics = playlist0.FileDownloaded
+    _report_prefetch(prefetch, False, metrics, sent_at, media_index)
+
+
+class RenditionSkew:
+    # Lag of one rendition behind the leader of its stream, from its own playlists: the last part of the playlist
+    # against LAST-MSN/LAST-PART of the other renditions (EXT-X-RENDITION-REPORT) at the time the playlist was made.
+    # Renditions published in lockstep have the lag 0.
+    Samples: int
+    Behind: int                         #playlists behind the leader
+    Last_Parts: int                     #lag of the latest playlist
+    Parts: stats.QuantileSketch
+    Lag_time: stats.QuantileSketch      #ms, parts × part target duration
+
+    def __init__(self):
+        self.Samples = 0
+        self.Behind = 0
+        self.Last_Parts = 0
+        self.Parts = stats.QuantileSketch()
+        self.Lag_time = stats.QuantileSketch()
+
+    def add(self, parts: int, lag_ms: float):
+        self.Samples += 1
+        if parts > 0:
+            self.Behind += 1
+        self.Last_Parts = parts
+        self.Parts.add(parts)
+        self.Lag_time.add(lag_ms)
+
+    def merge(self, other: "RenditionSkew"):
+        self.Samples += other.Samples
+        self.Behind += other.Behind
+        self.Last_Parts = other.Last_Parts
+        self.Parts.merge(other.Parts)
+        self.Lag_time.merge(other.Lag_time)
+
+    def __repr__(self):
+        return f"RenditionSkew(Samples={self.Samples}, Behind={self.Behind}, Last_Parts={self.Last_Parts})"
+
+def parts_in_segment(playlist0: m3u8.M3U8) -> int:
+    # parts per segment for absolute part indexes (msn * parts in segment + part), 0 if the playlist has no parts
+    if playlist0.EXT_X_PartInf_Part_Target > 0:
+        return int(playlist0.EXT_X_Target_Duration // round(playlist0.EXT_X_PartInf_Part_Target, 1))
+    return 0
+
+def _reported_parts(playlist0: m3u8.M3U8, max_parts_in_segment: int) -> List[tuple[str, int]]:
+    # (URI path, absolute index of the last part) of the other renditions
+    return [(urlparse(report.URI).path, report.LastMSN * max_parts_in_segment + report.LastPart)
+            for report in playlist0.RenditionReports if report.LastMSN is not None and report.LastPart is not None]
+
+def record_rendition_skew(playlist0: m3u8.M3U8, media_index: int):
+    max_parts_in_segment = parts_in_segment(playlist0)
+    if max_parts_in_segment == 0 or not playlist0.Media_Parts:
+        return
+    reported = _reported_parts(playlist0, max_parts_in_segment)
+    if not reported:
+        return
+    last_part = playlist0.Media_Parts[-1]
+    own = last_part.Segment * max_parts_in_segment + last_part.PartNum
+    lag = max(max(i_part for _, i_part in reported) - own, 0)
+    with _global_summaryparts_lock:
+        _summary_skew.setdefault(media_index, RenditionSkew()).add(lag, lag * playlist0.EXT_X_PartInf_Part_Target * 1000)
+    if _headless is None:
+        display.display_rendition_skew(media_index, lag)
+
+def seed_from_rendition_reports(renditions: List[streams.MonitoredRendition]):
+    # One non-blocking playlist of every stream instead of one of every rendition: its last part and its rendition
+    # reports give the last part of every rendition, so their first request is a blocking one for the next part.
+    # Renditions without a report start with a non-blocking request as usual.
+    _live_edge_seeds.clear()
+    groups: Dict[streams.StreamConfig, List[streams.MonitoredRendition]] = {}
+    for rendition in renditions:
+        groups.setdefault(rendition.Stream, []).append(rendition)
+    for stream_renditions in groups.values():
+        playlist0 = m3u8.load_and_parse_manifest(stream_renditions[0].Media.URI)
+        if playlist0 is None or playlist0.FileDownloaded is None or playlist0.FileDownloaded.HTTP_code != 200 or playlist0.Type != m3u8.TypeM3U8.VIDEO:
+            continue
+        max_parts_in_segment = parts_in_segment(playlist0)
+        if max_parts_in_segment == 0 or not playlist0.Media_Parts:
+            continue
+        last_part = playlist0.Media_Parts[-1]
+        last_parts = dict(_reported_parts(playlist0, max_parts_in_segment))
+        last_parts[urlparse(stream_renditions[0].Media.URI).path] = last_part.Segment * max_parts_in_segment + last_part.PartNum
+        for rendition in stream_renditions:
+            i_part = last_parts.get(urlparse(rendition.Media.URI).path)
+            if i_part is not None:
+                _live_edge_seeds[rendition.Media_index] = divmod(i_part + 1, max_parts_in_segment)
+
+
+class RenditionLoopState:
+    # Progress of one rendition loop, shared by the thread and the asyncio engines
+    Media_Manifest: m3u8.MediaStream
+    Media_Index: int
+    Current_IPart: int
+    Current_Part: tuple[int, int]
+    Processed_Parts: ProcessedPartsWindow
+    Num_Of_Errors_In_A_Raw: int
+    Url_LLHLS_Playlist: str
+    Path_To_Save_Files: str
+    Timer_Start: float
+    Summary_Response_Manifests: List[int]
+    Summary_Stat_Manifests: stats.RequestStats
+    Summary_Manifest_Part_Duration: float
+    Last_Playlist: m3u8.M3U8    #full or merged playlist, base for the next delta playlist
+    Delta_Stats: m3u8.DeltaPlaylistStats
+    Preload_Hint: PrefetchRequest   #part of the preload hint of the last playlist, requested with the next playlist in prefetch mode
+    Prefetched_IPart: int           #part index of the last prefetched part, not downloaded again when it's listed
+
+    def __init__(self, media_manifest: m3u8.MediaStream, media_index: int):
+        self.Media_Manifest = media_manifest
+        self.Media_Index = media_index
+        self.Current_IPart = 0
+        self.Current_Part = (0,0)
+        self.Processed_Parts = ProcessedPartsWindow()
+        self.Num_Of_Errors_In_A_Raw = 0
+        # init as first playlist to download, a blocking request at the live edge if seeded by rendition reports
+        self.Url_LLHLS_Playlist = media_manifest.URI
+        seed = _live_edge_seeds.get(media_index)
+        if seed is not None:
+            self.Url_LLHLS_Playlist = add_or_update_query_params(media_manifest.URI, {'_HLS_msn': seed[0], '_HLS_part': seed[1]})
+        self.Path_To_Save_Files = None
+        #self.Path_To_Save_Files = "/Users/apih/Temp/1/" # must ends with /
+        self.Timer_Start = time.time()
+        self.Summary_Response_Manifests = [0,0,0,0]
+        self.Summary_Stat_Manifests = stats.RequestStats()
+        self.Summary_Manifest_Part_Duration = 0.0
+        self.Last_Playlist = None
+        self.Delta_Stats = m3u8.DeltaPlaylistStats()
+        self.Preload_Hint = None
+        self.Prefetched_IPart = -1
+
+    def path_to_save(self, url: str, suffix: str) -> str:
+        if not self.Path_To_Save_Files:
+            return None
+        parsed_url = urlparse(url)
+        filename = add_suffix_to_filename(os.path.basename(parsed_url.path), suffix)
+        return self.Path_To_Save_Files + filename
+
+
+
+# live state of rendition loops, read by periodic summaries
+_rendition_states: Dict[int, RenditionLoopState] = {}
+
+def prepare_playlist_request(state: RenditionLoopState) -> tuple[str, int, int, bool, float]:
+    # Load manifest:
+    # – for the first time without LL query stribng
+    # – for later with LL query string attributes
+    # Returns url, msn, part, force_new_line_on_screen, seconds to sleep before the request
+    state.Timer_Start = time.time()
+
+    parsed_url = urlparse(state.Url_LLHLS_Playlist)
+    query_params = parse_qs(parsed_url.query)
 
-    path_to_save_files: str = None
-    #path_to_save_files = "/Users/apih/Temp/1/" # must ends with /
+    s = "0"
+    p = "0"
+    force_new_line_on_screen = False
+    backoff_s = 0.0
+    qp = query_params.get("_HLS_msn") if query_params else None
+    if isinstance(qp, list):
+        s = qp[0]
+    qp = query_params.get("_HLS_part") if query_params else None
+    if isinstance(qp, list):
+        p = qp[0]
+    if state.Num_Of_Errors_In_A_Raw >= 3:
+        if qp is not None:
+            state.Url_LLHLS_Playlist = remove_query_params(state.Url_LLHLS_Playlist, ['_HLS_msn', '_HLS_part', '_HLS_skip'])
+            state.Last_Playlist = None
+            force_new_line_on_screen = True
+            if state.Num_Of_Errors_In_A_Raw > 5:
+                backoff_s = 1.0  # Sleep for 1 second
+
+    return state.Url_LLHLS_Playlist, int(s), int(p), force_new_line_on_screen, backoff_s
+
+def start_prefetch(state: RenditionLoopState, url: str) -> PrefetchRequest:
+    # the part of the preload hint if it's the part the blocking playlist request is for, None otherwise
+    prefetch, state.Preload_Hint = state.Preload_Hint, None
+    if prefetch is None or "_HLS_msn=" not in url:
+        return None
+    state.Prefetched_IPart = prefetch.IPart
+    return prefetch
+
+def register_playlist_result(state: RenditionLoopState, playlist0: m3u8.M3U8, ssummary: SummaryStatus) -> bool:
+    # Returns False if the manifest cannot be used to detect new parts
+    state.Summary_Response_Manifests[ssummary.value] += 1
+    state.Summary_Stat_Manifests.add(playlist0.FileDownloaded)
+    state.Summary_Manifest_Part_Duration = playlist0.EXT_X_PartInf_Part_Target
+
+    # check for 400, 500, etc errors of getting manifests
+    # validate that CAN-BLOCK is YES
+    if playlist0.FileDownloaded.HTTP_code != 200 or playlist0.Type != m3u8.TypeM3U8.VIDEO:
+        state.Num_Of_Errors_In_A_Raw += 1
+        return False
+    else:
+        state.Num_Of_Errors_In_A_Raw = 0
+        return True
+
+def apply_delta_playlist(state: RenditionLoopState, playlist0: m3u8.M3U8) -> m3u8.M3U8:
+    # Merges delta playlist into the previous playlist of the rendition, counts bytes and parse time saved.
+    # Returns playlist to detect new parts in
+    stats = state.Delta_Stats
+    body_size = len(playlist0.FileDownloaded.Response_body) if playlist0.FileDownloaded.Response_body is not None else 0
+
+    if playlist0.EXT_X_Skip_Skipped_Segments == 0:
+        # full playlist is the reference for the next delta playlists
+        stats.Full_Requests += 1
+        stats.Full_Bytes = body_size
+        stats.Full_Parse_Time = playlist0.Parse_Time
+        state.Last_Playlist = playlist0
+        return playlist0
+
+    stats.Delta_Requests += 1
+    timer_merge = time.perf_counter_ns()
+    merged = m3u8.merge_delta_playlist(state.Last_Playlist, playlist0)
+    merge_time_ms = (time.perf_counter_ns() - timer_merge) / 1000000
+    if merged is None:
+        # parts of delta playlist are still valid, but the next request must be for a full playlist
+        stats.Merge_Failures += 1
+        state.Last_Playlist = None
+        return playlist0
+
+    if stats.Full_Requests > 0:
+        stats.Bytes_Saved += max(stats.Full_Bytes - body_size, 0)
+        stats.Parse_Time_Saved += stats.Full_Parse_Time - playlist0.Parse_Time - merge_time_ms
+    state.Last_Playlist = merged
+    return merged
+
+def select_parts_to_download(state: RenditionLoopState, playlist0: m3u8.M3U8) -> tuple[List[tuple[int, int, m3u8.MediaPart]], float]:
+    # Detect parts to be downloaded and prepare the next blocking playlist request
+    # Returns list of (msn, part, MediaPart) and seconds to sleep if manifest has no parts
+    parts_to_download: List[tuple[int, int, m3u8.MediaPart]] = []
+
+    max_parts_in_segment = parts_in_segment(playlist0)
+    if len(playlist0.Media_Parts) > 0:
+        last_part = playlist0.Media_Parts[len(playlist0.Media_Parts) - 1]
+        state.Processed_Parts.resize(len(playlist0.Media_Parts))
+
+        i_part = int(last_part.Segment * (max_parts_in_segment)) + last_part.PartNum
+
+        # if no new part is inside the manifest
+        if state.Current_IPart > 0 and i_part <= state.Current_IPart:
+            # no new parts in new manifest, then it's a problem
+            # notify user on the screen
+            pass
+        else:
+            if i_part > state.Current_IPart + 3:
+                # if more than 3 parts are skipped then it's a problem
+                # need just to skip all of those part and to download just the latest one
+                state.Current_IPart = i_part - 1
+
+            # if 1-2 parts are skipped, then need to download them as well, because it can be CDN delivery issue
+            # ??? but to download in reverse sequence – the latestes must be downloaded first
+            for i_part_to_download in range(state.Current_IPart+1, i_part+1):
+
+                s = i_part_to_download // max_parts_in_segment
+                p = i_part_to_download % max_parts_in_segment
+
+                if i_part_to_download == state.Prefetched_IPart:
+                    # requested with the playlist
+                    state.Processed_Parts.add(i_part_to_download)
+                    continue
+                if state.Processed_Parts.add(i_part_to_download):
+                    part_to_download = playlist0.Media_Parts[len(playlist0.Media_Parts) - (i_part - i_part_to_download) - 1]
+                    parts_to_download.append((int(s), int(p), part_to_download))
+
+        state.Current_IPart = i_part
+        state.Current_Part = (last_part.Segment, last_part.PartNum)
+
+        next_part = 0
+        next_msn = 0
+        if last_part.Final:
+            next_msn = last_part.Segment + 1
+            next_part = 0
+        else:
+            next_msn = last_part.Segment
+            next_part = last_part.PartNum + 1
+
+        #need to validate that sum of parts is equal to part_target_duration
+
+        # media_3.m3u8?_HLS_msn=7&_HLS_part=3
+        # server will block the request till exact requested part msn+part is really prepared and be ready for downloading from server
+        state.Url_LLHLS_Playlist = add_or_update_query_params(playlist0.URI, {'_HLS_msn': next_msn, '_HLS_part': next_part})
+        if _prefetch and playlist0.EXT_X_Preload_Hint_URI and max_parts_in_segment > 0:
+            state.Preload_Hint = PrefetchRequest(next_msn, next_part, next_msn * max_parts_in_segment + next_part, playlist0.EXT_X_Preload_Hint_URI,
+                                                 playlist0, (last_part.Segment, last_part.PartNum))
+
+        # delta playlist only if there is a playlist to merge it into
+        skip = m3u8.delta_playlist_skip(playlist0) if _delta_playlists and state.Last_Playlist is not None else None
+        if skip is not None:
+            state.Url_LLHLS_Playlist = add_or_update_query_params(state.Url_LLHLS_Playlist, {'_HLS_skip': str(skip)})
+        elif '_HLS_skip' in state.Url_LLHLS_Playlist:
+            state.Url_LLHLS_Playlist = remove_query_params(state.Url_LLHLS_Playlist, ['_HLS_skip'])
+        return parts_to_download, 0.0
+
+    # no parts at all in new manifest, then it's a problem
+    # Sleep for at least 1 second or EXT_X_Target_Duration
+    if playlist0.EXT_X_Target_Duration > 0:
+        exec_time_s = time.time() - state.Timer_Start
+        return parts_to_download, max(float(playlist0.EXT_X_Target_Duration) - exec_time_s, 0.0)
+    return parts_to_download, 1.0
+
+
+def run_tasks_for_media_manifest_1(media_manifest: m3u8.MediaStream, media_index: int, limit_downloads: int, part_executor: concurrent.futures.Executor = None) -> bool:
+    # part_executor = executor shared by all streams (global worker budget), otherwise parts have an executor per rendition
+    global _global_escape_pressed
 
-    timer_start_ms: float = time.time()
+    state = RenditionLoopState(media_manifest, media_index)
+    _rendition_states[media_index] = state
+    task_id = 0
+    part_futures = set()
 
     try:
         #ThreadPoolExecutorStackTraced
         #with concurrent.futures.ThreadPoolExecutor(thread_name_prefix=f"Media{media_index}PartDownload") as media_executor:        
-        with ThreadPoolExecutorStackTraced(thread_name_prefix=f"Media{media_index}PartDownload") as media_executor:
+        with (ThreadPoolExecutorStackTraced(thread_name_prefix=f"Media{media_index}PartDownload") if part_executor is None else contextlib.nullcontext(part_executor)) as media_executor:
             while task_id <= limit_downloads and (not _global_escape_pressed): # True: #10
                 # if Esq key is pressed, then finilase the thread
                 keypressed = display.display_getch(False)
@@ -406,173 +1134,201 @@ def run_tasks_for_media_manifest_1(media_manifest: m3u8.M3U8, media_index: int,
                     break   
                 
                 task_id += 1
-                timer_start_ms = time.time()
-                
-                filepath: str = None
 
-                # Load manifest:
-                # – for the first time without LL query stribng
-                # – for later with LL query string attributes
-                parsed_url = urlparse(url_llhls_playlist)                        
-                query_params = parse_qs(parsed_url.query)
-                
-                s = "0"
-                p = "0"
-                force_new_line_on_screen = False
-                qp = query_params.get("_HLS_msn") if query_params else None
-                if isinstance(qp, list):
-                    s = qp[0]
-                qp = query_params.get("_HLS_part") if query_params else None
-                if isinstance(qp, list):
-                    p = qp[0]
-                if num_of_errors_in_a_raw >= 3:
-                    if qp is not None:
-                        url_llhls_playlist = remove_query_params(url_llhls_playlist, ['_HLS_msn', '_HLS_part'])  
-                        force_new_line_on_screen = True
-                        if num_of_errors_in_a_raw > 5:
-                            time.sleep(1)  # Sleep for 1 second
-
-                if path_to_save_files:
-                    filename = add_suffix_to_filename(os.path.basename(parsed_url.path), f"-{s}_{p}")
-                    filepath = path_to_save_files + filename
-                
-                file_id = display_download_started(m3u8.TypeDownload.MANIFEST_MEDIA, url_llhls_playlist, int(s), int(p), media_index, media_manifest.URI, force_new_line_on_screen)
+                url_llhls_playlist, s, p, force_new_line_on_screen, backoff_s = prepare_playlist_request(state)
+                if backoff_s > 0:
+                    time.sleep(backoff_s)
+
+                prefetch = start_prefetch(state, url_llhls_playlist)
+                if prefetch is not None:
+                    filepath = state.path_to_save(prefetch.URI, f"_{prefetch.Segment}_{prefetch.Part}")
+                    file_id = display_download_started(m3u8.TypeDownload.FILE_PART, prefetch.URI, prefetch.Segment, prefetch.Part, media_index, "preload hint")
+                    future = media_executor.submit(run_task_for_prefetching_part_1, prefetch, media_manifest, filepath, media_index, file_id)
+                    part_futures.add(future)
+                    future.add_done_callback(part_futures.discard)
+
+                filepath = state.path_to_save(url_llhls_playlist, f"-{s}_{p}")
+                file_id = display_download_started(m3u8.TypeDownload.MANIFEST_MEDIA, url_llhls_playlist, s, p, media_index, media_manifest.URI, force_new_line_on_screen)
+                sent_at = time.time()
                 playlist0 = m3u8.load_and_parse_manifest(url_llhls_playlist, filepath)
-                #display.display_downloadstatus(m3u8.TypeDownload.MANIFEST_MEDIA, int(s), int(p), manifest=playlist0)
-                ssummary = display_status_of_download(m3u8.TypeDownload.MANIFEST_MEDIA, int(s), int(p), None, media_manifest, playlist0, media_index, file_id)
-                summary_response_manifests[ssummary.value] += 1
-                summary_stat_manifests.append((playlist0.FileDownloaded.Response_time, playlist0.FileDownloaded.Download_time, playlist0.FileDownloaded.Download_speed))
-                summary_manifest_part_duration = playlist0.EXT_X_PartInf_Part_Target
+                estimate_hold(playlist0, url_llhls_playlist, s, p, media_index)
+                if prefetch is not None:
+                    prefetch_playlist_finished(prefetch, playlist0, sent_at, media_index)
+                ssummary = display_status_of_download(m3u8.TypeDownload.MANIFEST_MEDIA, s, p, None, media_manifest, playlist0, media_index, file_id)
+                playlist_is_valid = register_playlist_result(state, playlist0, ssummary)
 
                 # Load "init_mp4" file if need
-                if path_to_save_files:
-                    parsed_url = urlparse(playlist0.EXT_X_Map_URI)                        
-                    filename = add_suffix_to_filename(os.path.basename(parsed_url.path), f"_init")
-                    filepath = path_to_save_files + filename
-                    if not os.path.exists(filepath):
-                        display.display_downloadstarted(m3u8.TypeDownload.FILE_INIT, 0, 0, playlist0.EXT_X_Map_URI, media_index)
-                        m3u8.download_file_http1(playlist0.EXT_X_Map_URI, filepath)   #-> wait for response in parallel, and print result on screen
-
-                # check for 400, 500, etc errors of getting manifests
-                # validate that CAN-BLOCK is YES
-
-                if playlist0.FileDownloaded.HTTP_code != 200 or playlist0.Type != m3u8.TypeM3U8.VIDEO:
-                    num_of_errors_in_a_raw += 1
+                filepath = state.path_to_save(playlist0.EXT_X_Map_URI, "_init")
+                if filepath and not os.path.exists(filepath):
+                    file_id = display_download_started(m3u8.TypeDownload.FILE_INIT, playlist0.EXT_X_Map_URI, 0, 0, media_index, playlist0.URI)
+                    metrics = m3u8.download_file(playlist0.EXT_X_Map_URI, filepath)   #-> wait for response in parallel, and print result on screen
+                    display_status_of_download(m3u8.TypeDownload.FILE_INIT, 0, 0, metrics, media_manifest, playlist0, media_index, file_id)
+
+                if not playlist_is_valid:
                     continue
-                else:
-                    num_of_errors_in_a_raw = 0
-
-                # Detect part to be downloaded and download it
-                max_parts_in_segment = 0
-                if playlist0.EXT_X_PartInf_Part_Target > 0:
-                    max_parts_in_segment = int(playlist0.EXT_X_Target_Duration // round(playlist0.EXT_X_PartInf_Part_Target, 1))
-                if len(playlist0.Media_Parts) > 0:
-                    last_part = playlist0.Media_Parts[len(playlist0.Media_Parts) - 1]
-
-                    #playlist0.EXT_X_Target_Duration
-                    #playlist0.EXT_X_PartInf_Part_Target
-
-                    i_part = int(last_part.Segment * (max_parts_in_segment)) + last_part.PartNum
-                    
-                    # if no new part is inside the manifest
-                    if current_ipart > 0 and i_part <= current_ipart:
-                        # no new parts in new manifest, then it's a problem
-                        # notify user on the screen        
-                        
-                        #!display.display_error(f"Manifest {playlist0.URI} does not contain new parts compared to the previous one! Last knows part was: {current_part[0]}/{current_part[1]} ")
-                        pass
-                    else:
-                        if i_part > current_ipart + 3:
-                            # if more than 3 parts are skipped then it's a problem
-                            # need just to skip all of those part and to download just the latest one 
-
-                            #Count how many lines are skipped
-                            # write ... instead of part number
-                            # and continue from the latest part
-                            current_ipart = i_part - 1
-
-                        # if 1-2 parts are skipped, then need to download them as well, because it can be CDN delivery issue
-                        # ??? but to download in reverse sequence – the latestes must be downloaded first
-                        for i_part_to_download in range(current_ipart+1, i_part+1):
-
-                            s = i_part_to_download // max_parts_in_segment
-                            p = i_part_to_download % max_parts_in_segment
-
-                            if i_part_to_download not in processed_parts:
-                                part_to_download = playlist0.Media_Parts[len(playlist0.Media_Parts) - (i_part - i_part_to_download) - 1]
-                                processed_parts.append(i_part_to_download)
-
-                                filepath = None
-                                if path_to_save_files:
-                                    parsed_url = urlparse(part_to_download.URI)                        
-                                    filename = add_suffix_to_filename(os.path.basename(parsed_url.path), f"_{s}_{p}")
-                                    filepath = path_to_save_files + filename
-                                
-                                
-                                file_id = display_download_started(m3u8.TypeDownload.FILE_PART, part_to_download.URI, int(s), int(p), media_index, playlist0.URI)
-                                future = media_executor.submit(run_task_for_downloading_part_1, s, p, part_to_download.URI, media_manifest, playlist0, filepath, media_index, file_id)
-                                #future.add_done_callback(long_task_callback_1)
-                                #m3u8.download_file(part_to_download.URI, filepath)   #-> wait for response in parallel, and print result on screen
-                        
-                    current_ipart = i_part
-                    current_part = (last_part.Segment, last_part.PartNum)
-
-                    next_part = 0
-                    next_msn = 0
-                    if last_part.Final:
-                        next_msn = last_part.Segment + 1 
-                        next_part = 0
-                    else:
-                        next_msn = last_part.Segment
-                        next_part = last_part.PartNum + 1
-
-                    #need to validate that sum of parts is equal to part_target_duration
-
-                    # media_3.m3u8?_HLS_msn=7&_HLS_part=3
-                    url_llhls_playlist = add_or_update_query_params(playlist0.URI, {'_HLS_msn': next_msn, '_HLS_part': next_part})  
-
-                    if next_part >= max_parts_in_segment: #== 6:
-                        #!display.display_error(f"Illegal request for part #{next_part} was generated outside the allowed range 0-{max_parts_in_segment-1}, URL = {url_llhls_playlist}")
-                        pass
-
-                    # server will block the request till exact requested part msn+part is really prepared and be ready for downloading from server
-                    #set a task to download next manifest
-                    #m3u8.load_manifest(url_llhls_playlist) # -> this will have huge waiting response time, but after it must be downloaded fastly
 
-                else:
-                    # no parts at all in new manifest, then it's a problem
-                    
-                    # notify user on the screen        
-                    #display.display_error(f"Manifest {playlist0.URI} does not contain parts at all! Last knows part was: {current_part[0]}/{current_part[1]} ")                        
-                    #pass
-
-                    # Sleep for at least 1 second or EXT_X_Target_Duration
-                    if playlist0.EXT_X_Target_Duration > 0:
-                        exec_time_s = time.time() - timer_start_ms
-                        time_to_sleep = float(playlist0.EXT_X_Target_Duration) - exec_time_s
-                        if time_to_sleep > 0:
-                            time.sleep(time_to_sleep)
-                    else:
-                        time.sleep(1) 
+                if _rendition_reports:
+                    record_rendition_skew(playlist0, media_index)
+
+                if _delta_playlists:
+                    playlist0 = apply_delta_playlist(state, playlist0)
+
+                parts_to_download, time_to_sleep = select_parts_to_download(state, playlist0)
+                for s, p, part_to_download in parts_to_download:
+                    filepath = state.path_to_save(part_to_download.URI, f"_{s}_{p}")
+                    file_id = display_download_started(m3u8.TypeDownload.FILE_PART, part_to_download.URI, s, p, media_index, playlist0.URI)
+                    future = media_executor.submit(run_task_for_downloading_part_1, s, p, part_to_download.URI, media_manifest, playlist0, filepath, media_index, file_id, part_to_download.Byterange)
+                    #future.add_done_callback(long_task_callback_1)
+                    part_futures.add(future)
+                    future.add_done_callback(part_futures.discard)
+
+                if time_to_sleep > 0:
+                    time.sleep(time_to_sleep)
+
+            # wait for parts in flight, the shared executor is not shut down with the rendition
+            concurrent.futures.wait(list(part_futures))
                             
-        _safe_add_summarymanifests_to_list(media_index, summary_response_manifests, summary_stat_manifests, summary_manifest_part_duration)
+        _safe_add_summarymanifests_to_list(media_index, state.Summary_Response_Manifests, state.Summary_Stat_Manifests, state.Summary_Manifest_Part_Duration, state.Delta_Stats, state.Processed_Parts)
         
         # write "STREAM #N IS DONE"
         #display_finish_of_download(media_index, task_id)
     except Exception as e:
         # Handle exceptions and print the error message
-        print(f"An error occurred: {e}")
+        logs.print_error(f"An error occurred: {e}")
         logs.write_exception(e)
+    finally:
+        _in_flight.close_rendition(media_index)
+
+
+async def run_task_for_downloading_part_async(segmentnum: int, partnum: int, url_to_download: str, media_manifest: m3u8.MediaStream, manifest: m3u8.M3U8, path_to_save: str = None, media_index: int = None, file_id: int = None, byterange: tuple[int, int] = None) -> bool:
+    try:
+        if _part_slots is None:
+            metrics = await m3u8.download_file_async(url_to_download, path_to_save, byterange)
+        else:
+            async with _part_slots:
+                metrics = await m3u8.download_file_async(url_to_download, path_to_save, byterange)
+        ssummary = display_status_of_download(m3u8.TypeDownload.FILE_PART, segmentnum, partnum, metrics, media_manifest, manifest, media_index, file_id)
+        _safe_add_summaryparts_to_list(media_index, ssummary, metrics)
+    except Exception as e:
+        # Handle exceptions and print the error message
+        logs.print_error(f"An error occurred: {e}")
+        logs.write_exception(e)
+        _in_flight.abandon(media_index, file_id)
+
+async def run_task_for_prefetching_part_async(prefetch: PrefetchRequest, media_manifest: m3u8.MediaStream, path_to_save: str = None, media_index: int = None, file_id: int = None) -> bool:
+    try:
+        if _part_slots is None:
+            sent_at = time.time()
+            metrics = await m3u8.download_file_async(prefetch.URI, path_to_save, prefetch.Byterange)
+        else:
+            async with _part_slots:
+                sent_at = time.time()
+                metrics = await m3u8.download_file_async(prefetch.URI, path_to_save, prefetch.Byterange)
+        prefetch_part_finished(prefetch, metrics, sent_at, media_index)
+        ssummary = display_status_of_download(m3u8.TypeDownload.FILE_PART, prefetch.Segment, prefetch.Part, metrics, media_manifest, prefetch.Playlist, media_index, file_id)
+        _safe_add_summaryparts_to_list(media_index, ssummary, metrics)
+    except Exception as e:
+        # Handle exceptions and print the error message
+        logs.print_error(f"An error occurred: {e}")
+        logs.write_exception(e)
+        _in_flight.abandon(media_index, file_id)
+
+async def run_tasks_for_media_manifest_async(media_manifest: m3u8.MediaStream, media_index: int, limit_downloads: int) -> bool:
+    # Same loop as run_tasks_for_media_manifest_1, but playlists and parts are coroutines of one event loop
+    global _global_escape_pressed
+
+    state = RenditionLoopState(media_manifest, media_index)
+    _rendition_states[media_index] = state
+    task_id = 0
+    part_tasks = set()
+
+    try:
+        while task_id <= limit_downloads and (not _global_escape_pressed):
+            # if Esq key is pressed, then finilase the loop
+            keypressed = display.display_getch(False)
+            if keypressed == 27:
+                _global_escape_pressed = True
+                break
+
+            task_id += 1
+
+            url_llhls_playlist, s, p, force_new_line_on_screen, backoff_s = prepare_playlist_request(state)
+            if backoff_s > 0:
+                await asyncio.sleep(backoff_s)
+
+            prefetch = start_prefetch(state, url_llhls_playlist)
+            if prefetch is not None:
+                filepath = state.path_to_save(prefetch.URI, f"_{prefetch.Segment}_{prefetch.Part}")
+                file_id = display_download_started(m3u8.TypeDownload.FILE_PART, prefetch.URI, prefetch.Segment, prefetch.Part, media_index, "preload hint")
+                task = asyncio.create_task(run_task_for_prefetching_part_async(prefetch, media_manifest, filepath, media_index, file_id))
+                part_tasks.add(task)
+                task.add_done_callback(part_tasks.discard)
+
+            filepath = state.path_to_save(url_llhls_playlist, f"-{s}_{p}")
+            file_id = display_download_started(m3u8.TypeDownload.MANIFEST_MEDIA, url_llhls_playlist, s, p, media_index, media_manifest.URI, force_new_line_on_screen)
+            sent_at = time.time()
+            playlist0 = await m3u8.load_and_parse_manifest_async(url_llhls_playlist, filepath)
+            estimate_hold(playlist0, url_llhls_playlist, s, p, media_index)
+            if prefetch is not None:
+                prefetch_playlist_finished(prefetch, playlist0, sent_at, media_index)
+            ssummary = display_status_of_download(m3u8.TypeDownload.MANIFEST_MEDIA, s, p, None, media_manifest, playlist0, media_index, file_id)
+            playlist_is_valid = register_playlist_result(state, playlist0, ssummary)
+
+            # Load "init_mp4" file if need
+            filepath = state.path_to_save(playlist0.EXT_X_Map_URI, "_init")
+            if filepath and not os.path.exists(filepath):
+                file_id = display_download_started(m3u8.TypeDownload.FILE_INIT, playlist0.EXT_X_Map_URI, 0, 0, media_index, playlist0.URI)
+                metrics = await m3u8.download_file_async(playlist0.EXT_X_Map_URI, filepath)
+                display_status_of_download(m3u8.TypeDownload.FILE_INIT, 0, 0, metrics, media_manifest, playlist0, media_index, file_id)
+
+            if not playlist_is_valid:
+                continue
+
+            if _rendition_reports:
+                record_rendition_skew(playlist0, media_index)
+
+            if _delta_playlists:
+                playlist0 = apply_delta_playlist(state, playlist0)
+
+            parts_to_download, time_to_sleep = select_parts_to_download(state, playlist0)
+            for s, p, part_to_download in parts_to_download:
+                filepath = state.path_to_save(part_to_download.URI, f"_{s}_{p}")
+                file_id = display_download_started(m3u8.TypeDownload.FILE_PART, part_to_download.URI, s, p, media_index, playlist0.URI)
+                task = asyncio.create_task(run_task_for_downloading_part_async(s, p, part_to_download.URI, media_manifest, playlist0, filepath, media_index, file_id, part_to_download.Byterange))
+                # keep a strong reference till the task is done
+                part_tasks.add(task)
+                task.add_done_callback(part_tasks.discard)
+
+            if time_to_sleep > 0:
+                await asyncio.sleep(time_to_sleep)
+
+        # wait for parts in flight, as the thread executor does on exit
+        if part_tasks:
+            await asyncio.gather(*part_tasks)
+
+        _safe_add_summarymanifests_to_list(media_index, state.Summary_Response_Manifests, state.Summary_Stat_Manifests, state.Summary_Manifest_Part_Duration, state.Delta_Stats, state.Processed_Parts)
+    except Exception as e:
+        # Handle exceptions and print the error message
+        logs.print_error(f"An error occurred: {e}")
+        logs.write_exception(e)
+    finally:
+        _in_flight.close_rendition(media_index)
+
+async def coordinator_async(renditions: List[streams.MonitoredRendition], workers: int = None):
+    # one event loop drives all renditions, one httpx.AsyncClient is shared by all of them
+    global _part_slots
+
+    _part_slots = asyncio.Semaphore(workers) if workers else None
+    try:
+        await asyncio.gather(*[run_tasks_for_media_manifest_async(r.Media, r.Media_index, r.Stream.Limit) for r in renditions])
+    finally:
+        _part_slots = None
+        await m3u8.close_client_async()
 
 def print_result_from_media_1():
     pass
 
-def coordinator(master_playlist: m3u8.M3U8, limit_downloads: int = 10):
-    global _summary_response_parts
-    global _summary_stat_parts
-    global _summary_response_manifests
-    global _summary_stat_manifests
-
+def coordinator(master_playlist: m3u8.M3U8, limit_downloads: int = 10, engine: MonitoringEngine = MonitoringEngine.THREAD, processes: int = 1):
     # must call functions async 
     # wait for result and print information on a screen
 
@@ -580,44 +1336,85 @@ def coordinator(master_playlist: m3u8.M3U8, limit_downloads: int = 10):
     if len(master_playlist.Media_Streams) == 0:
         return
 
-    #media_list = []
-    #media_list.append(master_playlist.Media_Streams[0])
-
     # set task to download manifest
     # wait for response
     # set task to download part 
     # set task to download maanifest for part+1
 
-    #for each media stream run async task
-    futures_media_list = []
-
     # media_limit:
     # -1 or 0 = all medias
     # 1..N = specified number of streams for debug
     media_limit = 0 # = 2
 
-    #ThreadPoolExecutorStackTraced
-    #with concurrent.futures.ThreadPoolExecutor(thread_name_prefix=f"Media") as master_executor: #max_workers=2
-    with ThreadPoolExecutorStackTraced(thread_name_prefix=f"Media") as master_executor: #max_workers=2
-        media_index = 0
-        for media in master_playlist.Media_Streams:
-            # Submit long running task
-            future = master_executor.submit(run_tasks_for_media_manifest_1, media, media_index, limit_downloads)
-            futures_media_list.append(future)
-            #future.add_done_callback(long_task_callback_1)
-            media_index += 1
-            if media_limit > 0 and media_index >= media_limit:
-                break
-        #for audio in master_playlist.Media_Audios:
-        #    future = master_executor.submit(run_tasks_for_media_manifest_1, audio, media_index)
-        #    futures_media_list.append(future)
-        #    media_index += 1
-        #    if media_limit > 0 and media_index >= media_limit:
-        #        break
-        concurrent.futures.wait(futures_media_list)
+    stream = streams.StreamConfig(master_playlist.URI, limit=limit_downloads,
+                                  renditions=streams.RenditionFilter(list(range(media_limit)) if media_limit > 0 else None))
+    coordinator_renditions(streams.select_renditions([(stream, master_playlist)]), engine, processes=processes)
+
+def coordinator_renditions(renditions: List[streams.MonitoredRendition], engine: MonitoringEngine = MonitoringEngine.THREAD, workers: int = None, processes: int = 1):
+    # renditions of one or many streams, workers = part downloads in parallel for all of them (None = per rendition),
+    # processes > 1 = streams are sharded across worker processes, this one only draws and merges results
+    _renditions.clear()
+    _renditions.update({r.Media_index: r for r in renditions})
+
+    # renditions of a stream stay in one worker (see sharding.shard_renditions), so a single stream runs in this process
+    processes = min(processes, len({r.Stream for r in renditions}))
+    if processes > 1:
+        import sharding
+        # events are stored by the workers, the summary of this process is merged from their quantile sketches
+        ram_budget_mb, events_dir = _event_store_settings
+        close_event_store()
+        set_event_store(0)
+        sharding.run_sharded(renditions, engine, workers, processes, {
+            "protocol": m3u8.get_protocol(),
+            "delta": _delta_playlists,
+            "prefetch": _prefetch,
+            "rendition_reports": _rendition_reports,
+            "events_ram_mb": max(ram_budget_mb // processes, 1) if ram_budget_mb > 0 else 0,
+            "events_dir": events_dir,
+            "headless": _headless is not None,
+            "log_format": logs.get_log_format(),
+            "metrics": _metrics is not None,
+        })
+        if _headless is None:
+            display.display_message("[Coordinator stopped by ESC] => PRESS ANY KEY" if _global_escape_pressed else "[Coordinator finished] => PRESS ANY KEY")
+        return
+
+    # keep-alive connections per origin for all renditions, so parts don't pay TCP and TLS setup again
+    parts_in_flight = len(renditions) * _parts_in_flight_per_rendition
+    m3u8.init_sessions_http1(len(renditions) + (min(parts_in_flight, workers) if workers else parts_in_flight))
+    if _rendition_reports:
+        seed_from_rendition_reports(renditions)
+
+    if engine == MonitoringEngine.ASYNC:
+        asyncio.run(coordinator_async(renditions, workers))
+    else:
+        #for each media stream run async task
+        futures_media_list = []
+
+        # a thread per rendition waits for blocking playlist requests, parts go to the shared executor if there is a budget
+        part_executor = ThreadPoolExecutorStackTraced(max_workers=workers, thread_name_prefix="PartDownload") if workers else None
+        try:
+            #ThreadPoolExecutorStackTraced
+            #with concurrent.futures.ThreadPoolExecutor(thread_name_prefix=f"Media") as master_executor: #max_workers=2
+            with ThreadPoolExecutorStackTraced(max_workers=len(renditions), thread_name_prefix=f"Media") as master_executor:
+                for r in renditions:
+                    # Submit long running task
+                    future = master_executor.submit(run_tasks_for_media_manifest_1, r.Media, r.Media_index, r.Stream.Limit, part_executor)
+                    futures_media_list.append(future)
+                    #future.add_done_callback(long_task_callback_1)
+                #for audio in master_playlist.Media_Audios:
+                #    future = master_executor.submit(run_tasks_for_media_manifest_1, audio, media_index)
+                #    futures_media_list.append(future)
+                #    media_index += 1
+                concurrent.futures.wait(futures_media_list)
+        finally:
+            if part_executor is not None:
+                part_executor.shutdown()
 
     #exit
-    if _global_escape_pressed:
+    if _headless is not None:
+        pass
+    elif _global_escape_pressed:
         display.display_message("[Coordinator stopped by ESC] => PRESS ANY KEY")
     else:
         display.display_message("[Coordinator finished] => PRESS ANY KEY")
@@ -631,5 +1428,205 @@ def display_summary(master_playlist: m3u8.M3U8):
     # - total of files downloaded of each type
     # – for each type of file show number of oks, warnings, errors
     # – p50, p75, p95, p99 of response time, download_time, download_speed 
-    display.display_summary_nocurses(master_playlist, _summary_response_manifests, _summary_stat_manifests, _summary_response_parts, _summary_stat_parts, _summary_manifest_part_duration)
+    summary_stat_manifests = _summary_stat_manifests
+    summary_stat_parts = _summary_stat_parts
+    if _event_store is not None:
+        # exact percentiles from all events instead of the sketches
+        summary_stat_manifests = {i: _event_store.request_stats(i, [m3u8.TypeDownload.MANIFEST_MEDIA]) for i in _summary_stat_manifests}
+        summary_stat_parts = {i: _event_store.request_stats(i, [m3u8.TypeDownload.FILE_PART]) for i in _summary_stat_parts}
+    groups = renditions_by_stream()
+    if len(groups) <= 1:
+        display.display_summary_nocurses(master_playlist, _summary_response_manifests, summary_stat_manifests, _summary_response_parts, summary_stat_parts, _summary_manifest_part_duration, _summary_suppressed_parts)
+    else:
+        # a summary per stream, renditions keep media indexes of the display and logs
+        for stream, renditions in groups:
+            stream_playlist = m3u8.M3U8(m3u8.TypeM3U8.MASTER)
+            stream_playlist.URI = stream.URL
+            stream_playlist.Media_Streams = [r.Media for r in renditions]
+            display.display_summary_nocurses(stream_playlist, _summary_response_manifests, summary_stat_manifests, _summary_response_parts, summary_stat_parts, _summary_manifest_part_duration, _summary_suppressed_parts,
+                                             [r.Media_index for r in renditions], stream.Name)
+    if m3u8.get_protocol() == m3u8.HttpProtocol.H2:
+        display.display_h2_summary_nocurses(m3u8.get_h2_edge_stats() + _remote_h2_edge_stats)
+    if _delta_playlists:
+        display.display_delta_summary_nocurses(master_playlist, _summary_delta_playlists)
+    if _prefetch:
+        display.display_prefetch_summary_nocurses(master_playlist, _summary_prefetch)
+    if _rendition_reports:
+        display.display_skew_summary_nocurses(master_playlist, _summary_skew)
+    display.display_in_flight_summary_nocurses(master_playlist, _in_flight.Shards)
+
+def renditions_by_stream() -> List[tuple[streams.StreamConfig, List[streams.MonitoredRendition]]]:
+    # in order of the config
+    groups: Dict[streams.StreamConfig, List[streams.MonitoredRendition]] = {}
+    for media_index in sorted(_renditions):
+        rendition = _renditions[media_index]
+        groups.setdefault(rendition.Stream, []).append(rendition)
+    return list(groups.items())
+
+def _stat_summary(responses: List[int], stat: stats.RequestStats) -> Dict:
+    summary = {status.name.lower(): responses[status.value] if responses else 0 for status in SummaryStatus}
+    if stat is not None:
+        for name, sketch in [("response_ms", stat.Response_time), ("download_ms", stat.Download_time), ("hold_ms", stat.Hold_time), ("excess_ms", stat.Excess_time), ("live_ms", stat.Live_latency)]:
+            if sketch.Count == 0 and name in ("hold_ms", "excess_ms", "live_ms"):
+                continue
+            min_value, avg_value, max_value, p50, p75, p95, p99 = sketch.stat_values()
+            summary[name] = {"min": round(min_value, 1), "avg": round(avg_value, 1), "max": round(max_value, 1),
+                             "p50": round(p50, 1), "p75": round(p75, 1), "p95": round(p95, 1), "p99": round(p99, 1)}
+    return summary
+
+def _delta_summary(delta_stats: m3u8.DeltaPlaylistStats) -> Dict:
+    delta_stats = delta_stats or m3u8.DeltaPlaylistStats()
+    return {"full": delta_stats.Full_Requests, "delta": delta_stats.Delta_Requests, "merge_failures": delta_stats.Merge_Failures,
+            "bytes_saved": delta_stats.Bytes_Saved, "parse_ms_saved": round(delta_stats.Parse_Time_Saved, 1)}
+
+def _prefetch_summary(prefetch_stats: PrefetchStats) -> Dict:
+    prefetch_stats = prefetch_stats or PrefetchStats()
+    summary = {"requests": prefetch_stats.Requests, "failed": prefetch_stats.Failed,
+               "part_first": prefetch_stats.Part_First, "playlist_first": prefetch_stats.Playlist_First}
+    for name, sketch in [("part_lead_ms", prefetch_stats.Part_Lead), ("playlist_lead_ms", prefetch_stats.Playlist_Lead)]:
+        if sketch.Count > 0:
+            p50, p95, p99 = sketch.quantiles([0.50, 0.95, 0.99])
+            summary[name] = {"p50": round(p50, 1), "p95": round(p95, 1), "p99": round(p99, 1), "max": round(sketch.Max, 1)}
+    return summary
+
+def _skew_summary(skew: RenditionSkew) -> Dict:
+    skew = skew or RenditionSkew()
+    summary = {"samples": skew.Samples, "behind": skew.Behind, "last_parts": skew.Last_Parts}
+    if skew.Samples > 0:
+        parts_p50, parts_p95 = skew.Parts.quantiles([0.50, 0.95])
+        lag_p50, lag_p95 = skew.Lag_time.quantiles([0.50, 0.95])
+        summary["parts"] = {"p50": round(parts_p50, 1), "p95": round(parts_p95, 1), "max": round(skew.Parts.Max, 1)}
+        summary["lag_ms"] = {"p50": round(lag_p50, 1), "p95": round(lag_p95, 1), "max": round(skew.Lag_time.Max, 1)}
+    return summary
+
+def headless_summary() -> List[Dict]:
+    # current counters and percentiles (quantile sketches) of every rendition, in order of streams
+    renditions = []
+    for media_index, state in sorted(_rendition_states.items()):
+        rendition = _renditions.get(media_index)
+        with _global_summaryparts_lock:
+            parts = _stat_summary(_summary_response_parts.get(media_index), _summary_stat_parts.get(media_index))
+            prefetch = _prefetch_summary(_summary_prefetch.get(media_index)) if _prefetch else None
+            skew = _skew_summary(_summary_skew.get(media_index)) if _rendition_reports else None
+        delta = _delta_summary(state.Delta_Stats) if _delta_playlists else None
+        shard = _in_flight.shard(media_index)
+        row = {
+            "media_index": media_index,
+            "stream": rendition.Stream.Name if rendition is not None else None,
+            "uri": state.Media_Manifest.URI,
+            "playlists": _stat_summary(state.Summary_Response_Manifests, state.Summary_Stat_Manifests),
+            "parts": parts,
+            "in_flight": len(shard.Entries),
+            "timed_out": shard.Timed_Out,
+            "orphaned": shard.Orphaned,
+        }
+        if delta is not None:
+            row["delta"] = delta
+        if prefetch is not None:
+            row["prefetch"] = prefetch
+        if skew is not None:
+            row["skew"] = skew
+        renditions.append(row)
+    for rows in list(_remote_summary_rows.values()):
+        renditions.extend(rows)
+    renditions.sort(key=lambda row: row["media_index"])
+    return renditions
+
+def bundle_renditions() -> List[Dict]:
+    # counts and quantile sketches of every rendition by type of file for the result bundle (see bundle.py)
+    renditions = []
+    with _global_summaryparts_lock:
+        for media_index, rendition in sorted(_renditions.items()):
+            types = {}
+            for type, responses, stat in [(m3u8.TypeDownload.MANIFEST_MEDIA, _summary_response_manifests, _summary_stat_manifests),
+                                          (m3u8.TypeDownload.FILE_PART, _summary_response_parts, _summary_stat_parts)]:
+                counts = responses.get(media_index)
+                if counts is None:
+                    continue
+                types[type.name] = {
+                    "counts": {status.name.lower(): counts[status.value] for status in SummaryStatus},
+                    "stats": (stat.get(media_index) or stats.RequestStats()).to_dict(),
+                }
+            row = {
+                "stream": rendition.Stream.Name,
+                "url": rendition.Stream.URL,
+                "uri": rendition.Media.URI,
+                "resolution": rendition.Media.Resolution,
+                "bandwidth": rendition.Media.Bandwidth,
+                "part_duration": _summary_manifest_part_duration.get(media_index, 0.0),
+                "types": types,
+            }
+            if _delta_playlists:
+                row["delta"] = _delta_summary(_summary_delta_playlists.get(media_index))
+            renditions.append(row)
+    return renditions
+
+def rendition_summary(media_index: int) -> Dict:
+    # everything the final summary has of the rendition, sent by a worker process to the parent
+    shard = _in_flight.shard(media_index)
+    with _global_summaryparts_lock:
+        return {
+            "response_manifests": _summary_response_manifests.get(media_index),
+            "stat_manifests": _summary_stat_manifests.get(media_index),
+            "response_parts": _summary_response_parts.get(media_index),
+            "stat_parts": _summary_stat_parts.get(media_index),
+            "part_duration": _summary_manifest_part_duration.get(media_index),
+            "delta_playlists": _summary_delta_playlists.get(media_index),
+            "suppressed_parts": _summary_suppressed_parts.get(media_index),
+            "prefetch": _summary_prefetch.get(media_index),
+            "skew": _summary_skew.get(media_index),
+            "in_flight": (shard.Max_Depth, shard.Timed_Out, shard.Orphaned, shard.Finished_After_Timeout),
+        }
+
+def _merge_responses(summary: Dict[int, List[int]], media_index: int, responses: List[int]):
+    if responses is None:
+        return
+    merged = summary.setdefault(media_index, [0] * len(responses))
+    for i, count in enumerate(responses):
+        merged[i] += count
 
+def _merge_stats(summary: Dict[int, stats.RequestStats], media_index: int, stat: stats.RequestStats):
+    if stat is None:
+        return
+    summary.setdefault(media_index, stats.RequestStats()).merge(stat)
+
+def merge_rendition_summary(media_index: int, summary: Dict):
+    # summary of a worker process (see rendition_summary) is added to the summary of this process
+    with _global_summaryparts_lock:
+        _merge_responses(_summary_response_manifests, media_index, summary["response_manifests"])
+        _merge_stats(_summary_stat_manifests, media_index, summary["stat_manifests"])
+        _merge_responses(_summary_response_parts, media_index, summary["response_parts"])
+        _merge_stats(_summary_stat_parts, media_index, summary["stat_parts"])
+        if summary["part_duration"] is not None:
+            _summary_manifest_part_duration[media_index] = summary["part_duration"]
+        if summary["delta_playlists"] is not None:
+            _summary_delta_playlists[media_index] = summary["delta_playlists"]
+        if summary["suppressed_parts"] is not None:
+            duplicates, late = _summary_suppressed_parts.get(media_index, (0, 0))
+            _summary_suppressed_parts[media_index] = (duplicates + summary["suppressed_parts"][0], late + summary["suppressed_parts"][1])
+        if summary["prefetch"] is not None:
+            _summary_prefetch.setdefault(media_index, PrefetchStats()).merge(summary["prefetch"])
+        if summary["skew"] is not None:
+            _summary_skew.setdefault(media_index, RenditionSkew()).merge(summary["skew"])
+    shard = _in_flight.shard(media_index)
+    with shard.Lock:
+        max_depth, timed_out, orphaned, finished_after_timeout = summary["in_flight"]
+        shard.Max_Depth = max(shard.Max_Depth, max_depth)
+        shard.Timed_Out += timed_out
+        shard.Orphaned += orphaned
+        shard.Finished_After_Timeout += finished_after_timeout
+
+def merge_h2_edge_stats(edge_stats: List[m3u8.H2EdgeStats]):
+    _remote_h2_edge_stats.extend(edge_stats)
+
+def remote_summary_rows(worker: int, rows: List[Dict]):
+    # the latest summary rows of the renditions of a worker process
+    _remote_summary_rows[worker] = rows
+
+def remote_metrics(worker: int, snapshot: Dict):
+    if _metrics is not None:
+        _metrics.set_remote(worker, snapshot)
+
+def remote_request_line(line: str):
+    if _headless is not None:
+        _headless.write_line(line)
@@ -0,0 +1,190 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from typing import Dict, List
+
+import display
+import exporter
+import headless
+import logs
+import m3u8
+import monitoring
+import streams
+
+# Streams are sharded across worker processes, so parsing, classification and logging of many renditions
+# use all CPU cores instead of one GIL. Renditions of a stream stay in one worker (see shard_renditions()),
+# so there are at most as many workers as streams. Every worker runs the usual coordinator for its renditions (media indexes
+# are kept) and streams compact results to the parent in batches:
+#   ("display", event)          event of display.py (start, status, in flight), drawn by the parent
+#   ("ndjson", line)            request line of headless mode, written by the parent
+#   ("rows", worker, rows)      current summary of the renditions of the worker (monitoring.headless_summary)
+#   ("metrics", worker, series) cumulative metrics of the worker (exporter.MetricsRegistry.snapshot), served by the parent
+#   ("final", worker, rows, summaries, h2_edge_stats)   merged into the summary of the parent at the end
+#   ("done", worker)
+# The parent draws the display, reads keys (ESC stops all workers) and prints the merged summary.
+# Workers write their own log files (..._worker<N>.log) and event stores (<events dir>/worker<N>).
+
+BATCH_INTERVAL_S = 0.05     #results are sent this often, one message of the queue per batch
+ROWS_INTERVAL_S = 1.0       #current summary (headless mode) and metrics of the worker are sent this often
+
+class ResultForwarder:
+    # Worker side: batches messages for the parent, the only thread which writes to the results queue.
+    # It's the stream of the headless reporter of the worker as well (write() gets NDJSON lines).
+    Worker: int
+    Send_rows: bool     #periodic summaries of the parent need rows of the worker
+
+    def __init__(self, worker: int, results: multiprocessing.Queue, send_rows: bool = False):
+        self.Worker = worker
+        self.Send_rows = send_rows
+        self._results = results
+        self._lock = threading.Lock()
+        self._batch: List[tuple] = []
+        self._stop = threading.Event()
+        self._thread: threading.Thread = None
+
+    def write(self, text: str):
+        line = text.rstrip("\n")
+        if line:
+            with self._lock:
+                self._batch.append(("ndjson", line))
+
+    def flush(self):
+        pass
+
+    def _send(self, periodic: bool = False):
+        messages = [("display", event) for event in display.display_take_events()]
+        with self._lock:
+            messages = self._batch + messages
+            self._batch = []
+        if periodic and self.Send_rows:
+            messages.append(("rows", self.Worker, monitoring.headless_summary()))
+        if periodic and monitoring._metrics is not None:
+            messages.append(("metrics", self.Worker, monitoring._metrics.snapshot()))
+        if messages:
+            self._results.put(messages)
+
+    def _run(self):
+        next_rows = time.monotonic() + ROWS_INTERVAL_S
+        while not self._stop.wait(BATCH_INTERVAL_S):
+            now = time.monotonic()
+            self._send(periodic=now >= next_rows)
+            if now >= next_rows:
+                next_rows = now + ROWS_INTERVAL_S
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="ResultForwarder", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # the last results and the summary of the renditions of the worker
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._send(periodic=True)
+        media_indexes = sorted(monitoring._renditions)
+        summaries = {media_index: monitoring.rendition_summary(media_index) for media_index in media_indexes}
+        self._results.put([("final", self.Worker, monitoring.headless_summary(), summaries, m3u8.get_h2_edge_stats()),
+                           ("done", self.Worker)])
+
+
+def _watch_stop(stop: multiprocessing.Event):
+    # ESC in the parent process stops the rendition loops of the worker.
+    # Polled: Event.set() of the parent waits for waiters to wake up, a waiter of a finished process never does.
+    while not stop.is_set():
+        time.sleep(BATCH_INTERVAL_S)
+    monitoring._global_escape_pressed = True
+
+def _worker_main(worker: int, renditions: List[streams.MonitoredRendition], engine: monitoring.MonitoringEngine, workers: int, settings: Dict, results: multiprocessing.Queue, stop: multiprocessing.Event):
+    logs.init_logs(settings["log_format"], f"_worker{worker}")
+    m3u8.set_protocol(settings["protocol"])
+    monitoring.set_delta_playlists(settings["delta"])
+    monitoring.set_prefetch(settings["prefetch"])
+    monitoring.set_rendition_reports(settings["rendition_reports"])
+    monitoring.set_event_store(settings["events_ram_mb"], os.path.join(settings["events_dir"], f"worker{worker}") if settings["events_dir"] else None)
+    if settings["metrics"]:
+        # series are served by the parent
+        monitoring.set_metrics(exporter.MetricsRegistry())
+    forwarder = ResultForwarder(worker, results, settings["headless"])
+    if settings["headless"]:
+        monitoring.set_headless(headless.HeadlessReporter(stream=forwarder, summary_interval=0))
+    else:
+        display.init_display_forwarding()
+    threading.Thread(target=_watch_stop, args=(stop,), name="StopWatcher", daemon=True).start()
+
+    forwarder.start()
+    try:
+        monitoring.coordinator_renditions(renditions, engine, workers)
+    except Exception as e:
+        logs.write_exception(e)
+    finally:
+        forwarder.stop()
+        monitoring.close_event_store()
+
+
+def shard_renditions(renditions: List[streams.MonitoredRendition], processes: int) -> List[List[streams.MonitoredRendition]]:
+    # all renditions of a stream go to one worker, as the PublishClock of the stream (holdtime.py) is shared by them;
+    # streams with the most renditions first, each to the worker with the fewest renditions so far
+    by_stream: Dict[streams.StreamConfig, List[streams.MonitoredRendition]] = {}
+    for rendition in renditions:
+        by_stream.setdefault(rendition.Stream, []).append(rendition)
+    shards = [[] for _ in range(max(min(processes, len(by_stream)), 1))]
+    for stream_renditions in sorted(by_stream.values(), key=len, reverse=True):
+        min(shards, key=len).extend(stream_renditions)
+    return [sorted(shard, key=lambda rendition: rendition.Media_index) for shard in shards]
+
+def run_sharded(renditions: List[streams.MonitoredRendition], engine: monitoring.MonitoringEngine, workers: int, processes: int, settings: Dict):
+    # workers = part downloads in parallel for all streams, split between the processes
+    shards = shard_renditions(renditions, processes)
+    processes = len(shards)
+    workers_per_process = max(workers // processes, 1) if workers else None
+
+    # spawn: the parent has threads (display, logs), a forked child would inherit their locks
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    stop = context.Event()
+    worker_processes = []
+    for worker, shard in enumerate(shards):
+        process = context.Process(target=_worker_main, args=(worker, shard, engine, workers_per_process, settings, results, stop), name=f"Worker{worker}")
+        process.start()
+        worker_processes.append(process)
+
+    running = set(range(processes))
+    try:
+        while running:
+            if display.display_getch(False) == 27:
+                monitoring._global_escape_pressed = True
+                stop.set()
+            try:
+                messages = results.get(timeout=BATCH_INTERVAL_S)
+            except queue.Empty:
+                # a worker which died without "done" (e.g. killed) must not block the parent
+                running = {worker for worker in running if worker_processes[worker].is_alive()}
+                continue
+            display_events = []
+            for message in messages:
+                kind = message[0]
+                if kind == "display":
+                    display_events.append(message[1])
+                elif kind == "ndjson":
+                    monitoring.remote_request_line(message[1])
+                elif kind == "rows":
+                    monitoring.remote_summary_rows(message[1], message[2])
+                elif kind == "metrics":
+                    monitoring.remote_metrics(message[1], message[2])
+                elif kind == "final":
+                    monitoring.remote_summary_rows(message[1], message[2])
+                    for media_index, summary in message[3].items():
+                        monitoring.merge_rendition_summary(media_index, summary)
+                    monitoring.merge_h2_edge_stats(message[4])
+                elif kind == "done":
+                    running.discard(message[1])
+            if display_events:
+                display.display_remote_events(display_events)
+    finally:
+        # workers still running after an exception are stopped too
+        if running:
+            stop.set()
+        for process in worker_processes:
+            process.join()
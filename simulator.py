@@ -0,0 +1,486 @@
+import argparse
+import datetime
+import json
+import math
+import random
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+# Local LL-HLS origin: synthetic ladder of renditions with parts, blocking playlist reload (_HLS_msn/_HLS_part),
+# preload hints, rendition reports and fMP4 bodies. Delivery of every rendition and file type is impaired by
+# profiles from a JSON file, all random decisions are seeded by the request, so runs are reproducible.
+#
+# python simulator.py --port 8080 --profile profile.json
+# python app.py http://127.0.0.1:8080/master.m3u8
+#
+# Profile file (all keys are optional):
+# {
+#   "seed": 1,
+#   "part_duration": 0.5,           seconds
+#   "parts_per_segment": 4,
+#   "window_segments": 10,          segments in media playlists
+#   "can_skip": false,              advertise delta playlists (CAN-SKIP-UNTIL) and serve them for _HLS_skip
+#   "byterange_parts": false,       parts are byte ranges of the segment file (BYTERANGE), the preload hint is an open-ended
+#                                   range (BYTERANGE-START); Range requests of segments are answered by 206 as parts
+#   "renditions": [{"name": "media_0", "bandwidth": 800000, "resolution": "640x360"}, ...],
+#   "profiles": [
+#     {"rendition": "*", "type": "playlist", "delay_ms": 100, "jitter_ms": 50},
+#     {"rendition": "media_1", "type": "part", "msn_from": 30, "msn_to": 35, "error_rate": 0.5, "error_code": 503},
+#     {"rendition": "media_2", "type": "playlist", "stale_rate": 0.2},
+#     {"rendition": "media_2", "type": "part", "bandwidth_kbps": 2000}
+#   ]
+# }
+# Profiles matching a request are applied in the order of the file, so later ones override earlier ones.
+# Types: master, playlist, part, segment, init. MSN range (inclusive) is optional.
+# stale_rate: blocking reload returns the playlist without the requested part, which the monitor shows as STALE.
+
+TYPE_MASTER = "master"
+TYPE_PLAYLIST = "playlist"
+TYPE_PART = "part"
+TYPE_SEGMENT = "segment"
+TYPE_INIT = "init"
+
+CONTENT_TYPE_PLAYLIST = "application/vnd.apple.mpegurl"
+CONTENT_TYPE_MEDIA = "video/mp4"
+
+DEFAULT_CONFIG = {
+    "seed": 1,
+    "part_duration": 0.5,
+    "parts_per_segment": 4,
+    "window_segments": 10,
+    "can_skip": False,
+    "byterange_parts": False,
+    "renditions": [
+        {"name": "media_0", "bandwidth": 800000, "resolution": "640x360"},
+        {"name": "media_1", "bandwidth": 2000000, "resolution": "1280x720"},
+        {"name": "media_2", "bandwidth": 4500000, "resolution": "1920x1080"},
+    ],
+    "profiles": [],
+}
+
+class DeliveryProfile:
+    # Impairments applied to one response
+    Delay_ms: float
+    Jitter_ms: float
+    Error_rate: float
+    Error_code: int
+    Bandwidth_kbps: float   #0 = not limited
+    Stale_rate: float
+
+    def __init__(self):
+        self.Delay_ms = 0.0
+        self.Jitter_ms = 0.0
+        self.Error_rate = 0.0
+        self.Error_code = 503
+        self.Bandwidth_kbps = 0.0
+        self.Stale_rate = 0.0
+
+    def update(self, rule: dict):
+        self.Delay_ms = float(rule.get("delay_ms", self.Delay_ms))
+        self.Jitter_ms = float(rule.get("jitter_ms", self.Jitter_ms))
+        self.Error_rate = float(rule.get("error_rate", self.Error_rate))
+        self.Error_code = int(rule.get("error_code", self.Error_code))
+        self.Bandwidth_kbps = float(rule.get("bandwidth_kbps", self.Bandwidth_kbps))
+        self.Stale_rate = float(rule.get("stale_rate", self.Stale_rate))
+
+    def __repr__(self):
+        return (f"DeliveryProfile(Delay_ms={self.Delay_ms}, Jitter_ms={self.Jitter_ms}, Error_rate={self.Error_rate}, "
+                f"Error_code={self.Error_code}, Bandwidth_kbps={self.Bandwidth_kbps}, Stale_rate={self.Stale_rate})")
+
+
+def _box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+def _full_box(box_type: bytes, version: int, flags: int, payload: bytes) -> bytes:
+    return _box(box_type, struct.pack(">I", (version << 24) | flags) + payload)
+
+def fmp4_init(track_id: int = 1, timescale: int = 90000) -> bytes:
+    ftyp = _box(b"ftyp", b"iso6" + struct.pack(">I", 0) + b"iso6cmfcdash")
+    mvhd = _full_box(b"mvhd", 0, 0, struct.pack(">IIII", 0, 0, timescale, 0) + b"\0" * 80)
+    tkhd = _full_box(b"tkhd", 0, 3, struct.pack(">IIII", 0, 0, track_id, 0) + b"\0" * 64)
+    mdhd = _full_box(b"mdhd", 0, 0, struct.pack(">IIIIHH", 0, 0, timescale, 0, 0x55c4, 0))
+    hdlr = _full_box(b"hdlr", 0, 0, struct.pack(">I4s", 0, b"vide") + b"\0" * 12 + b"simulator\0")
+    trak = _box(b"trak", tkhd + _box(b"mdia", mdhd + hdlr))
+    trex = _full_box(b"trex", 0, 0, struct.pack(">IIIII", track_id, 1, 0, 0, 0))
+    moov = _box(b"moov", mvhd + trak + _box(b"mvex", trex))
+    return ftyp + moov
+
+def fmp4_fragment(sequence_number: int, base_decode_time: int, duration: int, size: int, track_id: int = 1) -> bytes:
+    # moof + mdat with one sample, total size is about `size` bytes
+    mfhd = _full_box(b"mfhd", 0, 0, struct.pack(">I", sequence_number))
+    tfhd = _full_box(b"tfhd", 0, 0x020000, struct.pack(">I", track_id))
+    tfdt = _full_box(b"tfdt", 1, 0, struct.pack(">Q", base_decode_time))
+    trun_size = 8 + 4 + 4 + 4 + 8
+    moof_size = 8 + len(mfhd) + 8 + len(tfhd) + len(tfdt) + trun_size
+    mdat_payload = max(size - moof_size - 8, 0)
+    # data offset from the start of moof to the first byte of mdat payload
+    trun = _full_box(b"trun", 0, 0x000301, struct.pack(">iiII", 1, moof_size + 8, duration, mdat_payload))
+    moof = _box(b"moof", mfhd + _box(b"traf", tfhd + tfdt + trun))
+    return moof + struct.pack(">I4s", 8 + mdat_payload, b"mdat") + bytes(mdat_payload)
+
+
+class OriginSimulator:
+    # Clock of the live stream and generation of its playlists and files.
+    # Part i (from 0) of the stream is published at Start + (i+1) * Part_duration, its msn is 1 + i // Parts_per_segment
+    Seed: int
+    Part_duration: float
+    Parts_per_segment: int
+    Target_duration: int
+    Window_segments: int
+    Can_skip: bool
+    Byterange_parts: bool
+    Renditions: List[dict]
+    Profiles: List[dict]
+    Start: float
+    Attempts: Dict[str, int]    #requests of the same file, so a retry gets its own decisions
+
+    def __init__(self, config: dict):
+        cfg = dict(DEFAULT_CONFIG)
+        cfg.update(config or {})
+        self.Seed = int(cfg["seed"])
+        self.Part_duration = float(cfg["part_duration"])
+        self.Parts_per_segment = int(cfg["parts_per_segment"])
+        self.Target_duration = math.ceil(self.Part_duration * self.Parts_per_segment)
+        self.Window_segments = int(cfg["window_segments"])
+        self.Can_skip = bool(cfg["can_skip"])
+        self.Byterange_parts = bool(cfg["byterange_parts"])
+        self.Renditions = list(cfg["renditions"])
+        self.Profiles = list(cfg["profiles"])
+        # the window is full from the first request
+        self.Start = time.time() - self.Window_segments * self.Parts_per_segment * self.Part_duration
+        self.Attempts = {}
+        self._attempts_lock = threading.Lock()
+
+    def rendition(self, name: str) -> dict:
+        for r in self.Renditions:
+            if r["name"] == name:
+                return r
+        return None
+
+    def published_parts(self, now: float = None) -> int:
+        now = time.time() if now is None else now
+        return max(int((now - self.Start) / self.Part_duration), 0)
+
+    def part_index(self, msn: int, part: int) -> int:
+        return (msn - 1) * self.Parts_per_segment + part
+
+    def published_at(self, index: int) -> float:
+        return self.Start + (index + 1) * self.Part_duration
+
+    def profile(self, rendition: str, file_type: str, msn: int = None) -> DeliveryProfile:
+        result = DeliveryProfile()
+        for rule in self.Profiles:
+            if rule.get("rendition", "*") not in ("*", rendition):
+                continue
+            if rule.get("type", "*") not in ("*", file_type):
+                continue
+            if msn is not None and (msn < rule.get("msn_from", msn) or msn > rule.get("msn_to", msn)):
+                continue
+            result.update(rule)
+        return result
+
+    def random_for(self, *key) -> random.Random:
+        # the same request (and its n-th retry) gets the same decisions in every run
+        key = "/".join(str(k) for k in (self.Seed,) + key)
+        with self._attempts_lock:
+            attempt = self.Attempts.get(key, 0)
+            self.Attempts[key] = attempt + 1
+        return random.Random(f"{key}/{attempt}")
+
+    def master_playlist(self) -> bytes:
+        lines = ["#EXTM3U", "#EXT-X-VERSION:9", "#EXT-X-INDEPENDENT-SEGMENTS"]
+        for r in self.Renditions:
+            lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={r["bandwidth"]},RESOLUTION={r.get("resolution", "640x360")},CODECS="avc1.64001f"')
+            lines.append(f'{r["name"]}.m3u8')
+        return ("\n".join(lines) + "\n").encode()
+
+    def media_playlist(self, name: str, published: int, skip: bool = False) -> bytes:
+        # playlist of the rendition at the moment when `published` parts are available
+        pps = self.Parts_per_segment
+        complete_segments = published // pps
+        current_msn = complete_segments + 1
+        current_parts = published % pps
+        first_msn = max(1, current_msn - self.Window_segments)
+
+        server_control = f"#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={self.Part_duration * 3:.3f}"
+        if self.Can_skip:
+            server_control += f",CAN-SKIP-UNTIL={self.Target_duration * 6:.1f}"
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:9",
+            f"#EXT-X-TARGETDURATION:{self.Target_duration}",
+            server_control,
+            f"#EXT-X-PART-INF:PART-TARGET={self.Part_duration:.5f}",
+            f"#EXT-X-MEDIA-SEQUENCE:{first_msn}",
+            f'#EXT-X-MAP:URI="{name}_init.mp4"',
+        ]
+
+        # parts are listed for the last 3 segments only
+        first_msn_with_parts = current_msn - 3
+        msn = first_msn
+        if skip and self.Can_skip:
+            # segments older than CAN-SKIP-UNTIL from the end of the playlist are skipped
+            skipped = max(current_msn - first_msn - math.ceil(self.Target_duration * 6 / (self.Part_duration * pps)), 0)
+            if skipped > 0:
+                lines.append(f"#EXT-X-SKIP:SKIPPED-SEGMENTS={skipped}")
+                msn += skipped
+        # program time of the first listed segment, parts end at their publish time
+        program_time = datetime.datetime.fromtimestamp(self.Start + (msn - 1) * pps * self.Part_duration, datetime.timezone.utc)
+        lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{program_time.isoformat(timespec='milliseconds').replace('+00:00', 'Z')}")
+        for msn in range(msn, current_msn):
+            if msn >= first_msn_with_parts:
+                for p in range(pps):
+                    lines.append(self.part_line(name, msn, p))
+            lines.append(f"#EXTINF:{self.Part_duration * pps:.5f},")
+            lines.append(f"{name}_{msn}.m4s")
+        for p in range(current_parts):
+            lines.append(self.part_line(name, current_msn, p))
+        if self.Byterange_parts:
+            lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="{name}_{current_msn}.m4s",BYTERANGE-START={current_parts * self.part_size(name)}')
+        else:
+            lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="{name}_{current_msn}_{current_parts}.m4s"')
+
+        # all renditions are aligned, so they report the same last part
+        last_msn, last_part = (current_msn, current_parts - 1) if current_parts > 0 else (current_msn - 1, pps - 1)
+        for r in self.Renditions:
+            if r["name"] != name:
+                lines.append(f'#EXT-X-RENDITION-REPORT:URI="{r["name"]}.m3u8",LAST-MSN={last_msn},LAST-PART={last_part}')
+        return ("\n".join(lines) + "\n").encode()
+
+    def part_line(self, name: str, msn: int, part: int) -> str:
+        independent = ",INDEPENDENT=YES" if part == 0 else ""
+        if not self.Byterange_parts:
+            return f'#EXT-X-PART:DURATION={self.Part_duration:.5f},URI="{name}_{msn}_{part}.m4s"{independent}'
+        # the offset of the first part only, the next ones follow it
+        byterange = f"{self.part_size(name)}@0" if part == 0 else f"{self.part_size(name)}"
+        return f'#EXT-X-PART:DURATION={self.Part_duration:.5f},URI="{name}_{msn}.m4s",BYTERANGE="{byterange}"{independent}'
+
+    def part_size(self, name: str) -> int:
+        # all parts of a rendition have the same size, so byte ranges of a segment are known before it's complete
+        return len(self.part_body(self.rendition(name), 1, 0))
+
+    def part_body(self, rendition: dict, msn: int, part: int) -> bytes:
+        index = self.part_index(msn, part)
+        duration = int(self.Part_duration * 90000)
+        size = int(rendition["bandwidth"] * self.Part_duration / 8)
+        return fmp4_fragment(index + 1, index * duration, duration, size)
+
+
+def parse_range(value: str) -> tuple[int, int]:
+    # "bytes=start-end" or "bytes=start-" -> (start, end or None), None if not a single range
+    unit, _, byte_range = value.partition("=")
+    start, dash, end = byte_range.strip().partition("-")
+    if unit.strip() != "bytes" or not dash or not start.isdigit() or (end and not end.isdigit()):
+        return None
+    return (int(start), int(end) if end else None)
+
+
+class SimulatorRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are separate sends, with Nagle every keep-alive response would wait for the delayed ACK (~40 ms)
+    disable_nagle_algorithm = True
+    server: "SimulatorServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        origin = self.server.Origin
+        parsed_url = urlparse(self.path)
+        query = parse_qs(parsed_url.query)
+        filename = parsed_url.path.rsplit("/", 1)[-1]
+
+        if filename == "master.m3u8":
+            profile = origin.profile("*", TYPE_MASTER)
+            self.respond(profile, origin.random_for(TYPE_MASTER), CONTENT_TYPE_PLAYLIST, origin.master_playlist)
+        elif filename.endswith(".m3u8"):
+            self.handle_media_playlist(origin, filename[:-len(".m3u8")], query)
+        elif filename.endswith("_init.mp4"):
+            name = filename[:-len("_init.mp4")]
+            if origin.rendition(name) is None:
+                return self.send_error_body(404)
+            self.respond(origin.profile(name, TYPE_INIT), origin.random_for(name, TYPE_INIT), CONTENT_TYPE_MEDIA, fmp4_init)
+        elif filename.endswith(".m4s"):
+            self.handle_media_file(origin, filename[:-len(".m4s")])
+        else:
+            self.send_error_body(404)
+
+    def handle_media_playlist(self, origin: OriginSimulator, name: str, query: Dict[str, List[str]]):
+        if origin.rendition(name) is None:
+            return self.send_error_body(404)
+        try:
+            msn = int(query["_HLS_msn"][0]) if "_HLS_msn" in query else None
+            part = int(query["_HLS_part"][0]) if "_HLS_part" in query else None
+        except ValueError:
+            return self.send_error_body(400)
+        skip = "_HLS_skip" in query
+
+        if msn is None:
+            profile = origin.profile(name, TYPE_PLAYLIST)
+            self.respond(profile, origin.random_for(name, TYPE_PLAYLIST, origin.published_parts()), CONTENT_TYPE_PLAYLIST, lambda: origin.media_playlist(name, origin.published_parts(), skip))
+            return
+
+        # blocking reload: hold the request till the part (or the whole segment) is published
+        if part is not None and part >= origin.Parts_per_segment:
+            return self.send_error_body(400)
+        index = origin.part_index(msn, part) if part is not None else origin.part_index(msn, origin.Parts_per_segment - 1)
+        published = origin.published_parts()
+        if index >= published + 2 * origin.Parts_per_segment:
+            # too far in the future
+            return self.send_error_body(400)
+
+        profile = origin.profile(name, TYPE_PLAYLIST, msn)
+        rng = origin.random_for(name, TYPE_PLAYLIST, msn, part)
+        if rng.random() < profile.Stale_rate:
+            # answer right away with the playlist without the requested part
+            self.respond(profile, rng, CONTENT_TYPE_PLAYLIST, lambda: origin.media_playlist(name, min(index, published), skip))
+            return
+
+        wait_s = origin.published_at(index) - time.time()
+        if wait_s > 0:
+            time.sleep(wait_s)
+        self.respond(profile, rng, CONTENT_TYPE_PLAYLIST, lambda: origin.media_playlist(name, max(origin.published_parts(), index + 1), skip))
+
+    def handle_media_file(self, origin: OriginSimulator, stem: str):
+        # name_msn_part.m4s (part) or name_msn.m4s (segment)
+        fields = stem.rsplit("_", 2)
+        try:
+            if len(fields) == 3 and origin.rendition(fields[0]) is not None:
+                name, msn, parts = fields[0], int(fields[1]), [int(fields[2])]
+                file_type = TYPE_PART
+            else:
+                name, msn = stem.rsplit("_", 1)
+                msn = int(msn)
+                parts = list(range(origin.Parts_per_segment))
+                file_type = TYPE_SEGMENT
+        except ValueError:
+            return self.send_error_body(404)
+        rendition = origin.rendition(name)
+        if rendition is None or msn < 1 or parts[-1] >= origin.Parts_per_segment:
+            return self.send_error_body(404)
+
+        # byte range of a segment = parts, an open-ended one is held for its first part like a preload hint
+        byterange = None
+        if file_type == TYPE_SEGMENT and self.headers.get("Range"):
+            byterange = parse_range(self.headers["Range"])
+            if byterange is None:
+                return self.send_error_body(416)
+            size = origin.part_size(name)
+            start, end = byterange
+            first = start // size
+            last = first if end is None else min(end // size, origin.Parts_per_segment - 1)
+            if first >= origin.Parts_per_segment or last < first:
+                return self.send_error_body(416)
+            parts = list(range(first, last + 1))
+            file_type = TYPE_PART
+
+        # preload hint: the next part is held till it's published, anything later does not exist yet
+        index = origin.part_index(msn, parts[-1])
+        published = origin.published_parts()
+        if index > published:
+            return self.send_error_body(404)
+        wait_s = origin.published_at(index) - time.time()
+        if wait_s > 0:
+            time.sleep(wait_s)
+
+        profile = origin.profile(name, file_type, msn)
+        rng = origin.random_for(name, file_type, msn, parts[0] if file_type == TYPE_PART else None)
+        if byterange is None:
+            self.respond(profile, rng, CONTENT_TYPE_MEDIA, lambda: b"".join(origin.part_body(rendition, msn, p) for p in parts))
+            return
+        # the range is cut from the parts published by now, an open-ended one ends with the last of them
+        size = origin.part_size(name)
+        start, end = byterange
+        available = min(origin.published_parts() - origin.part_index(msn, 0), origin.Parts_per_segment) * size
+        end = available - 1 if end is None else min(end, available - 1)
+        first = start // size
+        body = lambda: b"".join(origin.part_body(rendition, msn, p) for p in range(first, end // size + 1))[start - first * size:end - first * size + 1]
+        self.respond(profile, rng, CONTENT_TYPE_MEDIA, body, 206, [("Content-Range", f"bytes {start}-{end}/{size * origin.Parts_per_segment}")])
+
+    def respond(self, profile: DeliveryProfile, rng: random.Random, content_type: str, make_body, status: int = 200, headers: List[tuple[str, str]] = None):
+        delay_ms = profile.Delay_ms + (rng.uniform(-profile.Jitter_ms, profile.Jitter_ms) if profile.Jitter_ms > 0 else 0.0)
+        is_error = rng.random() < profile.Error_rate
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+        if is_error:
+            return self.send_error_body(profile.Error_code)
+
+        body = make_body()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        for header, value in headers or []:
+            self.send_header(header, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache" if content_type == CONTENT_TYPE_PLAYLIST else "max-age=60")
+        self.end_headers()
+
+        if profile.Bandwidth_kbps <= 0:
+            self.wfile.write(body)
+            return
+        # throttle the body to the bandwidth of the profile
+        chunk_size = 16384
+        for i in range(0, len(body), chunk_size):
+            chunk = body[i:i + chunk_size]
+            self.wfile.write(chunk)
+            self.wfile.flush()
+            time.sleep(len(chunk) * 8 / (profile.Bandwidth_kbps * 1000))
+
+    def send_error_body(self, code: int):
+        body = f"{code}\n".encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class SimulatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+    Origin: OriginSimulator
+
+    def __init__(self, address: tuple[str, int], origin: OriginSimulator):
+        super().__init__(address, SimulatorRequestHandler)
+        self.Origin = origin
+
+    @property
+    def master_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/master.m3u8"
+
+def start_simulator(config: dict = None, host: str = "127.0.0.1", port: int = 0) -> SimulatorServer:
+    # runs the origin in a background thread, port 0 = any free port, see SimulatorServer.master_url
+    server = SimulatorServer((host, port), OriginSimulator(config))
+    threading.Thread(target=server.serve_forever, name="Simulator", daemon=True).start()
+    return server
+
+def load_config(path: str) -> dict:
+    if not path:
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local LL-HLS origin with blocking playlist reload and delivery profiles")
+    parser.add_argument('--host', type=str, default="127.0.0.1", help='address to listen on (default is 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on (default is 8080)')
+    parser.add_argument('--profile', type=str, default=None, help='JSON file with the ladder and delivery profiles, see the top of simulator.py')
+    parser.add_argument('--seed', type=int, default=None, help='seed of random decisions, overrides the one of the profile file')
+    args = parser.parse_args()
+
+    config = load_config(args.profile)
+    if args.seed is not None:
+        config["seed"] = args.seed
+
+    server = SimulatorServer((args.host, args.port), OriginSimulator(config))
+    print(f"LL-HLS origin: {server.master_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,280 @@
+import math
+from typing import Dict, List
+
+import numpy as np
+
+import m3u8
+
+# Streaming statistics of requests with constant memory.
+# QuantileSketch is a histogram with logarithmic buckets (as HDR histogram / DDSketch): every value is counted in
+# the bucket [gamma^(i-1), gamma^i), so a quantile is returned with relative error below Relative_accuracy.
+# Sketches with the same accuracy are merged by adding counts of buckets.
+# Negative values (e.g. live-edge latency with the probe clock behind the packager) are counted in mirrored buckets
+# of their absolute values, as in DDSketch.
+
+# 1% relative error, values from 1 microsecond to 10^7 ms (or bps) need less than 1500 buckets
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+class QuantileSketch:
+    Relative_accuracy: float
+    Count: int
+    Sum: float
+    Min: float
+    Max: float
+    Zero_count: int             #values == 0
+    Buckets: Dict[int, int]     #bucket index -> count
+    Negative_buckets: Dict[int, int]    #bucket index of -value -> count
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY):
+        self.Relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.Count = 0
+        self.Sum = 0.0
+        self.Min = math.inf
+        self.Max = -math.inf
+        self.Zero_count = 0
+        self.Buckets = {}
+        self.Negative_buckets = {}
+
+    def add(self, value: float, count: int = 1):
+        if value is None:
+            return
+        self.Count += count
+        self.Sum += value * count
+        if value < self.Min:
+            self.Min = value
+        if value > self.Max:
+            self.Max = value
+        if value == 0:
+            self.Zero_count += count
+            return
+        buckets = self.Buckets if value > 0 else self.Negative_buckets
+        index = math.ceil(math.log(abs(value)) / self._log_gamma)
+        buckets[index] = buckets.get(index, 0) + count
+
+    def merge(self, other: "QuantileSketch"):
+        if other is None or other.Count == 0:
+            return
+        if other.Relative_accuracy != self.Relative_accuracy:
+            raise ValueError(f"Sketches with different accuracy can't be merged: {self.Relative_accuracy} and {other.Relative_accuracy}")
+        self.Count += other.Count
+        self.Sum += other.Sum
+        self.Min = min(self.Min, other.Min)
+        self.Max = max(self.Max, other.Max)
+        self.Zero_count += other.Zero_count
+        for index, count in other.Buckets.items():
+            self.Buckets[index] = self.Buckets.get(index, 0) + count
+        for index, count in other.Negative_buckets.items():
+            self.Negative_buckets[index] = self.Negative_buckets.get(index, 0) + count
+
+    def _bucket_value(self, index: int) -> float:
+        # value in the middle of the bucket, relative error to any value of the bucket is below Relative_accuracy
+        return 2 * self._gamma ** index / (self._gamma + 1)
+
+    def _sorted_buckets(self):
+        # (value, count) of all buckets in ascending order of values, values are clamped to Min..Max
+        for index in sorted(self.Negative_buckets, reverse=True):
+            yield max(self.Min, min(-self._bucket_value(index), self.Max)), self.Negative_buckets[index]
+        if self.Zero_count > 0:
+            yield max(self.Min, min(0.0, self.Max)), self.Zero_count
+        for index in sorted(self.Buckets):
+            yield max(self.Min, min(self._bucket_value(index), self.Max)), self.Buckets[index]
+
+    def quantile(self, q: float) -> float:
+        return self.quantiles([q])[0]
+
+    def quantiles(self, qs: List[float]) -> List[float]:
+        # rank of a value is as in numpy.percentile, but without interpolation; all quantiles in one pass over buckets
+        values = [0.0] * len(qs)
+        if self.Count == 0:
+            return values
+        seen = 0
+        value = self.Min
+        buckets = self._sorted_buckets()
+        for rank, i in sorted((q * (self.Count - 1), i) for i, q in enumerate(qs)):
+            while seen <= rank:
+                bucket = next(buckets, None)
+                if bucket is None:
+                    value = self.Max
+                    break
+                value, count = bucket
+                seen += count
+            values[i] = value
+        return values
+
+    def sum_above(self, threshold: float) -> float:
+        # approximate sum of values above the threshold
+        if self.Count == 0 or self.Max <= threshold:
+            return 0.0
+        total = 0.0
+        for value, count in self._sorted_buckets():
+            if value > threshold:
+                total += value * count
+        return total
+
+    def mean(self) -> float:
+        return self.Sum / self.Count if self.Count > 0 else 0.0
+
+    def stat_values(self) -> tuple[float, float, float, float, float, float, float]:
+        # min, avg, max, p50, p75, p95, p99
+        if self.Count == 0:
+            return (0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+        p50, p75, p95, p99 = self.quantiles([0.50, 0.75, 0.95, 0.99])
+        return (self.Min, self.mean(), self.Max, p50, p75, p95, p99)
+
+    def to_dict(self) -> Dict:
+        # compact form for JSON (result bundles), buckets as parallel lists of indexes and counts
+        indexes = sorted(self.Buckets)
+        negative_indexes = sorted(self.Negative_buckets)
+        return {
+            "accuracy": self.Relative_accuracy,
+            "count": self.Count,
+            "sum": self.Sum,
+            "min": self.Min if self.Count > 0 else None,
+            "max": self.Max if self.Count > 0 else None,
+            "zero": self.Zero_count,
+            "index": indexes,
+            "bucket": [self.Buckets[i] for i in indexes],
+            "negative_index": negative_indexes,
+            "negative_bucket": [self.Negative_buckets[i] for i in negative_indexes],
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "QuantileSketch":
+        sketch = cls(d["accuracy"])
+        sketch.Count = d["count"]
+        sketch.Sum = d["sum"]
+        if sketch.Count > 0:
+            sketch.Min = d["min"]
+            sketch.Max = d["max"]
+        sketch.Zero_count = d["zero"]
+        sketch.Buckets = dict(zip(d["index"], d["bucket"]))
+        # bundles written before negative buckets counted negative values as zero
+        sketch.Negative_buckets = dict(zip(d.get("negative_index", []), d.get("negative_bucket", [])))
+        return sketch
+
+    def __repr__(self):
+        return (f"QuantileSketch(Count={self.Count}, Min={self.Min}, Max={self.Max}, "
+                f"Buckets={len(self.Buckets)}, Relative_accuracy={self.Relative_accuracy})")
+
+
+class ArrayStats:
+    # Exact statistics of a numpy array of values (e.g. a column of events.EventStore), same interface as
+    # QuantileSketch for the summary. NaN values (not measured) are skipped.
+    Values: np.ndarray
+    Count: int
+
+    def __init__(self, values: np.ndarray):
+        self.Values = values[~np.isnan(values)] if values.dtype.kind == "f" else values
+        self.Count = len(self.Values)
+
+    def sum_above(self, threshold: float) -> float:
+        return float(self.Values[self.Values > threshold].sum(dtype=np.float64))
+
+    def mean(self) -> float:
+        return float(self.Values.mean(dtype=np.float64)) if self.Count > 0 else 0.0
+
+    def stat_values(self) -> tuple[float, float, float, float, float, float, float]:
+        # min, avg, max, p50, p75, p95, p99
+        if self.Count == 0:
+            return (0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+        p50, p75, p95, p99 = np.percentile(self.Values, [50, 75, 95, 99])
+        return (float(self.Values.min()), self.mean(), float(self.Values.max()), float(p50), float(p75), float(p95), float(p99))
+
+    def __repr__(self):
+        return f"ArrayStats(Count={self.Count})"
+
+
+class RequestStats:
+    # Sketches of requests of one rendition and one type of file (manifests or parts)
+    Response_time: QuantileSketch       #ms
+    Download_time: QuantileSketch       #ms
+    Download_speed: QuantileSketch      #bps
+    Response_time_new_conn: QuantileSketch
+    Response_time_reused_conn: QuantileSketch
+    Phases: Dict[str, QuantileSketch]   #ms, see timing.PHASES
+    Hold_time: QuantileSketch           #ms, expected blocking-reload hold of playlist requests (see holdtime.py)
+    Excess_time: QuantileSketch         #ms, response time without the expected hold of the same requests
+    Live_latency: QuantileSketch        #ms, arrival behind the end of the newest part in program time (live edge)
+
+    def __init__(self):
+        self.Response_time = QuantileSketch()
+        self.Download_time = QuantileSketch()
+        self.Download_speed = QuantileSketch()
+        self.Response_time_new_conn = QuantileSketch()
+        self.Response_time_reused_conn = QuantileSketch()
+        self.Phases = {}
+        self.Hold_time = QuantileSketch()
+        self.Excess_time = QuantileSketch()
+        self.Live_latency = QuantileSketch()
+
+    def add(self, metrics: m3u8.DownloadMetrics):
+        if metrics is None:
+            return
+        self.Response_time.add(metrics.Response_time or 0.0)
+        self.Download_time.add(metrics.Download_time or 0.0)
+        self.Download_speed.add(metrics.Download_speed or 0.0)
+        if metrics.Connection_reused is not None:
+            sketch = self.Response_time_reused_conn if metrics.Connection_reused else self.Response_time_new_conn
+            sketch.add(metrics.Response_time or 0.0)
+        for phase, value in metrics.phases_ms().items():
+            if value is not None:
+                sketch = self.Phases.get(phase)
+                if sketch is None:
+                    sketch = self.Phases[phase] = QuantileSketch()
+                sketch.add(value)
+        if metrics.Time_hold is not None:
+            self.Hold_time.add(metrics.Time_hold)
+            self.Excess_time.add(metrics.excess_time())
+        if metrics.Live_latency is not None:
+            self.Live_latency.add(metrics.Live_latency)
+
+    def merge(self, other: "RequestStats"):
+        if other is None:
+            return
+        self.Response_time.merge(other.Response_time)
+        self.Download_time.merge(other.Download_time)
+        self.Download_speed.merge(other.Download_speed)
+        self.Response_time_new_conn.merge(other.Response_time_new_conn)
+        self.Response_time_reused_conn.merge(other.Response_time_reused_conn)
+        for phase, sketch in other.Phases.items():
+            if phase not in self.Phases:
+                self.Phases[phase] = QuantileSketch(sketch.Relative_accuracy)
+            self.Phases[phase].merge(sketch)
+        self.Hold_time.merge(other.Hold_time)
+        self.Excess_time.merge(other.Excess_time)
+        self.Live_latency.merge(other.Live_latency)
+
+    def to_dict(self) -> Dict:
+        return {
+            "response_time": self.Response_time.to_dict(),
+            "download_time": self.Download_time.to_dict(),
+            "download_speed": self.Download_speed.to_dict(),
+            "response_time_new_conn": self.Response_time_new_conn.to_dict(),
+            "response_time_reused_conn": self.Response_time_reused_conn.to_dict(),
+            "phases": {phase: sketch.to_dict() for phase, sketch in self.Phases.items()},
+            "hold_time": self.Hold_time.to_dict(),
+            "excess_time": self.Excess_time.to_dict(),
+            "live_latency": self.Live_latency.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "RequestStats":
+        stats = cls()
+        stats.Response_time = QuantileSketch.from_dict(d["response_time"])
+        stats.Download_time = QuantileSketch.from_dict(d["download_time"])
+        stats.Download_speed = QuantileSketch.from_dict(d["download_speed"])
+        stats.Response_time_new_conn = QuantileSketch.from_dict(d["response_time_new_conn"])
+        stats.Response_time_reused_conn = QuantileSketch.from_dict(d["response_time_reused_conn"])
+        stats.Phases = {phase: QuantileSketch.from_dict(sketch) for phase, sketch in d["phases"].items()}
+        # bundles written before the hold time and the live latency were measured have no sketches of them
+        if "hold_time" in d:
+            stats.Hold_time = QuantileSketch.from_dict(d["hold_time"])
+            stats.Excess_time = QuantileSketch.from_dict(d["excess_time"])
+        if "live_latency" in d:
+            stats.Live_latency = QuantileSketch.from_dict(d["live_latency"])
+        return stats
+
+    def __repr__(self):
+        return f"RequestStats(Count={self.Response_time.Count}, Phases={list(self.Phases)})"
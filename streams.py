@@ -0,0 +1,158 @@
+import json
+import re
+from typing import Dict, List
+
+import m3u8
+
+# Many live streams monitored by one process, listed in a JSON config file:
+#
+# python app.py --config streams.json --headless
+#
+# Config file (all keys but "streams" and "url" are optional):
+# {
+#   "limit": 100,                   playlist requests per rendition, default of every stream
+#   "workers": 64,                  part downloads in parallel for all streams (global budget)
+#   "thresholds": {...},            default thresholds of every stream, see Thresholds
+#   "streams": [
+#     {"name": "channel_1", "url": "https://cdn.example.com/channel_1/master.m3u8"},
+#     {"name": "channel_2", "url": "https://cdn.example.com/channel_2/master.m3u8", "limit": 50,
+#      "renditions": {"indexes": [0, 2], "min_bandwidth": 0, "max_bandwidth": 3000000, "uri": "720p"},
+#      "thresholds": {"part_download_ms": 300}}
+#   ]
+# }
+# Renditions of a master playlist are selected by all given filters: indexes in the master playlist,
+# bandwidth range (bps) and a regular expression searched in the URI of the rendition.
+# Every selected rendition gets its own media index (display column, summary, logs), numbered across all streams.
+
+DEFAULT_WORKERS = 64
+
+class Thresholds:
+    Part_download_ms: float             #part is SLOW if downloaded longer
+    Playlist_response_ms: float         #playlist response is marked DELAY (not counted) if longer
+    Part_response_factor: float         #part is DELAY if response time > factor * PART-TARGET
+    Playlist_response_factor: float     #playlist is DELAY if response time > factor * TARGETDURATION
+
+    def __init__(self, part_download_ms: float = 150.0, playlist_response_ms: float = 500.0, part_response_factor: float = 1.0, playlist_response_factor: float = 1.0):
+        self.Part_download_ms = part_download_ms
+        self.Playlist_response_ms = playlist_response_ms
+        self.Part_response_factor = part_response_factor
+        self.Playlist_response_factor = playlist_response_factor
+
+    def updated(self, values: Dict) -> "Thresholds":
+        # copy with the values of the config ({"part_download_ms": 300, ...})
+        thresholds = Thresholds(self.Part_download_ms, self.Playlist_response_ms, self.Part_response_factor, self.Playlist_response_factor)
+        for key, value in (values or {}).items():
+            attribute = key.capitalize()
+            if not hasattr(thresholds, attribute):
+                raise ValueError(f"Unknown threshold: {key}")
+            setattr(thresholds, attribute, float(value))
+        return thresholds
+
+    def __repr__(self):
+        return (f"Thresholds(Part_download_ms={self.Part_download_ms}, Playlist_response_ms={self.Playlist_response_ms}, "
+                f"Part_response_factor={self.Part_response_factor}, Playlist_response_factor={self.Playlist_response_factor})")
+
+DEFAULT_THRESHOLDS = Thresholds()
+
+
+class RenditionFilter:
+    Indexes: List[int]          #indexes in the master playlist, None = all
+    Min_bandwidth: int
+    Max_bandwidth: int          #0 = no limit
+    Uri_pattern: re.Pattern
+
+    def __init__(self, indexes: List[int] = None, min_bandwidth: int = 0, max_bandwidth: int = 0, uri: str = None):
+        self.Indexes = indexes
+        self.Min_bandwidth = min_bandwidth
+        self.Max_bandwidth = max_bandwidth
+        self.Uri_pattern = re.compile(uri) if uri else None
+
+    def matches(self, index: int, media: m3u8.MediaStream) -> bool:
+        if self.Indexes is not None and index not in self.Indexes:
+            return False
+        try:
+            bandwidth = int(media.Bandwidth)
+        except (TypeError, ValueError):
+            bandwidth = 0
+        if bandwidth < self.Min_bandwidth or (self.Max_bandwidth > 0 and bandwidth > self.Max_bandwidth):
+            return False
+        if self.Uri_pattern is not None and not self.Uri_pattern.search(media.URI):
+            return False
+        return True
+
+
+class StreamConfig:
+    Name: str
+    URL: str
+    Limit: int
+    Renditions: RenditionFilter
+    Thresholds: Thresholds
+
+    def __init__(self, url: str, name: str = None, limit: int = 100, renditions: RenditionFilter = None, thresholds: Thresholds = None):
+        self.URL = url
+        self.Name = name or url
+        self.Limit = limit
+        self.Renditions = renditions or RenditionFilter()
+        self.Thresholds = thresholds or DEFAULT_THRESHOLDS
+
+    def __repr__(self):
+        return f"StreamConfig(Name='{self.Name}', URL='{self.URL}', Limit={self.Limit})"
+
+
+class MonitoringConfig:
+    Limit: int
+    Workers: int
+    Streams: List[StreamConfig]
+
+    def __init__(self, streams: List[StreamConfig], limit: int = 100, workers: int = DEFAULT_WORKERS):
+        self.Streams = streams
+        self.Limit = limit
+        self.Workers = workers
+
+
+class MonitoredRendition:
+    # rendition of a stream with its media index in the process
+    Media_index: int
+    Stream: StreamConfig
+    Media: m3u8.MediaStream
+
+    def __init__(self, media_index: int, stream: StreamConfig, media: m3u8.MediaStream):
+        self.Media_index = media_index
+        self.Stream = stream
+        self.Media = media
+
+    def __repr__(self):
+        return f"MonitoredRendition(Media_index={self.Media_index}, Stream='{self.Stream.Name}', URI='{self.Media.URI}')"
+
+
+def parse_config(config: Dict) -> MonitoringConfig:
+    limit = int(config.get("limit", 100))
+    thresholds = DEFAULT_THRESHOLDS.updated(config.get("thresholds"))
+    streams = []
+    for i, s in enumerate(config.get("streams", [])):
+        if "url" not in s:
+            raise ValueError(f"Stream #{i + 1} of the config has no url")
+        r = s.get("renditions", {})
+        streams.append(StreamConfig(
+            s["url"],
+            s.get("name"),
+            int(s.get("limit", limit)),
+            RenditionFilter(r.get("indexes"), int(r.get("min_bandwidth", 0)), int(r.get("max_bandwidth", 0)), r.get("uri")),
+            thresholds.updated(s.get("thresholds")),
+        ))
+    if not streams:
+        raise ValueError("No streams in the config")
+    return MonitoringConfig(streams, limit, max(int(config.get("workers", DEFAULT_WORKERS)), 1))
+
+def load_config(path: str) -> MonitoringConfig:
+    with open(path, "r") as f:
+        return parse_config(json.load(f))
+
+def select_renditions(streams: List[tuple[StreamConfig, m3u8.M3U8]]) -> List[MonitoredRendition]:
+    # (stream, loaded master playlist) -> selected renditions of all streams, media indexes in order of the streams
+    renditions = []
+    for stream, master_playlist in streams:
+        for i, media in enumerate(master_playlist.Media_Streams):
+            if stream.Renditions.matches(i, media):
+                renditions.append(MonitoredRendition(len(renditions), stream, media))
+    return renditions
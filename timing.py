@@ -0,0 +1,242 @@
+import asyncio
+import contextvars
+import socket
+import time
+from typing import Dict, List
+
+import httpcore
+import urllib3.connection
+import urllib3.connectionpool
+import urllib3.exceptions
+
+# Phases of a request, all of them are measured by monotonic time.perf_counter_ns():
+# DNS -> TCP connect -> TLS handshake -> request send -> server wait (blocking-reload hold) -> body transfer
+PHASES = ["dns", "connect", "tls", "send", "wait", "body"]
+
+class RequestTimer:
+    # Timestamps (ns) of one request, None if phase did not happen (e.g. reused connection)
+    Start: int
+    Dns_start: int
+    Dns_end: int
+    Connect_start: int
+    Connect_end: int
+    Tls_start: int
+    Tls_end: int
+    Send_start: int
+    Send_end: int
+    Headers_received: int
+    Body_end: int
+
+    def __init__(self):
+        self.Start = time.perf_counter_ns()
+        self.Dns_start = None
+        self.Dns_end = None
+        self.Connect_start = None
+        self.Connect_end = None
+        self.Tls_start = None
+        self.Tls_end = None
+        self.Send_start = None
+        self.Send_end = None
+        self.Headers_received = None
+        self.Body_end = None
+
+    def mark(self, name: str):
+        setattr(self, name, time.perf_counter_ns())
+
+    def elapsed_ms(self, name: str = None) -> float:
+        # ms from start of request till the timestamp, or till now
+        end = getattr(self, name) if name else time.perf_counter_ns()
+        if end is None:
+            return None
+        return (end - self.Start) / 1000000
+
+    def phases_ms(self) -> Dict[str, float]:
+        def delta(start: int, end: int) -> float:
+            if start is None or end is None:
+                return None
+            return max(end - start, 0) / 1000000
+
+        # for HTTP without TLS the connection is opened lazily inside of the sending of the request
+        send_start = self.Send_start
+        for t in [self.Connect_end, self.Tls_end]:
+            if send_start is not None and t is not None and t > send_start:
+                send_start = t
+
+        return {
+            "dns": delta(self.Dns_start, self.Dns_end),
+            "connect": delta(self.Connect_start, self.Connect_end),
+            "tls": delta(self.Tls_start, self.Tls_end),
+            "send": delta(send_start, self.Send_end),
+            "wait": delta(self.Send_end, self.Headers_received),
+            "body": delta(self.Headers_received, self.Body_end),
+        }
+
+    # httpcore "trace" extension, sync interface
+    def __call__(self, event_name: str, info: dict):
+        name = event_name.split(".", 1)[-1]
+        if name == "connect_tcp.started":
+            # DNS is resolved by TimedNetworkBackend inside of connect_tcp, so TCP starts after it
+            if self.Connect_start is None:
+                self.mark("Connect_start")
+        elif name == "connect_tcp.complete":
+            self.mark("Connect_end")
+        elif name == "start_tls.started":
+            self.mark("Tls_start")
+        elif name == "start_tls.complete":
+            self.mark("Tls_end")
+        elif name == "send_request_headers.started":
+            self.mark("Send_start")
+        elif name == "send_request_body.complete":
+            self.mark("Send_end")
+        elif name == "receive_response_headers.complete":
+            self.mark("Headers_received")
+
+    # httpcore "trace" extension, async interface
+    async def trace_async(self, event_name: str, info: dict):
+        self.__call__(event_name, info)
+
+# timer of the request executed in the current thread or asyncio task
+_current_timer: contextvars.ContextVar = contextvars.ContextVar("llhls_request_timer", default=None)
+
+def start_request_timer() -> RequestTimer:
+    timer = RequestTimer()
+    _current_timer.set(timer)
+    return timer
+
+def _mark_dns(timer: RequestTimer, dns_start: int):
+    if timer is not None:
+        timer.Dns_start = dns_start
+        timer.mark("Dns_end")
+        # TCP connect starts right after the name is resolved
+        timer.mark("Connect_start")
+
+def _addresses(infos) -> List[str]:
+    # addresses of getaddrinfo() in its order (A/AAAA by the system preference), without duplicates
+    return list(dict.fromkeys(info[4][0] for info in infos))
+
+def _resolve(host: str, port: int) -> List[str]:
+    # every address is tried in order by the connect, like socket.create_connection() does
+    try:
+        return _addresses(socket.getaddrinfo(host, port, type=socket.SOCK_STREAM))
+    except socket.gaierror:
+        # let the connection report the error in its usual way
+        return [host]
+
+
+# httpcore: DNS is a part of connect_tcp, so resolve the name separately to measure it.
+# TLS SNI and certificate check use the origin host, not the address passed into connect_tcp.
+class TimedNetworkBackend(httpcore.NetworkBackend):
+    def __init__(self):
+        self._backend = httpcore.SyncBackend()
+
+    def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        dns_start = time.perf_counter_ns()
+        addresses = _resolve(host, port)
+        _mark_dns(_current_timer.get(), dns_start)
+        for i, address in enumerate(addresses):
+            try:
+                return self._backend.connect_tcp(address, port, timeout=timeout, local_address=local_address, socket_options=socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout):
+                if i == len(addresses) - 1:
+                    raise
+
+    def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return self._backend.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    def sleep(self, seconds):
+        self._backend.sleep(seconds)
+
+class TimedAsyncNetworkBackend(httpcore.AsyncNetworkBackend):
+    def __init__(self):
+        self._backend = httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        dns_start = time.perf_counter_ns()
+        try:
+            addresses = _addresses(await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM))
+        except socket.gaierror:
+            addresses = [host]
+        _mark_dns(_current_timer.get(), dns_start)
+        for i, address in enumerate(addresses):
+            try:
+                return await self._backend.connect_tcp(address, port, timeout=timeout, local_address=local_address, socket_options=socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout):
+                if i == len(addresses) - 1:
+                    raise
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self._backend.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds):
+        await self._backend.sleep(seconds)
+
+def install_timed_backend(client):
+    # httpx does not expose the network backend of its connection pool, so it is replaced in place
+    pool = getattr(client._transport, "_pool", None)
+    if pool is None:
+        return
+    if isinstance(pool, httpcore.AsyncConnectionPool):
+        pool._network_backend = TimedAsyncNetworkBackend()
+    else:
+        pool._network_backend = TimedNetworkBackend()
+
+
+# requests/urllib3: the same phases are measured by connection classes of the session pools
+class _TimedConnectionMixin:
+    def _new_conn(self):
+        timer = _current_timer.get()
+        dns_start = time.perf_counter_ns()
+        dns_host = self._dns_host
+        addresses = _resolve(dns_host, self.port)
+        _mark_dns(timer, dns_start)
+        try:
+            for i, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except (urllib3.exceptions.NewConnectionError, urllib3.exceptions.ConnectTimeoutError):
+                    if i == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = dns_host
+            if timer is not None:
+                timer.mark("Connect_end")
+                # for https TLS handshake follows right after TCP connect
+                timer.Tls_start = timer.Connect_end
+
+    def connect(self):
+        super().connect()
+        timer = _current_timer.get()
+        if timer is not None and timer.Tls_start is not None and isinstance(self, urllib3.connection.HTTPSConnection):
+            timer.mark("Tls_end")
+
+    def request(self, *args, **kwargs):
+        timer = _current_timer.get()
+        if timer is not None:
+            timer.mark("Send_start")
+        super().request(*args, **kwargs)
+        if timer is not None:
+            timer.mark("Send_end")
+
+    def getresponse(self, *args, **kwargs):
+        response = super().getresponse(*args, **kwargs)
+        timer = _current_timer.get()
+        if timer is not None:
+            timer.mark("Headers_received")
+        return response
+
+class TimedHTTPConnection(_TimedConnectionMixin, urllib3.connection.HTTPConnection):
+    pass
+
+class TimedHTTPSConnection(_TimedConnectionMixin, urllib3.connection.HTTPSConnection):
+    pass
+
+class TimedHTTPConnectionPool(urllib3.connectionpool.HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(urllib3.connectionpool.HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+def install_timed_pools(adapter):
+    # requests.adapters.HTTPAdapter
+    adapter.poolmanager.pool_classes_by_scheme = {"http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool}